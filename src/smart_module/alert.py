@@ -23,54 +23,489 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import print_function
+import math
+import time
+import datetime
 import logging
+from array import array
+from collections import deque
 import sqlite3
+import threading
 from utilities import SM_LOGGER
+from job_scheduler import Wakeup
+
+class AlertParamsCache(object):
+    """Hold alert_params for every asset in memory.
+
+    The table is read once and kept until invalidate() is called (after a
+    database synchronization) or db_info.data_version is seen to change. The
+    version is checked at most every version_check_interval seconds.
+    """
+
+    field_names = '''
+        lower_threshold
+        upper_threshold
+        message
+        response_type
+    '''.split()
+
+    rule_field_names = '''
+        rule_type
+        rule_window
+        rule_limit
+    '''.split()
+
+    def __init__(self, dbfile="hapi_core.db", version_check_interval=60.0):
+        self.dbfile = dbfile
+        self.version_check_interval = version_check_interval
+        self.params = None
+        self.rules = {}
+        self.data_version = None
+        self.last_version_check = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.params = None
+
+    def read_version(self, database):
+        row = database.cursor().execute("SELECT data_version FROM db_info;").fetchone()
+        return row[0] if row else None
+
+    def load(self):
+        """Read all alert parameters from the database.
+
+        Rows whose rule_type is empty or 'threshold' are the static thresholds;
+        other rows are kept as statistical rules (see Alert.update_rules).
+        Databases without the rule columns only provide thresholds.
+        """
+        logging.getLogger(SM_LOGGER).info("Fetching alert param. from database")
+        params = {}
+        rules = {}
+        database = sqlite3.connect(self.dbfile)
+        try:
+            fields = self.field_names + self.rule_field_names
+            sql = 'SELECT asset_id, {fields} FROM alert_params;'
+            try:
+                rows = database.cursor().execute(sql.format(fields=', '.join(fields))).fetchall()
+            except sqlite3.OperationalError:
+                fields = self.field_names
+                rows = database.cursor().execute(sql.format(fields=', '.join(fields))).fetchall()
+            for row in rows:
+                values = dict(zip(fields, row[1:]))
+                rule_type = (values.pop("rule_type", None) or "threshold").lower()
+                if rule_type == "threshold":
+                    values.pop("rule_window", None)
+                    values.pop("rule_limit", None)
+                    values["lower_threshold"] = float(values["lower_threshold"])
+                    values["upper_threshold"] = float(values["upper_threshold"])
+                    params[str(row[0])] = values
+                else:
+                    values["rule_type"] = rule_type
+                    rules.setdefault(str(row[0]), []).append(values)
+            self.data_version = self.read_version(database)
+        finally:
+            database.close()
+        self.params = params
+        self.rules = rules
+        self.last_version_check = time.time()
+
+    def check_version(self):
+        """Invalidate the cache if db_info.data_version changed."""
+        self.last_version_check = time.time()
+        database = sqlite3.connect(self.dbfile)
+        try:
+            if self.read_version(database) != self.data_version:
+                self.params = None
+        finally:
+            database.close()
+
+    def refresh(self):
+        """Reload the parameters if needed; called with the lock held."""
+        if (self.params is not None
+                and time.time() - self.last_version_check >= self.version_check_interval):
+            self.check_version()
+        if self.params is None:
+            self.load()
+
+    def all(self):
+        """Return {asset_id: parameters} for all assets.
+
+        The same dict is returned until the cache is reloaded.
+        """
+        with self.lock:
+            self.refresh()
+            return self.params
+
+    def get_rules(self, asset_id):
+        """Return the statistical rules of asset_id as a list of dicts."""
+        with self.lock:
+            self.refresh()
+            return self.rules.get(str(asset_id), [])
+
+alert_params_cache = AlertParamsCache()
+
+class SlopeRule(object):
+    """Fire when the least-squares slope over the last 'window' seconds passes 'limit'.
+
+    'limit' is in units per hour: a negative limit fires when the value falls
+    faster than that, a positive one when it rises faster. Running sums are
+    updated as readings enter and leave the window, O(1) amortized. Times are
+    kept relative to an origin that is moved up to the oldest reading once per
+    window, so the sums stay small and exact.
+    """
+
+    def __init__(self, window, limit):
+        self.window = window
+        self.limit = limit
+        self.points = deque()
+        self.origin = None
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+
+    def add(self, value, timestamp):
+        if self.origin is None:
+            self.origin = timestamp
+        t = (timestamp - self.origin) / 3600.0
+        self.points.append((t, value))
+        self.sum_t += t
+        self.sum_v += value
+        self.sum_tt += t * t
+        self.sum_tv += t * value
+        oldest = t - self.window / 3600.0
+        while self.points[0][0] < oldest:
+            t0, v0 = self.points.popleft()
+            self.sum_t -= t0
+            self.sum_v -= v0
+            self.sum_tt -= t0 * t0
+            self.sum_tv -= t0 * v0
+        if self.points[0][0] > self.window / 3600.0:
+            self.rebase()
+
+    def rebase(self):
+        """Move the origin to the oldest reading and recompute the sums."""
+        shift = self.points[0][0]
+        self.origin += shift * 3600.0
+        self.points = deque((t - shift, v) for t, v in self.points)
+        self.sum_t = sum(t for t, _ in self.points)
+        self.sum_v = sum(v for _, v in self.points)
+        self.sum_tt = sum(t * t for t, _ in self.points)
+        self.sum_tv = sum(t * v for t, v in self.points)
+
+    def slope(self):
+        n = len(self.points)
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if n < 3 or denominator <= 0:
+            return None
+        return (n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+    def breached(self, value, timestamp):
+        self.add(value, timestamp)
+        span = (self.points[-1][0] - self.points[0][0]) * 3600.0
+        slope = self.slope()
+        if slope is None or span < self.window / 2.0:
+            return False
+        return slope <= self.limit if self.limit < 0 else slope >= self.limit
+
+class EwmaRule(object):
+    """Fire when a reading is more than 'limit' standard deviations from the EWMA.
+
+    'window' is the EWMA time constant in seconds: a reading dt seconds after
+    the previous one gets the weight 1 - exp(-dt / window), so irregular
+    sampling doesn't skew the average. No alert fires before the readings
+    span 'window' seconds.
+    """
+
+    def __init__(self, window, limit):
+        self.window = window
+        self.limit = limit
+        self.first = None
+        self.last = None
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def breached(self, value, timestamp):
+        if self.first is None:
+            self.first = self.last = timestamp
+            self.mean = value
+            return False
+        elapsed = max(0.0, timestamp - self.last)
+        self.last = max(self.last, timestamp)
+        alpha = 1.0 - math.exp(-elapsed / self.window) if self.window > 0 else 1.0
+        deviation = value - self.mean
+        breached = (timestamp - self.first >= self.window
+                    and abs(deviation) > self.limit * math.sqrt(self.variance))
+        increment = alpha * deviation
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + deviation * increment)
+        return breached
+
+class VarianceRule(object):
+    """Fire when the variance of the readings of the last 'window' seconds exceeds 'limit'.
+
+    Mean and variance use Welford's update, with removal as readings leave
+    the window. No alert fires before the readings span half the window.
+    """
+
+    def __init__(self, window, limit):
+        self.window = window
+        self.limit = limit
+        self.points = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def breached(self, value, timestamp):
+        self.points.append((timestamp, value))
+        delta = value - self.mean
+        self.mean += delta / len(self.points)
+        self.m2 += delta * (value - self.mean)
+        oldest = timestamp - self.window
+        while self.points[0][0] < oldest:
+            _, dropped = self.points.popleft()
+            delta = dropped - self.mean
+            self.mean -= delta / len(self.points)
+            self.m2 = max(0.0, self.m2 - delta * (dropped - self.mean))
+        span = self.points[-1][0] - self.points[0][0]
+        return (len(self.points) >= 2 and span >= self.window / 2.0
+                and self.m2 / len(self.points) > self.limit)
+
+RULE_TYPES = {
+    "slope": SlopeRule,
+    "ewma": EwmaRule,
+    "variance": VarianceRule,
+}
 
 class Alert(object):
-    """Hold Alert information fetched from database and check for alerts."""
+    """Hold the statistical rules of one asset and check readings against them.
+
+    Static thresholds are evaluated for every asset at once by AlertEngine.
+    """
     def __init__(self, asset_id):
-        """Create object with null values."""
         self.alert_id = asset_id
-        self.lower_threshold = 0.0
-        self.upper_threshold = 0.0
-        self.message = ""
-        self.response_type = ""
-
-    def __str__(self):
-        """Use to pass Alert information in JSON."""
-        return str([{"id": self.alert_id,
-                     "lower": self.lower_threshold,
-                     "upper": self.upper_threshold,
-                     "message": self.message,
-                     "response": self.response_type
-                    }])
-
-    def update_alert(self):
-        """Fetch alert parameters from database."""
+        self.rules = []
+        self.rule_params = None
+        self.last_checked = 0.0
+        # Readings of one asset may be handled on several threads at once.
+        self.lock = threading.Lock()
+
+    def update_rules(self):
+        """(Re)build the statistical rules when their parameters change.
+
+        Rules keep their running state between readings, so a cache reload
+        that returns the same parameters keeps the existing rules.
+        """
+        try:
+            rule_params = alert_params_cache.get_rules(self.alert_id)
+            if rule_params == self.rule_params:
+                return
+            self.rule_params = rule_params
+            self.rules = []
+            for params in rule_params:
+                rule_class = RULE_TYPES.get(params["rule_type"])
+                if rule_class is None:
+                    logging.getLogger(SM_LOGGER).error("Unknown alert rule type: %s",
+                                                       params["rule_type"])
+                    continue
+                rule = rule_class(float(params["rule_window"]), float(params["rule_limit"]))
+                self.rules.append([rule, params, False])
+        except Exception, excpt:
+            logging.getLogger(SM_LOGGER).exception("Error building alert rules: %s", excpt)
+
+    def check_rules(self, current_value, timestamp=None):
+        """Feed a reading to every rule.
+
+        Return (asset_id, value, timestamp, message) for each rule that starts
+        to be breached; a rule fires again only after it has cleared. Readings
+        no newer than the last one checked are skipped, so rules see readings
+        in order even when they are handled on several threads.
+        """
+        value = float(current_value)
+        timestamp = timestamp or time.time()
+        fired = []
+        with self.lock:
+            if timestamp <= self.last_checked:
+                return fired
+            self.last_checked = timestamp
+            self.update_rules()
+            for entry in self.rules:
+                rule, params, active = entry
+                breached = rule.breached(value, timestamp)
+                if breached and not active:
+                    fired.append((str(self.alert_id), value, timestamp,
+                                  params["message"] or params["rule_type"]))
+                entry[2] = breached
+        return fired
+
+class AlertEngine(object):
+    """Evaluate the latest reading of every asset against its thresholds in one pass.
+
+    Thresholds and per-asset state are kept in parallel arrays indexed by
+    asset. A breach must persist across readings: an alert fires once every
+    reading for at least 'debounce' seconds (by reading timestamp) has been
+    outside [lower, upper], so a single bad reading never fires on its own.
+    The alert only clears once the reading is back inside the band narrowed
+    on both sides by 'hysteresis' times the band width. After an alert fires,
+    the same asset won't fire again for 'cooldown' seconds.
+
+    Fired alerts are appended to alert_log in hapi_history.db, one transaction
+    per evaluation pass.
+    """
+
+    def __init__(self, params_cache=None, hysteresis=0.05, debounce=30.0, cooldown=900.0,
+                 interval=1.0, dbfile="hapi_history.db"):
+        if not 0.0 <= hysteresis < 0.5:
+            raise ValueError("hysteresis is a fraction of the band width below 0.5.")
+        self.params_cache = params_cache or alert_params_cache
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self.cooldown = cooldown
+        self.interval = interval
+        self.dbfile = dbfile
+        self.params = None
+        self.asset_ids = []
+        self.index = {}
+        self.lower = array('d')
+        self.upper = array('d')
+        self.margin = array('d')
+        self.value = array('d')
+        self.updated = array('d')
+        self.breach_since = array('d')
+        self.active = array('b')
+        self.last_alert = array('d')
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.wakeup = Wakeup()
+        self.thread = None
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self):
+        if self.thread:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="AlertEngine")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def rebuild(self, params):
+        """Lay out thresholds for 'params', keeping the state of known assets."""
+        old = dict((asset_id, i) for i, asset_id in enumerate(self.asset_ids))
+        asset_ids = sorted(params)
+        count = len(asset_ids)
+        lower = array('d', (params[a]["lower_threshold"] for a in asset_ids))
+        upper = array('d', (params[a]["upper_threshold"] for a in asset_ids))
+        margin = array('d', (self.hysteresis * (upper[i] - lower[i]) for i in xrange(count)))
+        value = array('d', [0.0]) * count
+        updated = array('d', [0.0]) * count
+        breach_since = array('d', [0.0]) * count
+        active = array('b', [0]) * count
+        last_alert = array('d', [0.0]) * count
+        for i, asset_id in enumerate(asset_ids):
+            j = old.get(asset_id)
+            if j is not None:
+                value[i] = self.value[j]
+                updated[i] = self.updated[j]
+                breach_since[i] = self.breach_since[j]
+                active[i] = self.active[j]
+                last_alert[i] = self.last_alert[j]
+        self.asset_ids = asset_ids
+        self.index = dict((asset_id, i) for i, asset_id in enumerate(asset_ids))
+        self.lower, self.upper, self.margin = lower, upper, margin
+        self.value, self.updated = value, updated
+        self.breach_since, self.active, self.last_alert = breach_since, active, last_alert
+        self.params = params
+
+    def refresh(self):
+        params = self.params_cache.all()
+        if params is not self.params:
+            self.rebuild(params)
+
+    def update(self, asset_id, value, timestamp=None):
+        """Record a reading of asset_id for the next evaluation.
+
+        Readings no newer than the last one recorded are ignored.
+        """
+        with self.lock:
+            if self.params is None:
+                try:
+                    self.refresh()
+                except Exception, excpt:
+                    self.log.exception("Error fetching alert param. from database: %s", excpt)
+                    return
+            i = self.index.get(str(asset_id))
+            if i is None:
+                return
+            timestamp = timestamp or time.time()
+            if timestamp <= self.updated[i]:
+                return
+            value = float(value)
+            self.value[i] = value
+            self.updated[i] = timestamp
+            if self.lower[i] <= value <= self.upper[i]:
+                self.breach_since[i] = 0.0
+            elif not self.breach_since[i]:
+                self.breach_since[i] = timestamp
+
+    def evaluate(self, now=None):
+        """Run one pass over all assets and return the alerts fired.
+
+        Alerts are (asset_id, value, timestamp, message) tuples.
+        """
+        now = now or time.time()
+        fired = []
+        with self.lock:
+            self.refresh()
+            lower, upper, margin = self.lower, self.upper, self.margin
+            value, updated = self.value, self.updated
+            breach_since, active, last_alert = self.breach_since, self.active, self.last_alert
+            debounce, cooldown = self.debounce, self.cooldown
+            for i in xrange(len(self.asset_ids)):
+                current = value[i]
+                if active[i]:
+                    if lower[i] + margin[i] <= current <= upper[i] - margin[i]:
+                        active[i] = 0
+                    continue
+                if not breach_since[i] or updated[i] - breach_since[i] < debounce:
+                    continue
+                active[i] = 1
+                if last_alert[i] and now - last_alert[i] < cooldown:
+                    continue
+                last_alert[i] = now
+                asset_id = self.asset_ids[i]
+                fired.append((asset_id, current, now, self.params[asset_id]["message"]))
+
+        if fired:
+            self.record(fired)
+        return fired
+
+    def record(self, fired):
+        """Log (asset_id, value, timestamp, message) alerts and append them to
+        alert_log in one transaction."""
+        for asset_id, value, timestamp, message in fired:
+            self.log.warning("Alert detected on asset %s. Value: %s (%s)", asset_id, value,
+                             message)
         try:
-            logging.getLogger(SM_LOGGER).info("Fetching alert param. from database")
-            field_names = '''
-                lower_threshold
-                upper_threshold
-                message
-                response_type
-            '''.split()
-            sql = 'SELECT {fields} FROM alert_params WHERE asset_id={asset};'.format(
-                fields=', '.join(field_names), asset=int(self.alert_id))
-            database = sqlite3.connect("hapi_core.db")
-            row = database.cursor().execute(sql).fetchone()
-            for key, value in zip(field_names, row):
-                setattr(self, key, value)
-            self.lower_threshold = float(self.lower_threshold)
-            self.upper_threshold = float(self.upper_threshold)
+            database = sqlite3.connect(self.dbfile)
+            database.executemany(
+                'INSERT INTO alert_log (asset_id, value, timestamp) VALUES (?, ?, ?);',
+                [(asset_id, value, str(datetime.datetime.fromtimestamp(timestamp)))
+                 for asset_id, value, timestamp, _ in fired])
+            database.commit()
             database.close()
         except Exception, excpt:
-            logging.getLogger(SM_LOGGER).exception("Error fetching alert param. from database: %s",
-                                                   excpt)
-
-    def check_alert(self, current_value):
-        """Check for alert."""
-        if not self.lower_threshold <= float(current_value) <= self.upper_threshold:
-            print("Alert detected.")
-            print("Value: ", current_value)
+            self.log.exception("Error writing alert log: %s", excpt)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.interval)
+            if self.stopped.is_set():
+                break
+            try:
+                self.evaluate()
+            except Exception, excpt:
+                self.log.exception("Error evaluating alerts: %s", excpt)
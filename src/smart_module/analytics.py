@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import json
+import logging
+import sqlite3
+import threading
+from influxdb.exceptions import InfluxDBClientError
+from influxdb.line_protocol import make_lines
+from utilities import SM_LOGGER
+from job_scheduler import Wakeup
+
+# Value of analytics_spool.format for line protocol points. Rows spooled
+# before the format column existed hold JSON point dictionaries.
+LINE_FORMAT = "line"
+
+def rejected(excpt):
+    """Return True if the server refused the points themselves.
+
+    InfluxDB answers 400 for points it can't parse or store (and still writes
+    the valid points of the batch), so resending can never succeed. Other
+    errors (5xx, connection errors, authentication) are worth retrying.
+    """
+    return (isinstance(excpt, InfluxDBClientError) and excpt.code is not None and
+            400 <= int(excpt.code) < 500 and int(excpt.code) not in (401, 403, 404))
+
+class Spool(object):
+    """Keep analytic points on disk while the InfluxDB server can't be reached.
+
+    Points are appended to the analytics_spool table in hapi_history.db and read
+    back oldest first. When the spool grows past max_points the oldest points
+    are dropped. JSON points left by older versions are converted to line
+    protocol when the spool is opened.
+    """
+
+    def __init__(self, dbfile="hapi_history.db", max_points=200000):
+        self.dbfile = dbfile
+        self.max_points = max_points
+        self.log = logging.getLogger(SM_LOGGER)
+        try:
+            database = sqlite3.connect(self.dbfile)
+            database.execute("PRAGMA journal_mode=WAL;")
+            database.execute('''
+                CREATE TABLE IF NOT EXISTS analytics_spool
+                (id INTEGER PRIMARY KEY AUTOINCREMENT, db_name text, point text, format text);
+            ''')
+            self.migrate(database)
+            database.commit()
+            database.close()
+        except Exception, excpt:
+            self.log.exception("Error initializing analytics spool: %s", excpt)
+
+    def migrate(self, database):
+        """Add the format column if needed and convert JSON rows to line protocol."""
+        columns = [row[1] for row in database.execute("PRAGMA table_info(analytics_spool);")]
+        if "format" not in columns:
+            database.execute("ALTER TABLE analytics_spool ADD COLUMN format text;")
+        converted = []
+        dropped = []
+        sql = "SELECT id, point FROM analytics_spool WHERE format IS NULL;"
+        for row_id, point in database.execute(sql).fetchall():
+            try:
+                line = make_lines({"points": [json.loads(point)]}).rstrip("\n")
+                converted.append((line, LINE_FORMAT, row_id))
+            except Exception:
+                dropped.append((row_id,))
+        database.executemany("UPDATE analytics_spool SET point = ?, format = ? WHERE id = ?;",
+                             converted)
+        database.executemany("DELETE FROM analytics_spool WHERE id = ?;", dropped)
+        if converted or dropped:
+            self.log.info("Converted %d spooled JSON points to line protocol, dropped %d.",
+                          len(converted), len(dropped))
+
+    def put(self, database, points):
+        """Append points for 'database' and evict the oldest ones over the cap."""
+        rows = [(database, point, LINE_FORMAT) for point in points]
+        db = sqlite3.connect(self.dbfile)
+        try:
+            db.executemany("INSERT INTO analytics_spool (db_name, point, format) VALUES (?, ?, ?);",
+                           rows)
+            # ids are contiguous: we only ever delete from the oldest end.
+            db.execute('''
+                DELETE FROM analytics_spool
+                WHERE id <= (SELECT max(id) FROM analytics_spool) - ?;
+            ''', (self.max_points,))
+            db.commit()
+        finally:
+            db.close()
+
+    def get(self, limit):
+        """Return (last_id, {database: [points]}) for the 'limit' oldest points."""
+        batches = {}
+        last_id = None
+        db = sqlite3.connect(self.dbfile)
+        try:
+            sql = "SELECT id, db_name, point FROM analytics_spool ORDER BY id LIMIT ?;"
+            for row_id, database, point in db.execute(sql, (limit,)):
+                batches.setdefault(database, []).append(point)
+                last_id = row_id
+        finally:
+            db.close()
+        return last_id, batches
+
+    def remove(self, last_id):
+        """Remove all points up to and including 'last_id'."""
+        db = sqlite3.connect(self.dbfile)
+        try:
+            db.execute("DELETE FROM analytics_spool WHERE id <= ?;", (last_id,))
+            db.commit()
+        finally:
+            db.close()
+
+    def count(self):
+        db = sqlite3.connect(self.dbfile)
+        try:
+            return db.execute("SELECT count(*) FROM analytics_spool;").fetchone()[0]
+        finally:
+            db.close()
+
+class AnalyticsWriter(object):
+    """Buffer analytic points per database and write them to InfluxDB in batches.
+
+    Points are line protocol strings (see line_protocol.PointEncoder).
+
+    Points are kept in memory until a database buffer holds batch_size points
+    or its oldest point is flush_interval seconds old. Each flush is a single
+    write_points call. The list of databases on the server is fetched once
+    and cached, so creating/looking up a database is not repeated per point.
+
+    If a spool is given, points that can't be written are stored in it and
+    replayed in batches of replay_size every replay_interval seconds. Points
+    the server rejects as invalid are dropped rather than spooled.
+    """
+
+    def __init__(self, client, batch_size=500, flush_interval=10.0, spool=None,
+                 replay_size=5000, replay_interval=60.0):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool = spool
+        self.replay_size = replay_size
+        self.replay_interval = replay_interval
+        self.last_replay = 0
+        self.buffers = {}
+        self.oldest = {}
+        self.known_databases = None
+        self.rejected_points = 0
+        self.lock = threading.Lock()
+        self.wakeup = Wakeup()
+        self.running = False
+        self.stopped = False
+        self.thread = None
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self):
+        """Start the background flushing thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="AnalyticsWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread and write whatever is still buffered."""
+        self.running = False
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def write(self, database, points):
+        """Queue a list of points to be written to 'database'."""
+        with self.lock:
+            buf = self.buffers.setdefault(database, [])
+            if not buf:
+                self.oldest[database] = time.time()
+            buf.extend(points)
+            full = len(buf) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def pending(self):
+        """Return the number of buffered points over all databases."""
+        with self.lock:
+            return sum(len(buf) for buf in self.buffers.values())
+
+    def ensure_database(self, database):
+        """Create 'database' on the server unless we already know it exists."""
+        if self.known_databases is None:
+            self.known_databases = set(db["name"] for db in self.client.get_list_database())
+        if database not in self.known_databases:
+            self.client.create_database(database)
+            self.known_databases.add(database)
+
+    def flush(self, force=True):
+        """Write buffered points to the server.
+
+        If force is False, only buffers that are full or old enough are written.
+        """
+        now = time.time()
+        batches = []
+        with self.lock:
+            for database, buf in self.buffers.items():
+                if not buf:
+                    continue
+                if (force or len(buf) >= self.batch_size
+                        or now - self.oldest[database] >= self.flush_interval):
+                    batches.append((database, buf))
+                    self.buffers[database] = []
+
+        for database, points in batches:
+            try:
+                self.ensure_database(database)
+                self.client.write_points(points, database=database, protocol="line")
+                self.log.info("Wrote %d points to analytic database %s", len(points), database)
+            except Exception, excpt:
+                if rejected(excpt):
+                    self.reject(database, points, excpt)
+                    continue
+                # Forget what we know about the server, it may have been reset.
+                self.known_databases = None
+                self.last_replay = time.time()
+                self.log.exception("Error writing to analytic database %s: %s", database, excpt)
+                self.spool_points(database, points)
+
+    def spool_points(self, database, points):
+        if self.spool is None:
+            return
+        try:
+            self.spool.put(database, points)
+            self.log.info("Spooled %d points for analytic database %s", len(points), database)
+        except Exception, excpt:
+            self.log.exception("Error spooling analytic points: %s", excpt)
+
+    def reject(self, database, points, excpt):
+        """Drop points the server refused; see rejected()."""
+        self.rejected_points += len(points)
+        self.log.error("Analytic database %s rejected %d points, dropping them: %s",
+                       database, len(points), excpt)
+
+    def replay(self):
+        """Write spooled points back to the server, oldest first.
+
+        Points the server rejects are dropped. Any other failure stops the
+        replay and leaves the rest for the next attempt.
+        """
+        self.last_replay = time.time()
+        while not self.stopped:
+            last_id, batches = self.spool.get(self.replay_size)
+            if last_id is None:
+                return
+            for database, points in batches.items():
+                try:
+                    self.ensure_database(database)
+                    self.client.write_points(points, database=database, protocol="line")
+                except Exception, excpt:
+                    if not rejected(excpt):
+                        raise
+                    self.reject(database, points, excpt)
+            self.spool.remove(last_id)
+            self.log.info("Replayed spooled points up to %d", last_id)
+
+    def tick(self):
+        """Flush due buffers and replay the spool when it's time to."""
+        try:
+            self.flush(force=False)
+            if self.spool and time.time() - self.last_replay >= self.replay_interval:
+                self.replay()
+        except Exception, excpt:
+            self.known_databases = None
+            self.log.exception("Error in analytics writer: %s", excpt)
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval / 2.0)
+            self.tick()
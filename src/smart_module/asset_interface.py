@@ -21,23 +21,85 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import time
+import logging
 import importlib
-import random
-import asset_wt
+from utilities import SM_LOGGER
+
+class DriverRegistry(object):
+    """Load each asset_<type> driver once and keep a long-lived AssetImpl for it.
+
+    A driver may implement discover() to (re)locate its device. It is called
+    again every rediscover_interval seconds, and after a failed read.
+    """
+
+    def __init__(self, rediscover_interval=300.0):
+        self.rediscover_interval = rediscover_interval
+        self.drivers = {}
+        self.discovered = {}
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def get(self, asset_type):
+        """Return the driver instance for asset_type, creating it if needed."""
+        asset_type = str(asset_type).lower()
+        driver = self.drivers.get(asset_type)
+        if driver is None:
+            module = importlib.import_module("asset_" + asset_type)
+            driver = self.drivers[asset_type] = module.AssetImpl()
+            self.discovered[asset_type] = time.time()
+            self.log.info("Loaded %s asset driver.", asset_type)
+        elif time.time() - self.discovered[asset_type] >= self.rediscover_interval:
+            self.rediscover(asset_type)
+        return driver
+
+    def rediscover(self, asset_type):
+        driver = self.drivers.get(asset_type)
+        self.discovered[asset_type] = time.time()
+        if driver is not None and hasattr(driver, "discover"):
+            driver.discover()
+
+    def read_value(self, asset_type):
+        driver = self.get(asset_type)
+        try:
+            return driver.read_value()
+        except Exception:
+            self.rediscover(str(asset_type).lower())
+            raise
+
+    def read_values(self, asset_type):
+        """Return {probe_id: value} from drivers that support several probes."""
+        driver = self.get(asset_type)
+        try:
+            if hasattr(driver, "read_values"):
+                return driver.read_values()
+            return {str(asset_type).lower(): driver.read_value()}
+        except Exception:
+            self.rediscover(str(asset_type).lower())
+            raise
+
+registry = DriverRegistry()
 
 class AssetInterface(object):
     def __init__(self, asset_type, mock):
-        """Determine the correct asset library and import it."""
+        """Determine the correct asset driver and load it."""
         self.mock = mock
+        self.asset_type = asset_type
         if asset_type.lower() == "mock":
             self.mock = True
+        if self.mock:
+            registry.get("sim")
         else:
-            self.asset_lib = importlib.import_module("asset_" + str(asset_type))
-        # Not sure why we should use it?
-        #eval('from "asset_" + str(asset_type) import AssetImpl')
+            registry.get(asset_type)
 
     def read_value(self):
         if self.mock:
-            return float(random.randrange(8, 34, 1))
+            return float(registry.read_value("sim"))
+
+        return registry.read_value(self.asset_type)
+
+    def read_values(self):
+        """Return {probe_id: value} for every probe of this asset."""
+        if self.mock:
+            return {"mock": self.read_value()}
 
-        return asset_wt.AssetImpl().read_value()
+        return registry.read_values(self.asset_type)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+HAPI Asset Interface for a simulated sensor
+Release: April 2017, Alpha Milestone
+Version: 1.0
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import print_function
+import os
+import math
+import time
+import random
+
+SECONDS_PER_DAY = 86400
+
+class AssetImpl(object):
+    '''Generate a realistic sensor signal.
+
+    value = base + amplitude * diurnal curve + drift + step faults + noise
+
+    The diurnal curve peaks at 15:00. Every read may start a step fault
+    (with probability step_rate, lasting step_duration seconds) or fail like a
+    dropped-out probe (with probability dropout_rate, raising IOError).
+
+    If 'rate' is given, simulated time starts at 'start' and advances 1/rate
+    seconds per read, so hours of signal can be generated in seconds.
+    Otherwise the wall clock is used. Runs are reproducible for a given seed,
+    which defaults to the HAPI_SIM_SEED environment variable.
+    '''
+
+    def __init__(self, base=22.0, amplitude=4.0, noise=0.15, drift=0.0,
+                 step_rate=0.0, step_size=5.0, step_duration=600.0,
+                 dropout_rate=0.0, seed=None, rate=None, start=None):
+        self.base = base
+        self.amplitude = amplitude
+        self.noise = noise
+        self.drift = drift
+        self.step_rate = step_rate
+        self.step_size = step_size
+        self.step_duration = step_duration
+        self.dropout_rate = dropout_rate
+        self.rate = rate
+        if seed is None:
+            seed = os.environ.get("HAPI_SIM_SEED")
+        self.random = random.Random(seed)
+        self.start = start if start is not None else time.time()
+        self.reads = 0
+        self.step_until = 0
+        self.step_offset = 0.0
+
+    def discover(self):
+        pass
+
+    def now(self):
+        if self.rate:
+            return self.start + self.reads / float(self.rate)
+        return time.time()
+
+    def value_at(self, timestamp):
+        '''Return the noiseless signal at 'timestamp'.'''
+        local = time.localtime(timestamp)
+        seconds = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec
+        phase = 2 * math.pi * (seconds - 9 * 3600) / SECONDS_PER_DAY
+        hours = (timestamp - self.start) / 3600.0
+        return self.base + self.amplitude * math.sin(phase) + self.drift * hours
+
+    def read_value(self):
+        timestamp = self.now()
+        self.reads += 1
+        if self.random.random() < self.dropout_rate:
+            raise IOError("Simulated sensor dropout.")
+
+        if timestamp >= self.step_until:
+            self.step_offset = 0.0
+            if self.random.random() < self.step_rate:
+                self.step_until = timestamp + self.step_duration
+                self.step_offset = self.random.choice((-1, 1)) * self.step_size
+
+        value = self.value_at(timestamp) + self.step_offset
+        return round(value + self.random.gauss(0, self.noise), 3)
@@ -27,45 +27,101 @@ import os
 import glob
 import time
 import logging
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from utilities import SM_LOGGER
 
+CRC_RETRIES = 5
+CRC_RETRY_DELAY = 0.2
+
 class AssetImpl(object):
-    def __init__(self):
+    """Read every DS18B20 probe on the 1-Wire bus.
+
+    Probes are read concurrently on a small thread pool, so the conversion
+    waits of a 6-10 probe reservoir overlap instead of adding up. A read
+    gives up on probes that haven't answered within read_timeout seconds.
+    """
+
+    base_dir = '/sys/bus/w1/devices'
+
+    def __init__(self, workers=4, read_timeout=5.0):
+        self.workers = workers
+        self.read_timeout = read_timeout
+        self.device_paths = {}
+        self.pool = None
+        self.discover()
+
+    def discover(self):
+        """Locate all DS18B20 probes on the 1-Wire bus."""
         try:
             # Let's put it as a config/dep on the image and modprobe'd on boot
             #os.system('modprobe w1-gpio')
             #os.system('modprobe w1-therm')
-            base_dir = '/sys/bus/w1/devices'
-            device_dir = glob.glob(os.path.join(base_dir, '28*'))[0]
-            self.device_path = os.path.join(device_dir, 'w1_slave')
-            print('Device file:', self.device_path)
+            device_paths = dict(
+                (os.path.basename(device_dir), os.path.join(device_dir, 'w1_slave'))
+                for device_dir in glob.glob(os.path.join(self.base_dir, '28*')))
+            if not device_paths:
+                raise IOError("No DS18B20 probe found in " + self.base_dir)
+            if device_paths != self.device_paths:
+                self.device_paths = device_paths
+                logging.getLogger(SM_LOGGER).info("Found probes: %s", sorted(device_paths))
         except Exception, excpt:
             logging.getLogger(SM_LOGGER).exception("Error initializing sensor interface: %s", excpt)
 
-    def read_temp_raw(self):
-        try:
-            lines = ""
-            with open(self.device_path, "r") as tempfile:
-                for line in tempfile:
-                    lines = lines + line.decode("utf-8")
-            return lines.split("\n")
-        except Exception, excpt:
-            logging.getLogger(SM_LOGGER).exception("Error reading raw temperature data: %s", excpt)
+    @staticmethod
+    def read_temp_raw(device_path):
+        lines = ""
+        with open(device_path, "r") as tempfile:
+            for line in tempfile:
+                lines = lines + line.decode("utf-8")
+        return lines.split("\n")
 
-    def read_value(self):
-        temp_c = -50
-        try:
-            lines = self.read_temp_raw()
-            while not lines[0].strip().endswith('YES'):
-                time.sleep(0.2)
-                lines = self.read_temp_raw()
+    def read_probe(self, probe_id):
+        """Return the temperature in C of one probe, retrying bad CRCs a few times."""
+        device_path = self.device_paths[probe_id]
+        lines = self.read_temp_raw(device_path)
+        retries = 0
+        while not lines[0].strip().endswith('YES'):
+            retries += 1
+            if retries > CRC_RETRIES:
+                raise IOError("CRC check failed on probe " + probe_id)
+            time.sleep(CRC_RETRY_DELAY)
+            lines = self.read_temp_raw(device_path)
 
-            equals_pos = lines[1].find('t=')
-            if equals_pos != -1:
-                temp_string = lines[1][equals_pos+2:]
-                temp_c = float(temp_string) / 1000.0
+        equals_pos = lines[1].find('t=')
+        if equals_pos == -1:
+            raise IOError("No temperature reported by probe " + probe_id)
+        return float(lines[1][equals_pos+2:]) / 1000.0
 
-        except Exception, excpt:
-            logging.getLogger(SM_LOGGER).exception("Error getting converted sensor data: %s", excpt)
+    def read_values(self):
+        """Return {probe_id: temperature in C} for every probe that could be read."""
+        probe_ids = sorted(self.device_paths)
+        if not probe_ids:
+            raise IOError("No DS18B20 probe available.")
+        if len(probe_ids) == 1:
+            return {probe_ids[0]: self.read_probe(probe_ids[0])}
+
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        pending = [(probe_id, self.pool.apply_async(self.read_probe, (probe_id,)))
+                   for probe_id in probe_ids]
+        deadline = time.time() + self.read_timeout
+        values = {}
+        for probe_id, result in pending:
+            try:
+                values[probe_id] = result.get(max(0.0, deadline - time.time()))
+            except TimeoutError:
+                logging.getLogger(SM_LOGGER).error("Probe %s did not answer within %.1f s.",
+                                                   probe_id, self.read_timeout)
+            except Exception, excpt:
+                logging.getLogger(SM_LOGGER).error("Error reading probe %s: %s", probe_id, excpt)
+        if not values:
+            raise IOError("No DS18B20 probe could be read.")
+        if len(values) < len(probe_ids):
+            self.discover()
+        return values
 
-        return temp_c
+    def read_value(self):
+        """Return the temperature in C of the first probe that could be read."""
+        values = self.read_values()
+        return values[min(values)]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Registry of the commands a scheduled job may run.
+
+A job's command is parsed once, when the schedule is loaded, into a bound
+callable. Commands look like a function call with literal arguments:
+
+    get_weather()
+    log_data
+    send_command("doc0220")
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import re
+import ast
+import inspect
+
+COMMAND_PATTERN = re.compile(r"^\s*([A-Za-z_]\w*)\s*(?:\((.*)\))?\s*$", re.DOTALL)
+TOPIC_WILDCARDS = ("+", "#")
+
+class CommandError(ValueError):
+    """A command that can't be parsed or doesn't match a registered command."""
+
+class Command(object):
+    """A registered command bound to its arguments."""
+    def __init__(self, name, func, args):
+        self.name = name
+        self.func = func
+        self.args = args
+
+    def __call__(self):
+        return self.func(*self.args)
+
+    def __repr__(self):
+        return "%s%r" % (self.name, self.args)
+
+def parse(text):
+    """Split a command into its name and a tuple of literal arguments."""
+    match = COMMAND_PATTERN.match(text or "")
+    if not match:
+        raise CommandError("Malformed command: %r" % (text,))
+    name, arguments = match.groups()
+    if not arguments or not arguments.strip():
+        return name, ()
+    try:
+        args = ast.literal_eval("(%s,)" % arguments)
+    except (SyntaxError, ValueError):
+        raise CommandError("Arguments of %r must be literals." % (text,))
+    return name, args
+
+def check_topic(topic):
+    """Raise CommandError if 'topic' can't be published to (empty or with wildcards)."""
+    topic = str(topic)
+    if not topic or any(wildcard in topic for wildcard in TOPIC_WILDCARDS):
+        raise CommandError("Can't publish to topic %r." % (topic,))
+    return topic
+
+def arity(func):
+    """Return the (minimum, maximum) number of positional arguments of func."""
+    spec = inspect.getargspec(func)
+    args = spec.args[1:] if inspect.ismethod(func) else spec.args
+    maximum = None if spec.varargs else len(args)
+    return len(args) - len(spec.defaults or ()), maximum
+
+class CommandRegistry(object):
+    def __init__(self):
+        self.commands = {}
+
+    def register(self, name, func, check=None):
+        """Register func as command 'name'.
+
+        check(*args), if given, validates a command's arguments when it is
+        compiled and raises CommandError for bad ones.
+        """
+        self.commands[name] = (func, arity(func), check)
+
+    def names(self):
+        return sorted(self.commands)
+
+    def compile(self, text):
+        """Return a Command for 'text', checking the name and arguments."""
+        return self.bind(*parse(text))
+
+    def bind(self, name, args):
+        """Return registered command 'name' bound to 'args', checking the arguments."""
+        if name not in self.commands:
+            raise CommandError("Unknown command %r (known: %s)." % (
+                name, ", ".join(self.names())))
+        func, (minimum, maximum), check = self.commands[name]
+        if len(args) < minimum or (maximum is not None and len(args) > maximum):
+            if maximum is None:
+                expected = "at least %d" % minimum
+            elif minimum == maximum:
+                expected = str(minimum)
+            else:
+                expected = "%d to %d" % (minimum, maximum)
+            raise CommandError("%s takes %s argument(s), got %d." % (name, expected, len(args)))
+        if check is not None:
+            check(*args)
+        return Command(name, func, args)
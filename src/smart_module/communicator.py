@@ -24,15 +24,34 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
 import datetime
+import json
 import logging
+import threading
 import paho.mqtt.client as mqtt
+import payload
+from dispatcher import TopicDispatcher
+from publisher import Publisher
+from worker_pool import WorkerPool, BACKLOG, DROP_OLDEST, REJECT
 from utilities import SM_LOGGER
 
+# Topics whose messages must not be lost; everything else is published at QoS 0.
+TOPIC_QOS = (
+    ("ASSET/RESPONSE/+", 1),
+    ("MODULE/BATCH/+", 1),
+    ("HISTORY/RESPONSE/+", 1),
+    ("COMMAND/#", 1),
+    ("SCHEDULER/RESPONSE", 1),
+    ("SYNCHRONIZE/DATA", 1),
+    ("SYNCHRONIZE/RESPONSE", 1),
+)
+
 class Communicator(object):
-    def __init__(self, sm):
+    def __init__(self, sm, workers=4, max_queue=256, pool=None):
         self.rtuid = ""
         self.name = ""
-        self.broker_name = "mqttbroker.local"
+        # The broker the discovery script hosts; broker_name is the one in use.
+        self.default_broker = "mqttbroker.local"
+        self.broker_name = self.default_broker
         self.fallback_broker = ""
         self.influx_address = ""
         self.start_uptime = datetime.datetime.now()
@@ -43,20 +62,42 @@ class Communicator(object):
         self.smart_module = sm
         self.is_connected = False
         self.scheduler_found = False
+        self.scheduler_name = ""
+        # Set on CONNACK and on a SCHEDULER/RESPONSE so discovery need not poll.
+        self.connected = threading.Event()
+        self.scheduler_located = threading.Event()
         self.broker_connections = -1
         self.logger = logging.getLogger(SM_LOGGER)
+        self.dispatcher = TopicDispatcher()
+        self.register_handlers()
+        # Handlers run here rather than on paho's network thread.
+        self.pool = pool
+        if self.pool is None:
+            self.pool = WorkerPool(workers=workers, max_queue=max_queue, name="Handler")
+            self.pool.start()
+        self.publisher = Publisher(self.client, topic_qos=TOPIC_QOS)
+        if pool is None:
+            self.publisher.start()
         self.logger.info("Communicator initialized")
 
-    def connect(self):
+    def connect(self, broker=None):
+        """Connect to 'broker' (default broker_name). Return False on error."""
+        broker = broker or self.broker_name
         try:
-            self.logger.info("Connecting to " + self.broker_name)
-            self.client.connect(host=self.broker_name, port=1883, keepalive=60)
+            self.logger.info("Connecting to " + broker)
+            self.client.connect(host=broker, port=1883, keepalive=60)
+            self.broker_name = broker
+            return True
         except Exception, excpt:
             self.logger.exception("Error connecting to broker. %s", excpt)
+            return False
 
     def on_disconnect(self, client, userdata, rc):
         print(mqtt.error_string(rc))
         self.logger.info("Disconnected")
+        self.is_connected = False
+        self.connected.clear()
+        self.publisher.on_disconnect()
 
     # The callback for when the client receives a CONNACK response from the server.
     #@staticmethod
@@ -75,6 +116,11 @@ class Communicator(object):
         self.client.subscribe("SYNCHRONIZE/GET", qos=0)
         self.client.subscribe("ASSET/QUERY" + "/#")
         self.client.subscribe("STATUS/QUERY")
+        self.client.subscribe("HISTORY/QUERY" + "/#")
+        self.client.subscribe("METRICS/QUERY")
+        if rc == mqtt.CONNACK_ACCEPTED:
+            self.publisher.on_connect()
+            self.connected.set()
 
     def subscribe(self, topic):
         self.client.subscribe(topic)
@@ -82,62 +128,126 @@ class Communicator(object):
     def unsubscribe(self, topic):
         self.client.unsubscribe(topic)
 
-    # The callback when a message is received
-    def on_message(self, client, userdata, msg):
-        print(msg.topic, msg.payload)
-        if "ENV/QUERY" in msg.topic:
-            self.smart_module.get_env(msg.payload)
-
-        elif "ASSET/QUERY" in msg.topic:
-            self.send("ASSET/RESPONSE/" + self.smart_module.asset.id,
-                      self.smart_module.get_asset_data())
-
-        elif "ASSET/RESPONSE" in msg.topic:
-            if self.smart_module.asset.id == msg.topic.split("/")[2]:
-                value = msg.payload
-                self.smart_module.asset.alert.update_alert()
-                self.smart_module.asset.alert.check_alert(value)
-                self.smart_module.push_data(self.smart_module.asset.name,
-                                            self.smart_module.asset.context,
-                                            value, self.smart_module.asset.unit)
-
-        elif "STATUS/QUERY" in msg.topic:
-            self.smart_module.last_status = self.smart_module.get_status(self.broker_connections)
-            self.send("STATUS/RESPONSE", str(self.smart_module.last_status))
-
-        elif "STATUS/RESPONSE" in msg.topic:
-            self.smart_module.push_sysinfo("system", self.smart_module.last_status)
-
+    def register_handlers(self):
+        """Map topic filters to their handlers and worker pool overflow policies."""
+        register = self.dispatcher.register
+        register("ENV/QUERY/#", self.on_env_query, policy=DROP_OLDEST)
+        register("ASSET/QUERY/#", self.on_asset_query, policy=DROP_OLDEST)
+        register("ASSET/RESPONSE/+", self.on_asset_response, policy=BACKLOG)
+        register("MODULE/BATCH/+", self.on_module_batch, policy=BACKLOG)
+        register("HISTORY/QUERY/+", self.on_history_query, policy=REJECT)
+        register("STATUS/QUERY", self.on_status_query, policy=DROP_OLDEST)
+        register("STATUS/RESPONSE", self.on_status_response, policy=DROP_OLDEST)
+        register("METRICS/QUERY", self.on_metrics_query, policy=REJECT)
         # Scheduler messages
-        elif "SCHEDULER/RESPONSE" in msg.topic:
-            self.scheduler_found = True
-            self.logger.info(msg.payload + " has identified itself as the Scheduler.")
-
-        elif "SCHEDULER/QUERY" in msg.topic:
-            if self.smart_module.scheduler:
-                self.send("SCHEDULER/RESPONSE", self.smart_module.hostname)
-                self.logger.info("Sent SCHEDULER/RESPONSE")
-
+        register("SCHEDULER/RESPONSE", self.on_scheduler_response, policy=BACKLOG)
+        register("SCHEDULER/QUERY", self.on_scheduler_query, policy=BACKLOG)
+        register("SEQUENCE/CANCEL/+", self.on_sequence_cancel, policy=BACKLOG)
+        register("COMMAND/ACK/+", self.on_command_ack, policy=BACKLOG)
         # Database synchronization messages
-        elif "SYNCHRONIZE/VERSION" in msg.topic:
-            self.send("SYNCHRONIZE/RESPONSE", self.smart_module.data_sync.read_db_version())
-
-        elif "SYNCHRONIZE/GET" in msg.topic:
-            if msg.payload == self.smart_module.hostname:
-                self.smart_module.data_sync.publish_core_db(self)
+        register("SYNCHRONIZE/VERSION", self.on_synchronize_version, policy=DROP_OLDEST)
+        register("SYNCHRONIZE/GET", self.on_synchronize_get, policy=BACKLOG)
+        register("SYNCHRONIZE/DATA/#", self.on_synchronize_data, policy=BACKLOG)
+        register("$SYS/broker/clients/total", self.on_clients_total, policy=DROP_OLDEST)
 
-        elif "SYNCHRONIZE/DATA" in msg.topic:
-            self.smart_module.data_sync.synchronize_core_db(msg.payload)
-
-        elif "$SYS/broker/clients/total" in msg.topic:
-            self.broker_connections = int(msg.payload)
-
-        # elif "SYNCHRONIZE/TEST" in msg.topic:
-        #     self.send("SYNCHRONIZE/RESPONSE", self.smart_module.data_sync.read_db_version())
-
-    def send(self, topic, message):
-        try:
-            if self.client:
-                self.client.publish(topic, message)
-        except Exception, excpt:
-            self.logger.info("Error publishing message: %s", excpt)
+    # The callback when a message is received
+    def on_message(self, client, userdata, msg):
+        self.logger.debug("Received %s: %s", msg.topic, msg.payload)
+        handlers = self.dispatcher.match(msg.topic)
+        for handler in handlers:
+            if not self.pool.submit(self.dispatcher.run, (handler, msg), handler.policy,
+                                    (handler.name, msg.topic)):
+                self.logger.warning("Handler queue full, rejected %s for %s",
+                                    msg.topic, handler.name)
+
+    def on_metrics_query(self, msg):
+        metrics = {
+            "queue": self.pool.metrics(),
+            "handlers": self.dispatcher.stats(),
+            "publish": self.publisher.metrics(),
+        }
+        if self.smart_module.scheduler:
+            metrics["jobs"] = self.smart_module.scheduler.executor.metrics()
+        self.send("METRICS/RESPONSE", json.dumps(metrics))
+
+    def on_env_query(self, msg):
+        self.smart_module.get_env()
+
+    def on_asset_query(self, msg):
+        fmt = payload.requested_format(msg.payload)
+        if fmt == payload.LEGACY:
+            data = self.smart_module.get_asset_data()
+        else:
+            data = payload.encode_reading(self.smart_module.get_reading(), fmt,
+                                          trend=self.smart_module.asset.readings.trend())
+        self.send("ASSET/RESPONSE/" + self.smart_module.asset.id, data)
+
+    def on_asset_response(self, msg):
+        asset = self.smart_module.asset
+        if asset.id == msg.topic.split("/")[2]:
+            reading = payload.decode_reading(msg.payload, asset_id=asset.id, unit=asset.unit)
+            if reading.quality == payload.FAILED:
+                self.logger.warning("Asset %s failed to read its sensor.", asset.id)
+                return
+            value = reading.value
+            self.smart_module.alert_engine.update(asset.id, value, reading.timestamp)
+            fired = asset.alert.check_rules(value, reading.timestamp)
+            if fired:
+                self.smart_module.alert_engine.record(fired)
+            self.smart_module.push_data(asset.name, asset.context, value, asset.unit)
+
+    def on_module_batch(self, msg):
+        self.smart_module.store_batch(payload.decode_batch(msg.payload))
+
+    def on_history_query(self, msg):
+        self.smart_module.send_history(msg.topic.split("/")[2], msg.payload)
+
+    def on_status_query(self, msg):
+        self.smart_module.last_status = self.smart_module.get_status(self.broker_connections)
+        self.send("STATUS/RESPONSE", payload.encode_status(self.smart_module.last_status,
+                                                           payload.requested_format(msg.payload)))
+
+    def on_status_response(self, msg):
+        # Legacy payloads can't be parsed; fall back to our own status as before.
+        status = payload.decode_status(msg.payload) or self.smart_module.last_status
+        self.smart_module.push_sysinfo("system", status)
+
+    def on_scheduler_response(self, msg):
+        self.scheduler_found = True
+        self.scheduler_name = msg.payload
+        self.scheduler_located.set()
+        self.logger.info(msg.payload + " has identified itself as the Scheduler.")
+
+    def on_scheduler_query(self, msg):
+        if self.smart_module.scheduler:
+            self.send("SCHEDULER/RESPONSE", self.smart_module.hostname)
+            self.logger.info("Sent SCHEDULER/RESPONSE")
+
+    def on_sequence_cancel(self, msg):
+        if self.smart_module.scheduler:
+            self.smart_module.scheduler.sequences.cancel(msg.topic.split("/")[2])
+
+    def on_command_ack(self, msg):
+        if self.smart_module.scheduler:
+            self.smart_module.scheduler.sequences.acknowledge(msg.topic.split("/")[2],
+                                                              msg.payload)
+
+    def on_synchronize_version(self, msg):
+        self.send("SYNCHRONIZE/RESPONSE", self.smart_module.data_sync.read_db_version())
+
+    def on_synchronize_get(self, msg):
+        if msg.payload == self.smart_module.hostname:
+            self.smart_module.data_sync.publish_core_db(self)
+
+    def on_synchronize_data(self, msg):
+        synchronized = self.smart_module.data_sync.synchronize_core_db(msg.payload)
+        if synchronized and self.smart_module.scheduler:
+            self.smart_module.scheduler.reload_schedule()
+
+    def on_clients_total(self, msg):
+        self.broker_connections = int(msg.payload)
+
+    def send(self, topic, message, qos=None):
+        """Queue a message for publishing; it is sent now if the client has room."""
+        self.publisher.put(topic, message, qos)
+        self.publisher.flush()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Discovery helpers: the last known broker/scheduler cache and startup timings.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import json
+import time
+import logging
+from utilities import SM_LOGGER
+
+class DiscoveryCache(object):
+    """Remember the broker and scheduler found at the last startup."""
+
+    def __init__(self, path="hapi_discovery.json"):
+        self.path = path
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def load(self):
+        """Return {"broker": ..., "scheduler": ...}; empty if nothing is cached."""
+        try:
+            with open(self.path) as cache:
+                return json.load(cache)
+        except IOError:
+            return {}
+        except ValueError, excpt:
+            self.log.warning("Ignoring corrupt discovery cache %s: %s", self.path, excpt)
+            return {}
+
+    def save(self, broker, scheduler):
+        try:
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as cache:
+                json.dump({"broker": broker, "scheduler": scheduler, "time": time.time()}, cache)
+            os.rename(temporary, self.path)
+        except (IOError, OSError), excpt:
+            self.log.warning("Could not write discovery cache %s: %s", self.path, excpt)
+
+class PhaseTimer(object):
+    """Time consecutive startup phases."""
+
+    def __init__(self):
+        self.started = self.last = time.time()
+        self.phases = []
+
+    def mark(self, phase):
+        """End the current phase, naming it 'phase'."""
+        now = time.time()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        parts = ["%s %.2fs" % (phase, seconds) for phase, seconds in self.phases]
+        parts.append("total %.2fs" % (self.last - self.started))
+        return ", ".join(parts)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Route MQTT messages to handlers through a trie of topic filters.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import logging
+import threading
+from worker_pool import BACKLOG
+from utilities import SM_LOGGER
+
+class Handler(object):
+    """A registered handler, its worker pool overflow policy and its counters."""
+    def __init__(self, topic_filter, callback, name, policy):
+        self.topic_filter = topic_filter
+        self.callback = callback
+        self.name = name
+        self.policy = policy
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+class TopicNode(object):
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+class TopicDispatcher(object):
+    """Match topics against registered MQTT topic filters ('+' and '#' wildcards).
+
+    Filters are split into levels and stored in a trie, so matching a topic
+    costs one dictionary lookup per level whatever the number of filters.
+    Results are cached per topic until the next registration.
+    """
+
+    max_cache = 1024
+
+    def __init__(self):
+        self.root = TopicNode()
+        self.handlers = []
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def register(self, topic_filter, callback, name=None, policy=BACKLOG):
+        """Call callback(msg) for every message whose topic matches topic_filter.
+
+        policy is the worker_pool overflow policy used when handlers are
+        queued on a WorkerPool.
+        """
+        levels = topic_filter.split("/")
+        if "#" in levels[:-1]:
+            raise ValueError("'#' must be the last level of a topic filter: " + topic_filter)
+        node = self.root
+        with self.lock:
+            for level in levels:
+                node = node.children.setdefault(level, TopicNode())
+            handler = Handler(topic_filter, callback, name or callback.__name__, policy)
+            node.handlers.append(handler)
+            self.handlers.append(handler)
+            self.cache = {}
+        return handler
+
+    def match(self, topic):
+        """Return the handlers whose filter matches topic."""
+        handlers = self.cache.get(topic)
+        if handlers is not None:
+            return handlers
+
+        levels = topic.split("/")
+        handlers = []
+        self.walk(self.root, levels, 0, handlers, topic.startswith("$"))
+        with self.lock:
+            if len(self.cache) >= self.max_cache:
+                self.cache = {}
+            self.cache[topic] = handlers
+        return handlers
+
+    def walk(self, node, levels, depth, handlers, system):
+        # Wildcards don't match the first level of '$' topics.
+        wildcards = not (system and depth == 0)
+        if wildcards:
+            multi = node.children.get("#")
+            if multi is not None:
+                handlers.extend(multi.handlers)
+        if depth == len(levels):
+            handlers.extend(node.handlers)
+            return
+        child = node.children.get(levels[depth])
+        if child is not None:
+            self.walk(child, levels, depth + 1, handlers, system)
+        if wildcards:
+            single = node.children.get("+")
+            if single is not None:
+                self.walk(single, levels, depth + 1, handlers, system)
+
+    def dispatch(self, msg):
+        """Run every handler matching msg.topic. Return the number of handlers run."""
+        handlers = self.match(msg.topic)
+        if not handlers:
+            self.log.debug("No handler for %s", msg.topic)
+        for handler in handlers:
+            self.run(handler, msg)
+        return len(handlers)
+
+    def run(self, handler, msg):
+        """Run a single handler on msg and update its counters."""
+        started = time.time()
+        failed = False
+        try:
+            handler.callback(msg)
+        except Exception, excpt:
+            failed = True
+            self.log.exception("Error handling %s in %s: %s", msg.topic, handler.name, excpt)
+        # Handlers run on several worker threads at once.
+        with self.lock:
+            handler.calls += 1
+            handler.errors += failed
+            handler.seconds += time.time() - started
+
+    def stats(self):
+        """Return the counters of every handler."""
+        with self.lock:
+            return [{"filter": h.topic_filter, "name": h.name, "policy": h.policy,
+                     "calls": h.calls, "errors": h.errors, "seconds": h.seconds}
+                    for h in self.handlers]
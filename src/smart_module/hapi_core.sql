@@ -1,6 +1,10 @@
 CREATE TABLE site (id int PRIMARY KEY NOT NULL, name text, wunder_key text, operator text, email text, phone text, location text, longitude text, latitude text, twilio_acct_sid text, twilio_auth_token text);
 CREATE TABLE assets (id int PRIMARY KEY NOT NULL, name text, unit text, virtual int, context text, system text, enabled int, data_field text);
-CREATE TABLE schedule(id int PRIMARY KEY NOT NULL, name TEXT, asset_id int, command TEXT, time_unit TEXT, interval INT, at_time TEXT, enabled INT, sequence text, virtual int);
+CREATE TABLE schedule(id int PRIMARY KEY NOT NULL, name TEXT, asset_id int, command TEXT, time_unit TEXT, interval INT, at_time TEXT, enabled INT, sequence text, virtual int, timeout real, overlap text);
 CREATE TABLE sequence (id int PRIMARY KEY NOT NULL, name TEXT, command TEXT, step INT, step_name TEXT, timeout INT);
-CREATE TABLE alert_params (asset_id int, lower_threshold real, upper_threshold real, message text, response_type text);
+-- alert_params: rows with an empty rule_type (or 'threshold') use lower/upper_threshold.
+-- Rows with rule_type 'slope', 'ewma' or 'variance' are statistical rules; their
+-- rule_window is in seconds for every rule type, and rule_limit is in units per hour
+-- (slope), standard deviations (ewma) or squared units (variance).
+CREATE TABLE alert_params (asset_id int, lower_threshold real, upper_threshold real, message text, response_type text, rule_type text, rule_window real, rule_limit real);
 CREATE TABLE db_info (schema_version text, data_version text);
@@ -1,2 +1,5 @@
 CREATE TABLE sensor_data (asset_id int, timestamp text, unit text, value float);
+CREATE INDEX sensor_data_asset_timestamp ON sensor_data (asset_id, timestamp);
+CREATE TABLE sensor_rollup (asset_id int, resolution int, bucket int, unit text, min real, max real, sum real, count int, PRIMARY KEY (asset_id, resolution, bucket));
 CREATE TABLE alert_log (asset_id int, value real, timestamp text);
+CREATE TABLE analytics_spool (id INTEGER PRIMARY KEY AUTOINCREMENT, db_name text, point text, format text);
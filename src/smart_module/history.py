@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Local time-series store for sensor readings in hapi_history.db.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import datetime
+import logging
+import sqlite3
+import threading
+from utilities import SM_LOGGER
+
+SECONDS_PER_MINUTE = 60
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+
+# Rollup resolution (seconds) -> how long its buckets are kept (seconds, None = forever).
+ROLLUPS = (
+    (SECONDS_PER_MINUTE, 14 * SECONDS_PER_DAY),
+    (SECONDS_PER_HOUR, 400 * SECONDS_PER_DAY),
+    (SECONDS_PER_DAY, None),
+)
+
+def format_timestamp(timestamp):
+    """Return the sensor_data text representation of a Unix timestamp."""
+    return str(datetime.datetime.fromtimestamp(timestamp))
+
+def parse_timestamp(text):
+    """Return the Unix timestamp of a sensor_data timestamp."""
+    fmt = "%Y-%m-%d %H:%M:%S.%f" if "." in text else "%Y-%m-%d %H:%M:%S"
+    moment = datetime.datetime.strptime(text, fmt)
+    return time.mktime(moment.timetuple()) + moment.microsecond / 1000000.0
+
+class SensorHistory(object):
+    """Store raw readings in sensor_data and keep min/max/sum/count rollups.
+
+    Rollups live in sensor_rollup, one row per (asset, resolution, bucket) and
+    are updated as readings arrive. Raw readings older than raw_retention
+    seconds and rollups older than their ROLLUPS retention are deleted at most
+    every expire_interval seconds.
+    """
+
+    def __init__(self, dbfile="hapi_history.db", raw_retention=2 * SECONDS_PER_DAY,
+                 expire_interval=SECONDS_PER_HOUR):
+        self.dbfile = dbfile
+        self.raw_retention = raw_retention
+        self.expire_interval = expire_interval
+        self.last_expire = 0
+        self.lock = threading.Lock()
+        self.log = logging.getLogger(SM_LOGGER)
+        try:
+            database = sqlite3.connect(self.dbfile)
+            database.executescript('''
+                CREATE TABLE IF NOT EXISTS sensor_data
+                    (asset_id int, timestamp text, unit text, value float);
+                CREATE INDEX IF NOT EXISTS sensor_data_asset_timestamp
+                    ON sensor_data (asset_id, timestamp);
+                CREATE TABLE IF NOT EXISTS sensor_rollup
+                    (asset_id int, resolution int, bucket int, unit text,
+                     min real, max real, sum real, count int,
+                     PRIMARY KEY (asset_id, resolution, bucket));
+            ''')
+            database.commit()
+            database.close()
+        except Exception, excpt:
+            self.log.exception("Error initializing sensor history: %s", excpt)
+
+    def record(self, asset_id, value, unit, timestamp=None):
+        """Store a single reading. timestamp defaults to now."""
+        self.record_many([(asset_id, value, unit, timestamp)])
+
+    def record_many(self, readings):
+        """Store (asset_id, value, unit, timestamp) readings in one transaction."""
+        now = time.time()
+        raw = []
+        for asset_id, value, unit, timestamp in readings:
+            raw.append((asset_id, timestamp or now, unit, float(value)))
+
+        with self.lock:
+            database = sqlite3.connect(self.dbfile)
+            try:
+                cursor = database.cursor()
+                cursor.executemany(
+                    'INSERT INTO sensor_data (asset_id, timestamp, unit, value) '
+                    'VALUES (?, ?, ?, ?);',
+                    [(asset_id, format_timestamp(timestamp), unit, value)
+                     for asset_id, timestamp, unit, value in raw])
+                for asset_id, timestamp, unit, value in raw:
+                    for resolution, _ in ROLLUPS:
+                        bucket = int(timestamp // resolution) * resolution
+                        # Works on old SQLite versions without UPSERT.
+                        cursor.execute('''
+                            INSERT OR IGNORE INTO sensor_rollup
+                            (asset_id, resolution, bucket, unit, min, max, sum, count)
+                            VALUES (?, ?, ?, ?, ?, ?, 0, 0);
+                        ''', (asset_id, resolution, bucket, unit, value, value))
+                        cursor.execute('''
+                            UPDATE sensor_rollup
+                            SET min = min(min, ?), max = max(max, ?), sum = sum + ?,
+                                count = count + 1
+                            WHERE asset_id = ? AND resolution = ? AND bucket = ?;
+                        ''', (value, value, value, asset_id, resolution, bucket))
+                if now - self.last_expire >= self.expire_interval:
+                    self.expire(cursor, now)
+                database.commit()
+            finally:
+                database.close()
+
+    def expire(self, cursor, now):
+        """Delete raw readings and rollups that are past their retention."""
+        self.last_expire = now
+        cursor.execute('DELETE FROM sensor_data WHERE timestamp < ?;',
+                       (format_timestamp(now - self.raw_retention),))
+        for resolution, retention in ROLLUPS:
+            if retention is None:
+                continue
+            cursor.execute('DELETE FROM sensor_rollup WHERE resolution = ? AND bucket < ?;',
+                           (resolution, now - retention))
+        self.log.info("Expired old sensor history.")
+
+    @staticmethod
+    def pick_resolution(resolution):
+        """Return the coarsest rollup resolution not coarser than 'resolution'.
+
+        0 means raw readings.
+        """
+        best = 0
+        for rollup, _ in ROLLUPS:
+            if rollup <= resolution:
+                best = rollup
+        return best
+
+    def query(self, asset_id, start, end, resolution=0, page_size=500):
+        """Yield pages of readings for asset_id between start and end (Unix time).
+
+        Raw pages hold [timestamp, value] rows; rollup pages hold
+        [bucket, min, max, mean, count] rows.
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be positive, got %r" % (page_size,))
+        resolution = self.pick_resolution(resolution)
+        database = sqlite3.connect(self.dbfile)
+        try:
+            cursor = database.cursor()
+            if resolution:
+                cursor.execute('''
+                    SELECT bucket, min, max, sum / count, count FROM sensor_rollup
+                    WHERE asset_id = ? AND resolution = ? AND bucket >= ? AND bucket <= ?
+                    ORDER BY bucket;
+                ''', (asset_id, resolution, int(start // resolution) * resolution, end))
+            else:
+                cursor.execute('''
+                    SELECT timestamp, value FROM sensor_data
+                    WHERE asset_id = ? AND timestamp >= ? AND timestamp <= ?
+                    ORDER BY timestamp;
+                ''', (asset_id, format_timestamp(start), format_timestamp(end)))
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                if resolution:
+                    yield resolution, [list(row) for row in rows]
+                else:
+                    yield resolution, [[parse_timestamp(ts), value] for ts, value in rows]
+        finally:
+            database.close()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Thread pool for scheduled jobs, with per-job timeouts and overlap policies.
+
+Python threads can't be killed, so a job that overruns its timeout (or is
+cancelled by a newer run) is abandoned: it is counted, its thread is
+replaced so the pool keeps its size, and the thread exits once the job
+eventually returns. A stuck network job therefore can't hold back the jobs
+that must fire on time.
+
+Cancellation is cooperative: a job can call cancelled() between steps to
+stop early, and time_left() to bound blocking calls by its own timeout, so
+abandoned threads don't linger.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import logging
+import threading
+from collections import deque
+from job_scheduler import Wakeup
+from utilities import SM_LOGGER
+
+# What to do when a job fires while its previous run is still going.
+SKIP = "skip"        # drop the new run
+QUEUE = "queue"      # run it once the previous run is done
+CANCEL = "cancel"    # abandon the previous run and start the new one
+OVERLAP_POLICIES = (SKIP, QUEUE, CANCEL)
+
+# The JobRun a worker thread is running.
+current = threading.local()
+
+def cancelled():
+    """Return True if the job running on this thread was cancelled or timed out."""
+    run = getattr(current, "run", None)
+    return run is not None and run.cancel.is_set()
+
+def time_left(default=None):
+    """Return the seconds left before this thread's job times out.
+
+    'default' is returned outside a job or for a job without a timeout.
+    """
+    run = getattr(current, "run", None)
+    if run is None or not run.timeout or run.started is None:
+        return default
+    return max(0.0, run.started + run.timeout - time.time())
+
+class JobRun(object):
+    def __init__(self, key, func, args, scheduled, timeout):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.scheduled = scheduled
+        self.timeout = timeout
+        self.started = None
+        self.abandoned = False
+        self.cancel = threading.Event()
+
+class JobStats(object):
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.duration_total = 0.0
+        self.duration_max = 0.0
+        self.lateness_total = 0.0
+        self.lateness_max = 0.0
+
+    def as_dict(self):
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "cancelled": self.cancelled,
+            "timeouts": self.timeouts,
+            "duration_mean": self.duration_total / self.runs if self.runs else 0.0,
+            "duration_max": self.duration_max,
+            "lateness_mean": self.lateness_total / self.runs if self.runs else 0.0,
+            "lateness_max": self.lateness_max,
+        }
+
+class JobExecutor(object):
+    """Run jobs on 'workers' threads.
+
+    At most one run of each job (identified by its key) is active at a time;
+    the overlap policy decides what happens to a run submitted meanwhile.
+    """
+
+    def __init__(self, workers=4, max_backlog=10, late_warning=1.0, name="Job"):
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.late_warning = late_warning
+        self.name = name
+        self.ready = deque()
+        self.active = {}
+        self.backlog = {}
+        self.stats = {}
+        self.condition = threading.Condition()
+        self.watchdog = Wakeup()
+        self.running = False
+        self.spawned = 0
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        for _ in range(self.workers):
+            self.spawn()
+        watchdog = threading.Thread(target=self.watch, name=self.name + "-watchdog")
+        watchdog.daemon = True
+        watchdog.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.watchdog.set()
+
+    def spawn(self):
+        self.spawned += 1
+        thread = threading.Thread(target=self.work, name="%s-%d" % (self.name, self.spawned))
+        thread.daemon = True
+        thread.start()
+
+    def job_stats(self, key):
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = JobStats()
+        return stats
+
+    def submit(self, key, func, args=(), scheduled=None, timeout=0, overlap=SKIP):
+        """Run func(*args) as job 'key'. Return False if the run was dropped.
+
+        scheduled is the time the job was due (for lateness); a timeout of 0
+        means no timeout.
+        """
+        run = JobRun(key, func, args, scheduled or time.time(), timeout)
+        with self.condition:
+            stats = self.job_stats(key)
+            if key in self.active or self.backlog.get(key):
+                if overlap == SKIP:
+                    stats.skipped += 1
+                    self.log.info("Skipping job %s: previous run still going.", key)
+                    return False
+                if overlap == QUEUE:
+                    backlog = self.backlog.setdefault(key, deque())
+                    if len(backlog) >= self.max_backlog:
+                        stats.skipped += 1
+                        self.log.warning("Skipping job %s: backlog full.", key)
+                        return False
+                    backlog.append(run)
+                    return True
+                # CANCEL
+                self.backlog.pop(key, None)
+                previous = self.active.get(key)
+                if previous is not None:
+                    stats.cancelled += 1
+                    self.abandon(previous)
+                    self.log.info("Cancelled job %s for a newer run.", key)
+            self.active[key] = run
+            self.ready.append(run)
+            self.condition.notify_all()
+        return True
+
+    def abandon(self, run):
+        """Give up on a running job; called with the condition held."""
+        run.abandoned = True
+        run.cancel.set()
+        if self.active.get(run.key) is run:
+            del self.active[run.key]
+            self.next_from_backlog(run.key)
+        if run.started is not None:
+            # Its thread stays busy until the job returns; keep the pool size.
+            self.spawn()
+
+    def next_from_backlog(self, key):
+        backlog = self.backlog.get(key)
+        if backlog:
+            run = backlog.popleft()
+            self.active[key] = run
+            self.ready.append(run)
+            self.condition.notify_all()
+        elif backlog is not None:
+            del self.backlog[key]
+
+    def work(self):
+        while True:
+            with self.condition:
+                while self.running and not self.ready:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                run = self.ready.popleft()
+                if run.abandoned:
+                    continue
+                run.started = time.time()
+            if run.timeout:
+                self.watchdog.set()
+
+            lateness = max(0.0, run.started - run.scheduled)
+            if lateness > self.late_warning:
+                self.log.warning("Job %s started %.1f s late.", run.key, lateness)
+            failed = False
+            current.run = run
+            try:
+                run.func(*run.args)
+            except Exception, excpt:
+                failed = True
+                self.log.exception("Error running job %s: %s", run.key, excpt)
+            finally:
+                current.run = None
+            duration = time.time() - run.started
+
+            with self.condition:
+                stats = self.job_stats(run.key)
+                stats.runs += 1
+                stats.failures += failed
+                stats.duration_total += duration
+                stats.duration_max = max(stats.duration_max, duration)
+                stats.lateness_total += lateness
+                stats.lateness_max = max(stats.lateness_max, lateness)
+                if run.abandoned:
+                    # A replacement thread has taken this one's place.
+                    return
+                del self.active[run.key]
+                self.next_from_backlog(run.key)
+
+    def watch(self):
+        """Abandon runs that overrun their timeout."""
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                now = time.time()
+                wait = None
+                for run in self.active.values():
+                    if not run.timeout or run.started is None:
+                        continue
+                    remaining = run.started + run.timeout - now
+                    if remaining <= 0:
+                        self.job_stats(run.key).timeouts += 1
+                        self.log.warning("Job %s timed out after %.1f s.", run.key, run.timeout)
+                        self.abandon(run)
+                    elif wait is None or remaining < wait:
+                        wait = remaining
+            # Woken by workers starting runs that have a timeout, and by stop().
+            self.watchdog.wait(wait)
+
+    def metrics(self):
+        """Return per-job counters, durations and lateness."""
+        with self.condition:
+            return dict((str(key), stats.as_dict()) for key, stats in self.stats.items())
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Timer heap for scheduled jobs.
+
+Jobs are kept in a min-heap ordered by their next fire time. run() sleeps
+in select() until the earliest deadline, or until add()/remove()/stop()
+write to a wakeup pipe, so an idle module doesn't wake up at all.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import time
+import fcntl
+import heapq
+import select
+import logging
+import calendar
+import datetime
+import threading
+from utilities import SM_LOGGER
+
+SECONDS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+}
+TIME_UNITS = tuple(SECONDS) + ("month",)
+
+def add_months(moment, months):
+    """Return 'moment' shifted by whole months, clamping the day to the month's end."""
+    month = moment.month - 1 + months
+    year = moment.year + month // 12
+    month = month % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+def parse_at_time(at_time):
+    """Parse "HH:MM" or "HH:MM:SS" into a datetime.time (None for empty)."""
+    if not at_time:
+        return None
+    parts = [int(part) for part in str(at_time).strip().split(":")]
+    if len(parts) not in (2, 3):
+        raise ValueError("Invalid at_time: %r" % (at_time,))
+    return datetime.time(*parts)
+
+class Wakeup(object):
+    """A pipe a thread sleeps on in select() until set() is called or a timeout.
+
+    On Python 2, threading.Event.wait(timeout) and Condition.wait(timeout)
+    poll in short sleeps; select() really sleeps.
+    """
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        for descriptor in (self.read_fd, self.write_fd):
+            flags = fcntl.fcntl(descriptor, fcntl.F_GETFL)
+            fcntl.fcntl(descriptor, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def set(self):
+        try:
+            os.write(self.write_fd, b"x")
+        except OSError:
+            pass  # The pipe is full, so a wakeup is already pending.
+
+    def wait(self, timeout=None):
+        """Sleep until set() or for 'timeout' seconds. Return True if set() was called."""
+        readable, _, _ = select.select([self.read_fd], [], [], timeout)
+        if readable:
+            try:
+                os.read(self.read_fd, 4096)
+            except OSError:
+                pass
+        return bool(readable)
+
+class DelayedCall(object):
+    """A callable that fires once; see JobScheduler.call_later."""
+    repeat = False
+
+    def __init__(self, deadline, func, args):
+        self.key = None
+        self.next_run = deadline
+        self.last_run = None
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class ScheduledJob(object):
+    """A callable that fires every 'interval' time units.
+
+    For day, week and month jobs an at_time ("HH:MM[:SS]") pins the time of
+    day; the first run is the next occurrence of that time.
+    """
+
+    repeat = True
+
+    def __init__(self, key, func, time_unit, interval=1, at_time=None, args=()):
+        time_unit = time_unit.lower()
+        if time_unit not in TIME_UNITS:
+            raise ValueError("Unknown time unit: %r" % (time_unit,))
+        self.key = key
+        self.func = func
+        self.args = args
+        self.time_unit = time_unit
+        self.interval = max(1, int(interval))
+        self.at_time = parse_at_time(at_time) if time_unit in ("day", "week", "month") else None
+        self.next_run = None
+        self.last_run = None
+        self.cancelled = False
+
+    def first_run(self, now):
+        if self.at_time is None:
+            return self.advance(now)
+        moment = datetime.datetime.fromtimestamp(now)
+        moment = datetime.datetime.combine(moment.date(), self.at_time)
+        if time.mktime(moment.timetuple()) <= now:
+            moment += datetime.timedelta(days=1)
+        return time.mktime(moment.timetuple())
+
+    def advance(self, deadline):
+        """Return the fire time following 'deadline'."""
+        if self.time_unit == "month":
+            moment = add_months(datetime.datetime.fromtimestamp(deadline), self.interval)
+        elif self.at_time is not None:
+            # Calendar arithmetic keeps the wall clock time across DST changes.
+            moment = datetime.datetime.fromtimestamp(deadline) + datetime.timedelta(
+                seconds=self.interval * SECONDS[self.time_unit])
+        else:
+            return deadline + self.interval * SECONDS[self.time_unit]
+        return time.mktime(moment.timetuple()) + moment.microsecond / 1e6
+
+    def schedule_after(self, now):
+        """Set next_run to the first fire time after 'now', skipping missed runs."""
+        if self.next_run is None:
+            self.next_run = self.first_run(now)
+        while self.next_run <= now:
+            self.next_run = self.advance(self.next_run)
+        return self.next_run
+
+class JobScheduler(object):
+    """Fire ScheduledJobs at their deadlines.
+
+    'dispatch(job)' is called for every due job; by default the job's func
+    runs inline on the scheduler thread. Calls made with call_later() always
+    run inline, so they must not block.
+    """
+
+    def __init__(self, dispatch=None):
+        self.dispatch = dispatch or self.run_job
+        self.heap = []
+        self.jobs = {}
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.waker = Wakeup()
+        self.running = False
+        self.thread = None
+        self.wakeups = 0
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def add(self, job, now=None):
+        """Schedule 'job', replacing any job with the same key."""
+        job.schedule_after(time.time() if now is None else now)
+        with self.lock:
+            previous = self.jobs.get(job.key)
+            if previous is not None:
+                previous.cancelled = True
+            self.jobs[job.key] = job
+            self.push(job)
+        self.wakeup()
+        return job
+
+    def call_later(self, delay, func, *args):
+        """Call func(*args) once, 'delay' seconds from now. Return a DelayedCall."""
+        call = DelayedCall(time.time() + delay, func, args)
+        with self.lock:
+            self.push(call)
+        self.wakeup()
+        return call
+
+    def remove(self, key):
+        with self.lock:
+            job = self.jobs.pop(key, None)
+            if job is not None:
+                job.cancelled = True
+        self.wakeup()
+        return job
+
+    def push(self, job):
+        self.counter += 1
+        heapq.heappush(self.heap, (job.next_run, self.counter, job))
+
+    def wakeup(self):
+        self.waker.set()
+
+    def next_deadline(self):
+        """Return the earliest pending deadline, or None if there are no jobs."""
+        with self.lock:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    def run_pending(self, now=None):
+        """Dispatch every job that is due. Return the number of jobs dispatched."""
+        now = time.time() if now is None else now
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, _, job = heapq.heappop(self.heap)
+                if job.cancelled:
+                    continue
+                job.last_run = job.next_run
+                if job.repeat:
+                    job.schedule_after(now)
+                    self.push(job)
+                due.append(job)
+        for job in due:
+            try:
+                if job.repeat:
+                    self.dispatch(job)
+                else:
+                    self.run_job(job)
+            except Exception, excpt:
+                self.log.exception("Error dispatching job %s: %s", job.key, excpt)
+        return len(due)
+
+    @staticmethod
+    def run_job(job):
+        job.func(*job.args)
+
+    def run(self):
+        """Fire jobs until stop() is called."""
+        self.running = True
+        while self.running:
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            self.waker.wait(timeout)
+            self.wakeups += 1
+            self.run_pending()
+
+    def start(self):
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self.run, name="JobScheduler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
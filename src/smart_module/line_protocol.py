@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Encode analytic points straight into InfluxDB line protocol.
+If run stand-alone, benchmark against the dictionary (JSON) path.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import math
+import time
+
+def escape_key(key):
+    """Escape a tag key/value or field key."""
+    return (unicode(key).replace("\\", "\\\\").replace(",", "\\,")
+            .replace("=", "\\=").replace(" ", "\\ ").replace("\n", "\\n"))
+
+def escape_measurement(name):
+    """Escape a measurement name ('=' is allowed there)."""
+    return unicode(name).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+
+def field_value(value):
+    """Format a field value according to its Python type.
+
+    InfluxDB rejects the whole write for nan or inf, so they raise ValueError
+    here instead of reaching the server.
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, long)):
+        return "%di" % value
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            raise ValueError("Field value must be finite, got %r." % value)
+        return repr(value)
+    return '"%s"' % unicode(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def now_ns():
+    """Return the current time as integer nanoseconds since the epoch."""
+    return int(time.time() * 1000000000)
+
+class PointEncoder(object):
+    """Turn (measurement, tags, fields, timestamp) tuples into line protocol.
+
+    Escaped measurement names and tag sets are computed once and cached, so
+    repeated points for the same site/asset pair only format their fields.
+    """
+
+    def __init__(self):
+        self.measurements = {}
+        self.tag_sets = {}
+
+    def measurement(self, name):
+        try:
+            return self.measurements[name]
+        except KeyError:
+            escaped = self.measurements[name] = escape_measurement(name)
+            return escaped
+
+    def tags(self, *pairs):
+        """Return the escaped tag set for (key, value) pairs, sorted by key."""
+        try:
+            return self.tag_sets[pairs]
+        except KeyError:
+            escaped = self.tag_sets[pairs] = u"".join(
+                u",%s=%s" % (escape_key(key), escape_key(value))
+                for key, value in sorted(pairs) if value != "")
+            return escaped
+
+    def encode(self, measurement, tag_set, fields, timestamp):
+        """Encode one point.
+
+        tag_set is a string returned by tags(), fields is a sequence of
+        (key, value) pairs and timestamp is in integer nanoseconds.
+        """
+        return u"%s%s %s %d" % (
+            self.measurement(measurement), tag_set,
+            u",".join(u"%s=%s" % (escape_key(key), field_value(value))
+                      for key, value in fields),
+            timestamp)
+
+def benchmark(count=20000):
+    """Compare the dictionary path used before with the PointEncoder path."""
+    import datetime
+    import timeit
+    from influxdb.line_protocol import make_lines
+
+    def dict_path():
+        json_body = [{
+            "measurement": "Water",
+            "tags": {"site": "HAPI Test Site", "asset": "Water Temperature"},
+            "time": str(datetime.datetime.now()),
+            "fields": {"value": 21.5, "unit": "C"}
+        }]
+        return make_lines({"points": json_body})
+
+    encoder = PointEncoder()
+
+    def line_path():
+        return encoder.encode("Water",
+                              encoder.tags(("site", "HAPI Test Site"),
+                                           ("asset", "Water Temperature")),
+                              (("value", 21.5), ("unit", "C")), now_ns())
+
+    for name, func in (("dict + make_lines", dict_path), ("PointEncoder", line_path)):
+        seconds = timeit.timeit(func, number=count)
+        print("%-20s %8.2f us/point" % (name, seconds / count * 1000000))
+
+if __name__ == "__main__":
+    benchmark()
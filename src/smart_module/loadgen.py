@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module load generator
+Release: April 2017 Beta Milestone
+
+Drive the query/response/store pipeline of a mock Smart Module with simulated
+readings at a fixed rate and report throughput and handler latency.
+
+    python loadgen.py --rate 200 --duration 60 --seed 42
+
+Without --broker, messages are handed straight to Communicator.on_message in
+this process. With --broker, ASSET/RESPONSE messages are published to that
+broker for a Scheduler running elsewhere.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+from collections import namedtuple
+import asset_sim
+from utilities import SM_LOGGER
+
+Message = namedtuple("Message", "topic payload")
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class DiscardClient(object):
+    """Stand-in InfluxDB client that counts analytic points and drops them."""
+
+    def __init__(self):
+        self.points = 0
+
+    def get_list_database(self):
+        return []
+
+    def create_database(self, database):
+        pass
+
+    def write_points(self, points, database=None, protocol=None):
+        self.points += len(points)
+        return True
+
+def run(args):
+    import alert
+    import smart_module
+
+    # Keep the module's databases (and the real readings, alerts and points in
+    # them) out of the run; alert thresholds come from a copy of hapi_core.db.
+    directory = tempfile.mkdtemp()
+    try:
+        if os.path.exists("hapi_core.db"):
+            shutil.copy("hapi_core.db", directory)
+        alert.alert_params_cache.dbfile = os.path.join(directory, "hapi_core.db")
+        generate(args, smart_module.SmartModule(data_dir=directory))
+    finally:
+        shutil.rmtree(directory)
+
+def generate(args, module):
+    from influxdb import InfluxDBClient
+
+    # Never send synthetic data to the module's default InfluxDB server.
+    if args.influx:
+        host, _, port = args.influx.partition(":")
+        module.ifconn = InfluxDBClient(host, int(port or 8086))
+    else:
+        module.ifconn = DiscardClient()
+    module.writer.client = module.ifconn
+    simulator = asset_sim.AssetImpl(seed=args.seed, rate=args.rate, noise=args.noise,
+                                    step_rate=args.step_rate, dropout_rate=args.dropout_rate)
+    topic = "ASSET/RESPONSE/" + module.asset.id
+
+    if args.broker:
+        module.comm.broker_name = args.broker
+        module.comm.client.loop_start()
+        module.comm.connect()
+
+    latencies = []
+    sent = dropouts = 0
+    started = time.time()
+    deadline = started + args.duration
+    period = 1.0 / args.rate
+    next_send = started
+    while time.time() < deadline:
+        try:
+            payload = str(simulator.read_value())
+        except IOError:
+            dropouts += 1
+            payload = None
+
+        if payload is not None:
+            begin = time.time()
+            if args.broker:
+                module.comm.send(topic, payload)
+            else:
+                module.comm.on_message(None, None, Message(topic, payload))
+            latencies.append(time.time() - begin)
+            sent += 1
+
+        next_send += period
+        delay = next_send - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    elapsed = time.time() - started
+    module.comm.pool.stop()
+    module.comm.publisher.stop()
+    module.sampler.stop()
+    module.alert_engine.stop()
+    module.writer.stop()
+    if args.broker:
+        module.comm.client.loop_stop()
+
+    print("Readings sent:      %d (%d dropouts)" % (sent, dropouts))
+    print("Achieved rate:      %.1f/s (target %.1f/s)" % (sent / elapsed, args.rate))
+    print("Submit latency:     mean %.3f ms, p99 %.3f ms" % (
+        1000 * sum(latencies) / max(1, len(latencies)), 1000 * percentile(latencies, 0.99)))
+    queue = module.comm.pool.metrics()
+    print("Handler queue:      wait mean %.3f ms, max %.3f ms, %d dropped, %d rejected" % (
+        1000 * queue["wait_mean"], 1000 * queue["wait_max"], queue["dropped"], queue["rejected"]))
+    for handler in module.comm.dispatcher.stats():
+        if handler["calls"]:
+            print("Handler %-18s %d calls, mean %.3f ms, %d errors" % (
+                handler["name"] + ":", handler["calls"],
+                1000 * handler["seconds"] / handler["calls"], handler["errors"]))
+    publish = module.comm.publisher.metrics()
+    print("Publish queue:      %d published (%.1f/s), latency mean %.3f ms, max %.3f ms, "
+          "%d dropped, %d failed, %d retries" % (
+              publish["published"], publish["rate"], 1000 * publish["latency_mean"],
+              1000 * publish["latency_max"], publish["dropped"], publish["failed"],
+              publish["retries"]))
+    print("Analytics pending:  %d" % module.writer.pending())
+    if not args.influx:
+        print("Analytics discarded: %d (no --influx given)" % module.ifconn.points)
+    print("Analytics spooled:  %d" % module.writer.spool.count())
+
+def main():
+    parser = argparse.ArgumentParser(description="HAPI Smart Module load generator")
+    parser.add_argument("--rate", type=float, default=50.0, help="readings per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--seed", default=None, help="simulator seed")
+    parser.add_argument("--noise", type=float, default=0.15)
+    parser.add_argument("--step-rate", type=float, default=0.0)
+    parser.add_argument("--dropout-rate", type=float, default=0.0)
+    parser.add_argument("--broker", default=None, help="publish to this MQTT broker")
+    parser.add_argument("--influx", default=None,
+                        help="InfluxDB host[:port] for analytic points (discarded if not given)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    logging.getLogger(SM_LOGGER).setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Versioned payloads for ASSET and STATUS messages.
+
+Three encodings are understood by decode_reading()/decode_status():
+
+  * binary: version byte 0x01 followed by a fixed struct layout,
+  * json:   a JSON object with "v": 1,
+  * legacy: the bare value (ASSET) or str(SystemStatus) (STATUS) sent by
+            older modules.
+
+A querying module asks for an encoding by putting "json" or "binary" in the
+query payload (see requested_format); anything else gets the legacy answer.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import json
+import time
+import struct
+from collections import namedtuple
+from status import SystemStatus
+
+VERSION = 1
+BINARY_MARKER = chr(VERSION)
+
+JSON = "json"
+BINARY = "binary"
+LEGACY = "legacy"
+
+# Reading quality
+GOOD = 0
+STALE = 1
+FAILED = 2
+
+KIND_READING = 1
+KIND_STATUS = 2
+KIND_BATCH = 3
+
+Reading = namedtuple("Reading", "asset_id timestamp unit quality value")
+
+# version, kind, timestamp, quality, value, unit length, asset id length
+READING_STRUCT = struct.Struct("!BBdBdBB")
+# version, kind, timestamp, boot, cpu, memory used/free/cached,
+# packets sent/recv, disk total/used/free, clients; followed by the module
+# id (prefixed by a length byte, absent from older modules' payloads).
+STATUS_STRUCT = struct.Struct("!BBddfQQQQQQQQi")
+# version, kind, number of frames; followed by module id, name and context
+# (each prefixed by a length byte) and then length-prefixed frames.
+BATCH_STRUCT = struct.Struct("!BBH")
+FRAME_STRUCT = struct.Struct("!H")
+
+Batch = namedtuple("Batch", "module name context readings status")
+
+def utf8(text):
+    """Return text as UTF-8 bytes; byte strings are assumed to be UTF-8 already."""
+    if isinstance(text, str):
+        return text
+    return text.encode("utf-8")
+
+def requested_format(query):
+    """Return the encoding asked for in a query payload."""
+    query = (query or "").strip().lower()
+    if query in (JSON, BINARY):
+        return query
+    return LEGACY
+
+def encode_reading(reading, fmt=BINARY, trend=None):
+    """Encode a Reading.
+
+    trend, the rolling stats of readings.ReadingBuffer.trend(), is carried by
+    JSON payloads only; binary payloads stay fixed-size.
+    """
+    if fmt == BINARY:
+        unit = utf8(reading.unit)
+        asset_id = utf8(reading.asset_id)
+        return READING_STRUCT.pack(VERSION, KIND_READING, reading.timestamp, reading.quality,
+                                   reading.value, len(unit), len(asset_id)) + unit + asset_id
+    if fmt == JSON:
+        fields = {"v": VERSION, "asset": reading.asset_id, "ts": reading.timestamp,
+                  "unit": reading.unit, "quality": reading.quality, "value": reading.value}
+        if trend:
+            fields["trend"] = trend
+        return json.dumps(fields, separators=(",", ":"))
+    return str(reading.value)
+
+def decode_reading(data, asset_id="", unit=""):
+    """Decode an ASSET/RESPONSE payload into a Reading.
+
+    asset_id and unit fill in what legacy payloads don't carry.
+    """
+    data = str(data)
+    if data.startswith(BINARY_MARKER):
+        (_, kind, timestamp, quality, value,
+         unit_len, id_len) = READING_STRUCT.unpack_from(data)
+        if kind != KIND_READING:
+            raise ValueError("Not a reading payload.")
+        start = READING_STRUCT.size
+        return Reading(data[start + unit_len:start + unit_len + id_len].decode("utf-8"),
+                       timestamp, data[start:start + unit_len].decode("utf-8"), quality, value)
+    if data.startswith("{"):
+        fields = json.loads(data)
+        return Reading(fields.get("asset", asset_id), float(fields["ts"]),
+                       fields.get("unit", unit), int(fields.get("quality", GOOD)),
+                       float(fields["value"]))
+    value = float(data)
+    return Reading(asset_id, time.time(), unit, GOOD if value != -1000 else FAILED, value)
+
+def encode_status(status, fmt=BINARY):
+    """Encode a SystemStatus; binary and JSON payloads carry status.module."""
+    if fmt == BINARY:
+        module = utf8(status.module)
+        return STATUS_STRUCT.pack(
+            VERSION, KIND_STATUS, status.timestamp,
+            time.mktime(time.strptime(status.boot, "%Y-%m-%d %H:%M:%S")),
+            status.cpu["percentage"],
+            status.memory["used"], status.memory["free"], status.memory["cached"],
+            status.network["packet_sent"], status.network["packet_recv"],
+            status.disk["total"], status.disk["used"], status.disk["free"],
+            status.clients) + chr(len(module)) + module
+    if fmt == JSON:
+        return json.dumps({"v": VERSION, "module": status.module,
+                           "time": status.timestamp, "boot": status.boot,
+                           "cpu": status.cpu, "memory": status.memory,
+                           "network": status.network, "disk": status.disk,
+                           "clients": status.clients}, separators=(",", ":"))
+    return str(status)
+
+def decode_status(data):
+    """Decode a binary or JSON STATUS/RESPONSE payload into a SystemStatus.
+
+    Return None for legacy payloads.
+    """
+    data = str(data)
+    status = SystemStatus()
+    if data.startswith(BINARY_MARKER):
+        (_, kind, status.timestamp, boot, cpu,
+         used, free, cached, sent, recv,
+         total, disk_used, disk_free, status.clients) = STATUS_STRUCT.unpack_from(data)
+        if kind != KIND_STATUS:
+            raise ValueError("Not a status payload.")
+        if len(data) > STATUS_STRUCT.size:
+            length = ord(data[STATUS_STRUCT.size])
+            start = STATUS_STRUCT.size + 1
+            status.module = data[start:start + length].decode("utf-8")
+        status.boot = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(boot))
+        status.cpu["percentage"] = cpu
+        status.memory.update(used=used, free=free, cached=cached)
+        status.network.update(packet_sent=sent, packet_recv=recv)
+        status.disk.update(total=total, used=disk_used, free=disk_free)
+        return status
+    if data.startswith("{"):
+        fields = json.loads(data)
+        status.module = fields.get("module", "")
+        status.timestamp = fields["time"]
+        status.boot = fields["boot"]
+        status.cpu.update(fields["cpu"])
+        status.memory.update(fields["memory"])
+        status.network.update(fields["network"])
+        status.disk.update(fields["disk"])
+        status.clients = fields["clients"]
+        return status
+    return None
+
+def encode_batch(batch, fmt=BINARY):
+    """Encode a Batch: several readings and optionally a status in one message."""
+    if fmt == JSON:
+        return json.dumps({
+            "v": VERSION, "module": batch.module, "name": batch.name, "context": batch.context,
+            "readings": [json.loads(encode_reading(r, JSON)) for r in batch.readings],
+            "status": json.loads(encode_status(batch.status, JSON)) if batch.status else None,
+        }, separators=(",", ":"))
+
+    frames = [encode_reading(r, BINARY) for r in batch.readings]
+    if batch.status:
+        frames.append(encode_status(batch.status, BINARY))
+    parts = [BATCH_STRUCT.pack(VERSION, KIND_BATCH, len(frames))]
+    for text in (batch.module, batch.name, batch.context):
+        text = utf8(text)
+        parts.append(chr(len(text)) + text)
+    for frame in frames:
+        parts.append(FRAME_STRUCT.pack(len(frame)) + frame)
+    return "".join(parts)
+
+def decode_batch(data):
+    """Decode a MODULE/BATCH payload into a Batch."""
+    data = str(data)
+    readings = []
+    status = None
+    if data.startswith("{"):
+        fields = json.loads(data)
+        for reading in fields["readings"]:
+            readings.append(decode_reading(json.dumps(reading)))
+        if fields.get("status"):
+            status = decode_status(json.dumps(fields["status"]))
+        if status and not status.module:
+            status.module = fields["module"]
+        return Batch(fields["module"], fields["name"], fields["context"], readings, status)
+
+    _, kind, count = BATCH_STRUCT.unpack_from(data)
+    if kind != KIND_BATCH:
+        raise ValueError("Not a batch payload.")
+    offset = BATCH_STRUCT.size
+    texts = []
+    for _ in range(3):
+        length = ord(data[offset])
+        texts.append(data[offset + 1:offset + 1 + length].decode("utf-8"))
+        offset += 1 + length
+    for _ in range(count):
+        length, = FRAME_STRUCT.unpack_from(data, offset)
+        frame = data[offset + FRAME_STRUCT.size:offset + FRAME_STRUCT.size + length]
+        offset += FRAME_STRUCT.size + length
+        if ord(frame[1]) == KIND_STATUS:
+            status = decode_status(frame)
+        else:
+            readings.append(decode_reading(frame))
+    if status and not status.module:
+        status.module = texts[0]
+    return Batch(texts[0], texts[1], texts[2], readings, status)
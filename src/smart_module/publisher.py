@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Outbound MQTT publish queue.
+
+Messages are buffered (up to max_buffer, oldest dropped first) and handed to
+the MQTT client while it is connected and fewer than max_inflight messages
+are waiting for their PUBACK (QoS 1/2) or to be written out (QoS 0).
+A publish the client refuses is retried with exponential backoff. On
+disconnect, unconfirmed QoS 0 messages go back to the head of the buffer;
+QoS 1/2 messages are redelivered by the client itself after reconnecting.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import heapq
+import logging
+import threading
+from collections import deque
+import paho.mqtt.client as mqtt
+from utilities import SM_LOGGER
+from job_scheduler import Wakeup
+
+# Publish results that mean the message itself is wrong; resending can't help.
+PERMANENT_ERRORS = (mqtt.MQTT_ERR_INVAL, mqtt.MQTT_ERR_PAYLOAD_SIZE)
+
+class Outgoing(object):
+    __slots__ = ("topic", "message", "qos", "queued", "attempts", "not_before")
+
+    def __init__(self, topic, message, qos):
+        self.topic = topic
+        self.message = message
+        self.qos = qos
+        self.queued = time.time()
+        self.attempts = 0
+        self.not_before = 0
+
+class Publisher(object):
+    """Buffer, rate-limit and retry publishes on a paho client.
+
+    topic_qos is a list of (topic filter, qos); the first matching filter
+    gives a topic's QoS, otherwise default_qos is used.
+
+    A message that fails to publish is parked with exponential backoff while
+    the messages behind it go on; it returns to the head of the buffer when
+    its delay is over. Messages the client refuses outright (an exception or
+    a permanent error code) are dropped at once.
+    """
+
+    def __init__(self, client, topic_qos=(), default_qos=0, max_inflight=20,
+                 max_buffer=1000, retry_delay=(0.5, 30.0), max_attempts=10, interval=0.5):
+        self.client = client
+        self.topic_qos = list(topic_qos)
+        self.default_qos = default_qos
+        self.max_inflight = max_inflight
+        self.max_buffer = max_buffer
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.qos_cache = {}
+        self.buffer = deque()
+        self.retrying = []
+        self.inflight = {}
+        self.acked = set()
+        self.connected = False
+        self.lock = threading.Lock()
+        self.sending = threading.Lock()
+        self.wakeup = Wakeup()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.started = time.time()
+        self.counter = 0
+        self.queued = 0
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+        self.max_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.log = logging.getLogger(SM_LOGGER)
+        client.on_publish = self.on_publish
+
+    def start(self):
+        if self.thread:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="Publisher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def qos(self, topic):
+        qos = self.qos_cache.get(topic)
+        if qos is None:
+            qos = self.default_qos
+            for topic_filter, filter_qos in self.topic_qos:
+                if mqtt.topic_matches_sub(topic_filter, topic):
+                    qos = filter_qos
+                    break
+            if len(self.qos_cache) >= 1024:
+                self.qos_cache = {}
+            self.qos_cache[topic] = qos
+        return qos
+
+    def put(self, topic, message, qos=None):
+        """Queue a message, dropping the oldest one if the buffer is full."""
+        outgoing = Outgoing(topic, message, self.qos(topic) if qos is None else qos)
+        with self.lock:
+            if len(self.buffer) >= self.max_buffer:
+                dropped = self.buffer.popleft()
+                self.dropped += 1
+                self.log.warning("Publish buffer full, dropped message for %s", dropped.topic)
+            self.buffer.append(outgoing)
+            self.queued += 1
+            self.max_depth = max(self.max_depth, len(self.buffer))
+        self.wakeup.set()
+
+    def on_connect(self):
+        with self.lock:
+            self.connected = True
+        self.wakeup.set()
+
+    def on_disconnect(self):
+        with self.lock:
+            self.connected = False
+            requeue = [mid for mid, outgoing in self.inflight.items() if outgoing.qos == 0]
+            for mid in sorted(requeue, reverse=True):
+                self.buffer.appendleft(self.inflight.pop(mid))
+
+    def on_publish(self, client, userdata, mid):
+        """Called by paho once a message is written out (QoS 0) or acknowledged."""
+        with self.lock:
+            outgoing = self.inflight.pop(mid, None)
+            if outgoing is None:
+                # Confirmed before flush() got to record it.
+                self.acked.add(mid)
+                return
+            self.complete(outgoing)
+        self.wakeup.set()
+
+    def complete(self, outgoing):
+        latency = time.time() - outgoing.queued
+        self.published += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def flush(self):
+        """Hand buffered messages to the client while there is room in flight."""
+        with self.sending:
+            with self.lock:
+                self.requeue_due()
+            while True:
+                with self.lock:
+                    if (not self.connected or not self.buffer or
+                            len(self.inflight) >= self.max_inflight):
+                        return
+                    outgoing = self.buffer.popleft()
+
+                try:
+                    info = self.client.publish(outgoing.topic, outgoing.message, qos=outgoing.qos)
+                    rc, mid = info.rc, info.mid
+                except Exception, excpt:
+                    with self.lock:
+                        self.failed += 1
+                    self.log.warning("Dropping message for %s: %s", outgoing.topic, excpt)
+                    continue
+
+                with self.lock:
+                    if rc == mqtt.MQTT_ERR_SUCCESS or (rc == mqtt.MQTT_ERR_NO_CONN and
+                                                       outgoing.qos > 0):
+                        # QoS 1/2 messages stay with the client until acknowledged.
+                        if mid in self.acked:
+                            self.acked.discard(mid)
+                            self.complete(outgoing)
+                        else:
+                            self.inflight[mid] = outgoing
+                        continue
+                    outgoing.attempts += 1
+                    if rc in PERMANENT_ERRORS or outgoing.attempts >= self.max_attempts:
+                        self.failed += 1
+                        self.log.warning("Giving up publishing to %s: %s",
+                                         outgoing.topic, mqtt.error_string(rc))
+                        continue
+                    self.retries += 1
+                    outgoing.not_before = time.time() + min(
+                        self.retry_delay[0] * 2 ** (outgoing.attempts - 1), self.retry_delay[1])
+                    self.counter += 1
+                    heapq.heappush(self.retrying, (outgoing.not_before, self.counter, outgoing))
+
+    def requeue_due(self):
+        """Put parked messages whose delay is over back at the head of the buffer."""
+        now = time.time()
+        due = []
+        while self.retrying and self.retrying[0][0] <= now:
+            due.append(heapq.heappop(self.retrying)[2])
+        due.sort(key=lambda outgoing: outgoing.queued)
+        self.buffer.extendleft(reversed(due))
+
+    def tick(self):
+        self.flush()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.interval)
+            self.flush()
+
+    def metrics(self):
+        """Return buffer depth, counters, publish rate and queue-to-confirm latency."""
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                "connected": self.connected,
+                "depth": len(self.buffer),
+                "max_depth": self.max_depth,
+                "retrying": len(self.retrying),
+                "inflight": len(self.inflight),
+                "queued": self.queued,
+                "published": self.published,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "retries": self.retries,
+                "rate": self.published / elapsed if elapsed > 0 else 0.0,
+                "latency_mean": self.latency_total / self.published if self.published else 0.0,
+                "latency_max": self.latency_max,
+            }
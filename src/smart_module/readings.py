@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+In-memory ring buffer of recent readings with rolling statistics.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+from array import array
+from collections import deque
+
+class RollingWindow(object):
+    """Running count/mean/variance/min/max over the last 'size' readings.
+
+    Mean and variance use Welford's update (with removal once the window is
+    full); min and max use monotonic deques. Every update is O(1) amortized.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minima = deque()
+        self.maxima = deque()
+
+    def update(self, seq, value, dropped=None):
+        """Add reading number 'seq'. 'dropped' is the value leaving the window."""
+        if dropped is None:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            old_mean = self.mean
+            self.mean += (value - dropped) / self.count
+            self.m2 += (value - dropped) * (value - self.mean + dropped - old_mean)
+            if self.m2 < 0.0:
+                self.m2 = 0.0
+
+        oldest = seq - self.size
+        while self.minima and self.minima[0][0] <= oldest:
+            self.minima.popleft()
+        while self.maxima and self.maxima[0][0] <= oldest:
+            self.maxima.popleft()
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.minima.append((seq, value))
+        self.maxima.append((seq, value))
+
+    def stats(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": self.minima[0][1],
+            "max": self.maxima[0][1],
+            "mean": self.mean,
+            "variance": self.m2 / self.count,
+        }
+
+class ReadingBuffer(object):
+    """Fixed-capacity ring buffer of (timestamp, value) readings for one asset.
+
+    Values and timestamps are kept in preallocated array('d') so memory stays
+    flat. 'windows' are the window sizes (in readings) for which rolling stats
+    are maintained; each must not exceed 'capacity'.
+    """
+
+    def __init__(self, capacity=1024, windows=(10, 60, 360)):
+        if max(windows) > capacity:
+            raise ValueError("Window larger than buffer capacity.")
+        self.capacity = capacity
+        self.values = array('d', [0.0]) * capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.seq = 0
+        self.windows = dict((size, RollingWindow(size)) for size in windows)
+
+    def __len__(self):
+        return min(self.seq, self.capacity)
+
+    def append(self, value, timestamp=None):
+        value = float(value)
+        pos = self.seq % self.capacity
+        for size, window in self.windows.items():
+            if self.seq >= size:
+                dropped = self.values[(self.seq - size) % self.capacity]
+                window.update(self.seq, value, dropped)
+            else:
+                window.update(self.seq, value)
+        self.values[pos] = value
+        self.timestamps[pos] = timestamp or time.time()
+        self.seq += 1
+
+    def last(self):
+        """Return the latest (timestamp, value) or None."""
+        if not self.seq:
+            return None
+        pos = (self.seq - 1) % self.capacity
+        return self.timestamps[pos], self.values[pos]
+
+    def recent(self, count):
+        """Return up to 'count' latest (timestamp, value) readings, oldest first."""
+        count = min(count, len(self))
+        return [(self.timestamps[i % self.capacity], self.values[i % self.capacity])
+                for i in range(self.seq - count, self.seq)]
+
+    def stats(self, window):
+        """Return the rolling stats of one of the configured windows."""
+        stats = self.windows[window].stats()
+        if self.seq:
+            stats["last"] = self.values[(self.seq - 1) % self.capacity]
+        return stats
+
+    def trend(self):
+        """Return the rolling stats of all windows, keyed by window size."""
+        return dict((size, self.stats(size)) for size in sorted(self.windows))
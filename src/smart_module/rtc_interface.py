@@ -21,7 +21,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 #https://github.com/switchdoclabs/RTC_SDL_DS3231/blob/master/SDL_DS3231.py
 
-import random
 import datetime
 import logging
 import time
@@ -38,6 +37,7 @@ except ImportError:
     some_import_failed = True
 
 from utilities import SM_LOGGER
+import asset_sim
 
 TYPE_ADDRESS = 0
 TYPE_LEN = 2
@@ -61,6 +61,7 @@ class RTCInterface(object):
         self.logger = logging.getLogger(SM_LOGGER)
 
         if self.mock:
+            self.simulator = asset_sim.AssetImpl(base=25.0, amplitude=2.0)
             return
 
         GPIO.setwarnings(False)
@@ -114,11 +115,11 @@ class RTCInterface(object):
         '''Gets the internal temperature from the RTC component
         Returns:
             float: Current RTC internal temperature sensor value if not mock;
-            20.0 if mock.
+            simulated temperature if mock.
         '''
 
         if self.mock:
-            return float(random.randrange(8, 34, 1))
+            return self.simulator.read_value()
 
         try:
             return self.ds3231.getTemp()
@@ -170,7 +171,7 @@ class RTCInterface(object):
             str: %s-byte Type data as String if not mock; 'wt' if mock.
         ''' % TYPE_LEN
 
-        return self.read_eeprom(self, TYPE_ADDRESS, TYPE_LEN, 'type', 'wt')
+        return self.read_eeprom(TYPE_ADDRESS, TYPE_LEN, 'type', 'wt')
 
     def set_type(self, type_):
         '''Writes the modules %s-byte sensor type to EEPROM
@@ -187,7 +188,7 @@ class RTCInterface(object):
         ''' % ID_LEN
 
         return self.read_eeprom(
-            self, ID_ADDRESS, ID_LEN, 'Module ID', 'HSM-WT123-MOCK')
+            ID_ADDRESS, ID_LEN, 'Module ID', 'HSM-WT123-MOCK')
 
     def set_id(self, id_):
         '''Writes the module id to EEPROM
@@ -206,7 +207,6 @@ class RTCInterface(object):
         ''' % CONTEXT_LEN
 
         return self.read_eeprom(
-            self,
             CONTEXT_ADDRESS, CONTEXT_LEN, 'Module context', 'Environment')
 
     def set_context(self, context):
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Single event loop runtime for the Smart Module.
+
+The regular entry point (smart_module.main) runs paho's network thread, a
+handler pool, writer/sampler/alert threads and the job scheduler. This
+runtime drives the MQTT client, sampling, InfluxDB writes and alert
+evaluation as timed tasks of one loop in the main thread. Anything that
+may block (sensor drivers, SQLite, HTTP, scheduled jobs) is handed to a small
+worker pool.
+
+    python runtime.py
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import heapq
+import logging
+import threading
+import paho.mqtt.client as mqtt
+from worker_pool import WorkerPool, REJECT
+from discovery import PhaseTimer
+from utilities import SM_LOGGER
+
+class Timer(object):
+    """Handle of a call scheduled on the EventLoop."""
+    def __init__(self, deadline, func, args):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop(object):
+    """Run timed callbacks and the MQTT client's network I/O in one thread.
+
+    The loop sleeps inside client.loop() until the next timer is due (at most
+    max_wait seconds, so timers added from other threads are picked up).
+    Blocking work goes to 'executor'.
+    """
+
+    def __init__(self, executor, max_wait=0.5, reconnect_delay=(1.0, 60.0)):
+        self.executor = executor
+        self.max_wait = max_wait
+        self.reconnect_delay = reconnect_delay
+        self.client = None
+        self.timers = []
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def call_later(self, delay, func, *args):
+        """Call func(*args) on the loop after 'delay' seconds."""
+        timer = Timer(time.time() + delay, func, args)
+        with self.lock:
+            self.counter += 1
+            heapq.heappush(self.timers, (timer.deadline, self.counter, timer))
+        return timer
+
+    def every(self, interval, func, blocking=False):
+        """Call func() every 'interval' seconds.
+
+        With blocking=True, func runs on the executor and a run is skipped
+        while the previous one is still going.
+        """
+        busy = threading.Event()
+
+        def work():
+            try:
+                func()
+            finally:
+                busy.clear()
+
+        def tick():
+            self.call_later(interval, tick)
+            if not blocking:
+                func()
+            elif not busy.is_set():
+                busy.set()
+                if not self.executor.submit(work, policy=REJECT):
+                    busy.clear()
+
+        return self.call_later(interval, tick)
+
+    def run_timers(self):
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.timers or self.timers[0][0] > now:
+                    return
+                _, _, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            try:
+                timer.func(*timer.args)
+            except Exception, excpt:
+                self.log.exception("Error in event loop task: %s", excpt)
+
+    def next_wait(self):
+        with self.lock:
+            if not self.timers:
+                return self.max_wait
+            return min(self.max_wait, max(0.0, self.timers[0][0] - time.time()))
+
+    def poll_client(self, timeout):
+        """Do one round of MQTT network I/O, reconnecting with backoff if needed."""
+        rc = self.client.loop(timeout=timeout)
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            self.reconnect_wait = self.reconnect_delay[0]
+            return
+        time.sleep(timeout)
+        if time.time() >= self.reconnect_at:
+            try:
+                self.client.reconnect()
+                self.log.info("Reconnected to broker.")
+            except Exception, excpt:
+                self.log.info("Error reconnecting to broker: %s", excpt)
+            self.reconnect_at = time.time() + self.reconnect_wait
+            self.reconnect_wait = min(self.reconnect_wait * 2, self.reconnect_delay[1])
+
+    def run(self, client=None):
+        self.client = client
+        self.running = True
+        self.reconnect_wait = self.reconnect_delay[0]
+        self.reconnect_at = 0
+        while self.running:
+            if self.client is not None:
+                self.poll_client(self.next_wait())
+            else:
+                time.sleep(self.next_wait())
+            self.run_timers()
+
+    def stop(self):
+        self.running = False
+
+class Runtime(object):
+    """Wire a SmartModule onto an EventLoop."""
+
+    def __init__(self, workers=2, max_queue=256):
+        self.executor = WorkerPool(workers=workers, max_queue=max_queue, name="Executor")
+        self.loop = EventLoop(self.executor)
+        self.smart_module = None
+        self.timer = None
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self):
+        import smart_module
+
+        self.executor.start()
+        module = self.smart_module = smart_module.SmartModule(executor=self.executor)
+        loop = self.loop
+
+        loop.every(module.comm.publisher.interval, module.comm.publisher.tick)
+        loop.every(module.writer.flush_interval / 2.0, module.writer.tick, blocking=True)
+        loop.every(module.sampler.interval, module.sampler.sample, blocking=True)
+        loop.every(module.alert_engine.interval, module.alert_engine.evaluate, blocking=True)
+        # Due jobs go to the Scheduler's own job executor.
+        module.timers.start()
+
+        self.log.info("Performing Discovery...")
+        self.timer = PhaseTimer()
+        cached = module.discovery_cache.load()
+        if cached.get("broker") and module.comm.connect(cached["broker"]):
+            loop.call_later(0, self.wait_for_connection,
+                            time.time() + module.cached_connect_wait, cached)
+        else:
+            self.run_discovery_script()
+
+    def run_discovery_script(self):
+        module = self.smart_module
+        module.start_discovery()
+        self.timer.mark("discovery script")
+        module.comm.connect(module.comm.default_broker)
+        self.loop.call_later(0, self.wait_for_connection, time.time() + module.connect_wait, {})
+
+    def wait_for_connection(self, deadline, cached):
+        module = self.smart_module
+        if not module.comm.connected.is_set():
+            if time.time() < deadline:
+                self.loop.call_later(0.05, self.wait_for_connection, deadline, cached)
+                return
+            if cached:
+                # The cached broker didn't answer: fall back to the full discovery.
+                self.timer.mark("cached broker")
+                self.run_discovery_script()
+                return
+        self.timer.mark("connect")
+        module.announce()
+        wait = module.scheduler_wait
+        if cached.get("scheduler") == module.hostname + ".local":
+            wait = min(wait, module.cached_scheduler_wait)
+        self.loop.call_later(0, self.wait_for_scheduler, time.time() + wait)
+
+    def wait_for_scheduler(self, deadline):
+        module = self.smart_module
+        if not module.comm.scheduler_located.is_set() and time.time() < deadline:
+            self.loop.call_later(0.05, self.wait_for_scheduler, deadline)
+            return
+        self.timer.mark("scheduler")
+        self.executor.submit(self.finish_discovery)
+
+    def finish_discovery(self):
+        module = self.smart_module
+        if not module.comm.scheduler_found:
+            module.become_scheduler()
+            self.timer.mark("become scheduler")
+        module.save_discovery()
+        self.log.info("Discovery finished: %s", self.timer.report())
+        module.load_site_data()
+
+    def run(self):
+        self.start()
+        try:
+            self.loop.run(self.smart_module.comm.client)
+        finally:
+            self.executor.stop()
+            self.smart_module.writer.stop()
+
+def main():
+    from smart_module import setup_logging
+
+    logger = setup_logging()
+    try:
+        Runtime().run()
+    except Exception, excpt:
+        logger.exception("Error in Smart Module runtime. %s", excpt)
+
+if __name__ == "__main__":
+    main()
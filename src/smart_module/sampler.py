@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Background sampling of the asset into a latest-value cache.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import logging
+import threading
+from collections import namedtuple
+from utilities import SM_LOGGER
+from job_scheduler import Wakeup
+
+CachedReading = namedtuple("CachedReading", "value timestamp stale")
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+class Sampler(object):
+    """Read a sensor every 'interval' seconds on a background thread.
+
+    Each sample is the median of 'oversample' reads. read() may return a single
+    value or a {probe_id: value} dict, in which case every probe is filtered
+    on its own and the first probe is the sampled value. The result is kept in a
+    cache together with its timestamp; a cached reading older than max_age
+    seconds (or left over from a failed sample) is reported as stale.
+    on_sample(value, timestamp) is called after every successful sample.
+    """
+
+    def __init__(self, read, interval=10.0, oversample=3, max_age=None, on_sample=None):
+        self.read = read
+        self.interval = interval
+        self.oversample = oversample
+        self.max_age = max_age if max_age is not None else 3 * interval
+        self.on_sample = on_sample
+        self.value = None
+        self.probes = {}
+        self.timestamp = 0
+        self.failed = False
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.wakeup = Wakeup()
+        self.thread = None
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self):
+        if self.thread:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="Sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def sample(self):
+        """Take one (oversampled, median filtered) sample and cache it."""
+        reads = []
+        for _ in range(self.oversample):
+            try:
+                value = self.read()
+                if not isinstance(value, dict):
+                    value = {None: value}
+                reads.append(value)
+            except Exception, excpt:
+                self.log.exception("Error sampling asset: %s", excpt)
+        if not reads:
+            with self.lock:
+                self.failed = True
+            return None
+
+        probes = {}
+        for probe_id in set().union(*reads):
+            probes[probe_id] = median([float(read[probe_id]) for read in reads
+                                       if probe_id in read])
+        value = probes[min(probes)]
+        timestamp = time.time()
+        with self.lock:
+            self.value = value
+            self.probes = probes if None not in probes else {}
+            self.timestamp = timestamp
+            self.failed = False
+        if self.on_sample:
+            self.on_sample(value, timestamp)
+        return value
+
+    def latest(self):
+        """Return the cached CachedReading without touching the sensor.
+
+        Before the first successful sample the value is None (and stale).
+        """
+        with self.lock:
+            stale = (self.value is None or self.failed or
+                     time.time() - self.timestamp > self.max_age)
+            return CachedReading(self.value, self.timestamp, stale)
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            self.sample()
+            self.wakeup.wait(max(0.0, self.interval - (time.time() - started)))
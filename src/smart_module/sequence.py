@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Timer-driven sequence engine.
+
+A sequence is a list of steps (step name, command, timeout). Each step
+publishes its command on COMMAND/<target>, then the run waits for the
+step's timeout on the job scheduler's timer heap before moving on, so any
+number of sequences run concurrently without a thread or process each.
+
+Progress is published as JSON on SEQUENCE/PROGRESS/<sequence name>. A target
+may acknowledge a step by publishing the command on COMMAND/ACK/<target>;
+with require_ack, a step only completes once acknowledged (or the run fails
+after ack_timeout). SEQUENCE/CANCEL/<run id or sequence name> cancels runs.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+from job_executor import SKIP, QUEUE, CANCEL
+from utilities import SM_LOGGER
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+Step = namedtuple("Step", "name command timeout")
+
+class SequenceRun(object):
+    def __init__(self, run_id, name, target, steps):
+        self.id = run_id
+        self.name = name
+        self.target = target
+        self.steps = steps
+        self.index = -1
+        self.state = RUNNING
+        self.acked = False
+        self.waited = False
+        self.timer = None
+        self.started = time.time()
+
+    def step(self):
+        return self.steps[self.index]
+
+class SequenceEngine(object):
+    """Run sequences as state machines on a job_scheduler.JobScheduler.
+
+    send(topic, message) publishes; timers provides call_later().
+    """
+
+    def __init__(self, timers, send, require_ack=False, ack_timeout=30.0):
+        self.timers = timers
+        self.send = send
+        self.require_ack = require_ack
+        self.ack_timeout = ack_timeout
+        self.runs = {}
+        self.pending = {}
+        self.counter = 0
+        self.lock = threading.RLock()
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self, name, target, steps, overlap=SKIP):
+        """Start sequence 'name' on 'target'. Return the run id, or None if skipped.
+
+        overlap says what to do if this sequence is already running on target:
+        skip the new run, queue it behind the current one, or cancel the
+        current one.
+        """
+        steps = [Step(*step) for step in steps]
+        if not steps:
+            self.log.warning("Sequence %s has no steps.", name)
+            return None
+        with self.lock:
+            current = [run for run in self.runs.values()
+                       if run.name == name and run.target == target]
+            if current:
+                if overlap == QUEUE:
+                    self.pending.setdefault((name, target), []).append(steps)
+                    self.log.info("Queued sequence %s on %s.", name, target)
+                    return None
+                if overlap != CANCEL:
+                    self.log.info("Sequence %s already running on %s, skipped.", name, target)
+                    return None
+                for run in current:
+                    self.finish(run, CANCELLED)
+            self.counter += 1
+            run = SequenceRun("%s-%d" % (name, self.counter), name, target, steps)
+            self.runs[run.id] = run
+            self.log.info("Running sequence %s on %s.", name, target)
+            self.advance(run)
+            return run.id
+
+    def advance(self, run):
+        """Start the run's next step, or finish it after the last one."""
+        run.index += 1
+        if run.index >= len(run.steps):
+            self.finish(run, DONE)
+            return
+        step = run.step()
+        run.acked = False
+        run.waited = False
+        self.send("COMMAND/" + run.target, step.command)
+        self.report(run)
+        run.timer = self.timers.call_later(float(step.timeout or 0), self.step_timeout, run,
+                                           run.index)
+
+    def step_timeout(self, run, index):
+        with self.lock:
+            if run.state != RUNNING or run.index != index:
+                return
+            run.waited = True
+            if run.acked or not self.require_ack:
+                self.advance(run)
+            else:
+                run.timer = self.timers.call_later(self.ack_timeout, self.ack_expired,
+                                                   run, index)
+
+    def ack_expired(self, run, index):
+        with self.lock:
+            if run.state == RUNNING and run.index == index and not run.acked:
+                self.log.warning("Sequence %s: no acknowledgement for step %s.",
+                                 run.id, run.step().name)
+                self.finish(run, FAILED)
+
+    def acknowledge(self, target, command):
+        """Record a COMMAND/ACK from 'target' for 'command'."""
+        with self.lock:
+            for run in self.runs.values():
+                if (run.target == target and run.index >= 0 and not run.acked and
+                        run.step().command == command):
+                    run.acked = True
+                    self.report(run)
+                    if run.waited:
+                        if run.timer:
+                            run.timer.cancel()
+                        self.advance(run)
+                    return True
+        return False
+
+    def cancel(self, key):
+        """Cancel the run with id 'key', or every run of the sequence named 'key'."""
+        with self.lock:
+            runs = [run for run in self.runs.values() if key in (run.id, run.name)]
+            for run in runs:
+                self.pending.pop((run.name, run.target), None)
+                self.finish(run, CANCELLED)
+        return len(runs)
+
+    def finish(self, run, state):
+        run.state = state
+        if run.timer:
+            run.timer.cancel()
+        self.runs.pop(run.id, None)
+        self.report(run)
+        self.log.info("Sequence %s %s after %.1f s.", run.id, state, time.time() - run.started)
+        queued = self.pending.get((run.name, run.target))
+        if queued:
+            steps = queued.pop(0)
+            if not queued:
+                del self.pending[(run.name, run.target)]
+            self.start(run.name, run.target, steps)
+
+    def report(self, run):
+        step = run.step() if 0 <= run.index < len(run.steps) else None
+        try:
+            self.send("SEQUENCE/PROGRESS/" + run.name, json.dumps({
+                "run": run.id,
+                "sequence": run.name,
+                "target": run.target,
+                "state": run.state,
+                "step": min(run.index + 1, len(run.steps)),
+                "steps": len(run.steps),
+                "step_name": step.name if step else None,
+                "acked": run.acked,
+                "elapsed": time.time() - run.started,
+            }))
+        except Exception, excpt:
+            self.log.exception("Error reporting sequence progress: %s", excpt)
+
+    def active(self):
+        with self.lock:
+            return sorted(self.runs)
@@ -23,24 +23,37 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import print_function
+import os
 import sys
 import time
 import datetime
 import subprocess
 import socket
 import codecs
-from multiprocessing import Process
 import urllib2
 import json
 import sqlite3                                      # https://www.sqlite.org/index.html
+import hashlib
 import logging
-import schedule                                     # sudo pip install schedule
+import threading
 import communicator
+import payload
 from influxdb import InfluxDBClient
+from analytics import AnalyticsWriter, Spool
+from line_protocol import PointEncoder, now_ns
+from history import SensorHistory
 from status import SystemStatus
 import asset_interface
 import rtc_interface
-from alert import Alert
+from alert import Alert, AlertEngine, alert_params_cache
+from readings import ReadingBuffer
+from sampler import Sampler
+from discovery import DiscoveryCache, PhaseTimer
+from job_scheduler import JobScheduler, ScheduledJob
+from job_executor import JobExecutor, OVERLAP_POLICIES, SKIP, cancelled, time_left
+from sequence import SequenceEngine
+from commands import CommandRegistry, CommandError, check_topic, parse
+from worker_pool import REJECT
 from utilities import SM_LOGGER, VERSION
 from utilities import trim
 
@@ -48,6 +61,9 @@ reload(sys)
 
 SECONDS_PER_MINUTE = 60
 MINUTES_PER_HOUR = 60
+SECONDS_PER_HOUR = SECONDS_PER_MINUTE * MINUTES_PER_HOUR
+
+PUBLISH_MODES = ("query", "batch")
 
 class Asset(object):
     """Hold Asset (sensor) information."""
@@ -61,11 +77,24 @@ class Asset(object):
         self.system = "Test"
         self.enabled = True
         self.value = None
-        self.alert = Alert(self.id)
+        self.readings = ReadingBuffer()
+        self._alert = None
+
+    @property
+    def alert(self):
+        """The Alert holding this asset's rule state, for its current id.
+
+        The id is only known once the RTC has been read, so the Alert is
+        created on first use and again if the id changes.
+        """
+        if self._alert is None or self._alert.alert_id != self.id:
+            self._alert = Alert(self.id)
+        return self._alert
 
     def __str__(self):
         """Return Asset information in JSON."""
-        return str([{"id": self.id, "name": self.name, "value": self.value}])
+        return str([{"id": self.id, "name": self.name, "value": self.value,
+                     "trend": self.readings.trend()}])
 
 class SmartModule(object):
     """Represents a HAPI Smart Module (Implementation).
@@ -78,11 +107,18 @@ class SmartModule(object):
         email: Email address of the primary site operator
         phone: Phone number of the primary site operator
         location: Location or Address of the site
+
+    If an executor (a worker_pool.WorkerPool) is given, message handlers run on
+    it and no background threads are started; the caller (see runtime.py) is
+    then responsible for driving the writer, sampler and alert engine.
+
+    The local history, alert log and analytics spool live in hapi_history.db
+    under data_dir (the working directory by default).
     """
 
-    def __init__(self):
+    def __init__(self, executor=None, publish_mode=None, data_dir=""):
         self.mock = True
-        self.comm = communicator.Communicator(self)
+        self.comm = communicator.Communicator(self, pool=executor)
         self.data_sync = DataSync()
         self.id = ""
         self.name = ""
@@ -99,6 +135,11 @@ class SmartModule(object):
         self.hostname = ""
         self.last_status = ""
         self.ifconn = InfluxDBClient("138.197.74.74", 8086, "early", "adopter")
+        self.encoder = PointEncoder()
+        history_db = os.path.join(data_dir, "hapi_history.db")
+        self.writer = AnalyticsWriter(self.ifconn, spool=Spool(history_db))
+        self.history = SensorHistory(history_db)
+        self.alert_engine = AlertEngine(dbfile=history_db)
         self.log = logging.getLogger(SM_LOGGER)
         self.rtc = rtc_interface.RTCInterface()
         self.rtc.power_on_rtc()
@@ -109,8 +150,80 @@ class SmartModule(object):
         self.asset.type = self.rtc.get_type()
         self.ai = asset_interface.AssetInterface(self.asset.type, self.rtc.mock)
         self.rtc.power_off_rtc()
+        # "query": answer ASSET/QUERY only; "batch": also publish every sampling
+        # cycle as one MODULE/BATCH message. Defaults to $HAPI_PUBLISH_MODE.
+        self.publish_mode = publish_mode or os.environ.get("HAPI_PUBLISH_MODE", "query")
+        if self.publish_mode not in PUBLISH_MODES:
+            raise ValueError("Unknown publish mode: %r" % (self.publish_mode,))
+        self.batch_status_interval = 60.0
+        self.last_batch_status = 0
+        self.batch_status = None
+        self.batch_status_lock = threading.Lock()
+        # Rule state for the assets of other modules, fed by MODULE/BATCH.
+        self.alerts = {}
+        self.sampler = Sampler(self.ai.read_values, on_sample=self.on_sample)
+        self.discovery_cache = DiscoveryCache()
+        self.timers = JobScheduler()
+        self.connect_wait = 10.0
+        self.cached_connect_wait = 3.0
+        self.scheduler_wait = 2.0
+        self.cached_scheduler_wait = 0.5
+        if executor is None:
+            self.writer.start()
+            self.alert_engine.start()
+            self.sampler.start()
 
     def discover(self):
+        """Connect to the broker and find (or become) the Scheduler.
+
+        The broker and scheduler found last time are tried first: if the
+        cached broker accepts us, the broker hosting script is skipped. Each
+        wait ends as soon as the CONNACK or SCHEDULER/RESPONSE arrives.
+        """
+        self.log.info("Performing Discovery...")
+        timer = PhaseTimer()
+        cached = self.discovery_cache.load()
+        self.comm.client.loop_start()
+
+        connected = False
+        if cached.get("broker"):
+            connected = (self.comm.connect(cached["broker"]) and
+                         self.comm.connected.wait(self.cached_connect_wait))
+            timer.mark("cached broker")
+        if not connected:
+            self.start_discovery()
+            timer.mark("discovery script")
+            # Not connect(): a cached broker that took the TCP connection but
+            # never sent a CONNACK is now broker_name.
+            if self.comm.connect(self.comm.default_broker):
+                self.comm.connected.wait(self.connect_wait)
+            timer.mark("connect")
+
+        self.announce()
+        wait = self.scheduler_wait
+        if cached.get("scheduler") == self.hostname + ".local":
+            # We were the Scheduler; nobody is likely to answer.
+            wait = min(wait, self.cached_scheduler_wait)
+        self.comm.scheduler_located.wait(wait)
+        timer.mark("scheduler")
+
+        if not self.comm.scheduler_found:
+            self.become_scheduler()
+            timer.mark("become scheduler")
+        self.save_discovery()
+        self.log.info("Discovery finished: %s", timer.report())
+        return timer
+
+    def save_discovery(self):
+        """Cache the broker and scheduler for the next startup."""
+        if not self.comm.connected.is_set():
+            return
+        scheduler = self.comm.scheduler_name
+        if self.scheduler:
+            scheduler = self.hostname + ".local"
+        self.discovery_cache.save(self.comm.broker_name, scheduler)
+
+    def start_discovery(self):
         if self.rtc.mock:
             print("Mock Smart Module hosting asset ", self.asset.id, self.asset.type,
                   self.asset.context)
@@ -118,44 +231,39 @@ class SmartModule(object):
             print("Real Smart Module hosting asset ", self.asset.id, self.asset.type,
                   self.asset.context)
 
-        self.log.info("Performing Discovery...")
         subprocess.call("sudo ./host-hapi.sh", shell=True)
         self.comm.smart_module = self
-        self.comm.client.loop_start()
-        self.comm.connect()
-        t_end = time.time() + 10
-        while (time.time() < t_end) and not self.comm.is_connected:
-            time.sleep(1)
 
+    def announce(self):
+        """Look for a Scheduler and announce ourselves."""
         self.comm.subscribe("SCHEDULER/RESPONSE")
-        self.comm.send("SCHEDULER/QUERY", "Where are you?")
-
         self.hostname = socket.gethostname()
+        self.comm.send("SCHEDULER/QUERY", "Where are you?")
         self.comm.send("ANNOUNCE", self.hostname + " is online.")
 
-        t_end = time.time() + 2
-        while (time.time() < t_end) and not self.comm.is_connected:
-            time.sleep(1)
-
-        if not self.comm.scheduler_found:
-            # Loading scheduled jobs
-            try:
-                self.log.info("No Scheduler found. Becoming the Scheduler.")
-                self.scheduler = Scheduler()
-                self.scheduler.smart_module = self
-                # running is always True after object creation. Should we remove it?
-                # self.scheduler.running = True
-                self.scheduler.prepare_jobs(self.scheduler.load_schedule())
-                self.comm.scheduler_found = True
-                self.comm.subscribe("SCHEDULER/QUERY")
-                self.comm.unsubscribe("SCHEDULER/RESPONSE")
-                self.comm.subscribe("STATUS/RESPONSE")
-                self.comm.subscribe("ASSET/RESPONSE" + "/#")
-                self.comm.send("SCHEDULER/RESPONSE", socket.gethostname() + ".local")
-                self.comm.send("ANNOUNCE", socket.gethostname() + ".local is running the Scheduler.")
-                self.log.info("Scheduler program loaded.")
-            except Exception, excpt:
-                self.log.exception("Error initializing scheduler. %s", excpt)
+    def become_scheduler(self):
+        # Loading scheduled jobs
+        try:
+            self.log.info("No Scheduler found. Becoming the Scheduler.")
+            self.scheduler = Scheduler(self.timers)
+            self.scheduler.smart_module = self
+            # running is always True after object creation. Should we remove it?
+            # self.scheduler.running = True
+            self.scheduler.reload_schedule(force=True)
+            self.scheduler.watch_schedule()
+            self.comm.scheduler_found = True
+            self.comm.subscribe("SCHEDULER/QUERY")
+            self.comm.unsubscribe("SCHEDULER/RESPONSE")
+            self.comm.subscribe("STATUS/RESPONSE")
+            self.comm.subscribe("ASSET/RESPONSE" + "/#")
+            self.comm.subscribe("MODULE/BATCH" + "/+")
+            self.comm.subscribe("SEQUENCE/CANCEL" + "/+")
+            self.comm.subscribe("COMMAND/ACK" + "/+")
+            self.comm.send("SCHEDULER/RESPONSE", socket.gethostname() + ".local")
+            self.comm.send("ANNOUNCE", socket.gethostname() + ".local is running the Scheduler.")
+            self.log.info("Scheduler program loaded.")
+        except Exception, excpt:
+            self.log.exception("Error initializing scheduler. %s", excpt)
 
     def load_site_data(self):
         field_names = '''
@@ -184,91 +292,163 @@ class SmartModule(object):
         except Exception, excpt:
             self.log.exception("Error loading site data: %s", excpt)
 
-    def connect_influx(self, asset_context):
-        """Connect to InfluxDB server and searches for the database in 'asset_context'.
-           Return the connection to the database or create it if necessary."""
-        databases = self.ifconn.get_list_database()
-        found = False
-        for db in databases:
-            if asset_context in db:
-                found = True
-                break
-
-        if found is False:
-            self.ifconn.create_database(asset_context)
-
-        self.ifconn.switch_database(asset_context)
-        return self.ifconn
-
     def push_sysinfo(self, asset_context, information):
-        """Push System Status (stats) information to InfluxDB server."""
-        timestamp = datetime.datetime.now()
-        conn = self.connect_influx(asset_context)
-        cpuinfo = [{"measurement": "cpu", "tags": {"asset": self.name}, "time": timestamp,
-                    "fields": {
-                        "unit": "percentage",
-                        "load": information.cpu["percentage"]
-                    }
-                   }]
-        meminfo = [{"measurement": "memory", "tags": {"asset": self.name}, "time": timestamp,
-                    "fields": {
-                        "unit": "bytes",
-                        "free": information.memory["free"],
-                        "used": information.memory["used"],
-                        "cached": information.memory["cached"]
-                    }
-                   }]
-        netinfo = [{"measurement": "network", "tags": {"asset": self.name}, "time": timestamp,
-                    "fields": {
-                        "unit": "packets",
-                        "packet_recv": information.network["packet_recv"],
-                        "packet_sent": information.network["packet_sent"]
-                    }
-                   }]
-        botinfo = [{"measurement": "boot", "tags": {"asset": self.name}, "time": timestamp,
-                    "fields": {
-                        "unit": "timestamp",
-                        "date": information.boot
-                    }
-                   }]
-        diskinf = [{"measurement": "disk", "tags": {"asset": self.name}, "time": timestamp,
-                    "fields": {
-                        "unit": "bytes",
-                        "total": information.disk["total"],
-                        "free": information.disk["free"],
-                        "used": information.disk["used"]
-                    }
-                   }]
-        ctsinfo = [{"measurement": "clients", "tags": {"asset": self.name}, "time": timestamp,
-                    "fields": {
-                        "unit": "integer",
-                        "clients": information.clients
-                    }
-                   }]
-        json = cpuinfo + meminfo + netinfo + botinfo + diskinf + ctsinfo
-        conn.write_points(json)
+        """Push System Status (stats) information to InfluxDB server.
+
+        Points are tagged with the id of the module that reported the status.
+        """
+        timestamp = now_ns()
+        tag_set = self.encoder.tags(("asset", self.name),
+                                    ("module", information.module or self.asset.id))
+        points = (
+            ("cpu", (("unit", "percentage"),
+                     ("load", information.cpu["percentage"]))),
+            ("memory", (("unit", "bytes"),
+                        ("free", information.memory["free"]),
+                        ("used", information.memory["used"]),
+                        ("cached", information.memory["cached"]))),
+            ("network", (("unit", "packets"),
+                         ("packet_recv", information.network["packet_recv"]),
+                         ("packet_sent", information.network["packet_sent"]))),
+            ("boot", (("unit", "timestamp"),
+                      ("date", information.boot))),
+            ("disk", (("unit", "bytes"),
+                      ("total", information.disk["total"]),
+                      ("free", information.disk["free"]),
+                      ("used", information.disk["used"]))),
+            ("clients", (("unit", "integer"),
+                         ("clients", information.clients))),
+        )
+        lines = [self.encoder.encode(measurement, tag_set, fields, timestamp)
+                 for measurement, fields in points]
+        self.writer.write(asset_context, lines)
 
     def get_status(self, brokerconnections):
         """Fetch system information (stats) and return a list with a single dictionary (JSON)."""
         try:
             sysinfo = SystemStatus(update=True)
             sysinfo.clients = brokerconnections
+            sysinfo.module = self.asset.id
             return sysinfo
         except Exception, excpt:
             self.log.exception("Error getting System Status: %s", excpt)
 
     def on_query_status(self):
         """It'll be called by the Scheduler to ask for System Status information."""
-        self.comm.send("STATUS/QUERY", "I might need to know how you are!")
+        self.comm.send("STATUS/QUERY", payload.BINARY)
 
     def on_check_alert(self):
         """It'll called by the Scheduler to ask for Alert Conditions."""
-        self.comm.send("ASSET/QUERY/" + self.asset.id, "Is it warm here?")
+        self.comm.send("ASSET/QUERY/" + self.asset.id, payload.BINARY)
+
+    def on_sample(self, value, timestamp):
+        """Called by the Sampler with every new (median filtered) reading."""
+        self.asset.value = value
+        self.asset.readings.append(value, timestamp)
+        try:
+            # Every module keeps the history of its own asset and answers
+            # HISTORY/QUERY for it (see send_history).
+            self.history.record(self.asset.id, value, self.asset.unit, timestamp)
+        except Exception, excpt:
+            self.log.exception("Error recording sensor history: %s", excpt)
+        if self.publish_mode == "batch":
+            self.publish_batch(timestamp)
+
+    def publish_batch(self, timestamp):
+        """Publish this cycle's readings (and status, now and then) as one message."""
+        try:
+            readings = [payload.Reading(self.asset.id, timestamp, self.asset.unit,
+                                        payload.GOOD, self.asset.value)]
+            probes = self.sampler.probes
+            if len(probes) > 1:
+                for probe_id, value in sorted(probes.items()):
+                    readings.append(payload.Reading(self.asset.id + "/" + probe_id, timestamp,
+                                                    self.asset.unit, payload.GOOD, value))
+            with self.batch_status_lock:
+                status, self.batch_status = self.batch_status, None
+            if time.time() - self.last_batch_status >= self.batch_status_interval:
+                self.last_batch_status = time.time()
+                # Measuring the CPU takes most of a second, so the status is
+                # collected on the worker pool and sent with a later batch.
+                self.comm.pool.submit(self.collect_batch_status, policy=REJECT)
+            batch = payload.Batch(self.asset.id, self.asset.name, self.asset.context,
+                                  readings, status)
+            self.comm.send("MODULE/BATCH/" + self.asset.id, payload.encode_batch(batch))
+        except Exception, excpt:
+            self.log.exception("Error publishing batch: %s", excpt)
+
+    def collect_batch_status(self):
+        status = self.get_status(self.comm.broker_connections)
+        with self.batch_status_lock:
+            self.batch_status = status
+
+    def alert_for(self, asset_id):
+        """Return the Alert holding the rule state of asset_id."""
+        if asset_id == self.asset.id:
+            return self.asset.alert
+        alert = self.alerts.get(asset_id)
+        if alert is None:
+            alert = self.alerts.setdefault(asset_id, Alert(asset_id))
+        return alert
+
+    def store_batch(self, batch):
+        """Fan a MODULE/BATCH message out to alerts and analytics at once.
+
+        Probe readings are tagged with their probe id, so every probe is a
+        series of its own; the module's own reading keeps the series that
+        push_data writes.
+        """
+        lines = []
+        fired = []
+        for reading in batch.readings:
+            if reading.quality == payload.FAILED:
+                continue
+            probe = reading.asset_id if reading.asset_id != batch.module else ""
+            try:
+                lines.append(self.encoder.encode(
+                    batch.context,
+                    self.encoder.tags(("site", self.name), ("asset", batch.name),
+                                      ("probe", probe)),
+                    (("value", reading.value), ("unit", reading.unit)),
+                    int(reading.timestamp * 1000000000)))
+            except ValueError, excpt:
+                self.log.warning("Skipping reading of %s: %s", reading.asset_id, excpt)
+                continue
+            self.alert_engine.update(reading.asset_id, reading.value, reading.timestamp)
+            fired.extend(self.alert_for(reading.asset_id).check_rules(reading.value,
+                                                                      reading.timestamp))
+        if fired:
+            self.alert_engine.record(fired)
+        if lines:
+            self.writer.write(batch.context, lines)
+        if batch.status:
+            self.push_sysinfo("system", batch.status)
+
+    def get_reading(self):
+        """Return the latest sampled value as a payload.Reading."""
+        try:
+            reading = self.sampler.latest()
+            if reading.value is not None:
+                quality = payload.STALE if reading.stale else payload.GOOD
+                return payload.Reading(self.asset.id, reading.timestamp, self.asset.unit,
+                                       quality, reading.value)
+        except Exception, excpt:
+            self.log.exception("Error getting asset data: %s", excpt)
+        return payload.Reading(self.asset.id, time.time(), self.asset.unit, payload.FAILED, -1000)
 
     def get_asset_data(self):
+        """Return the latest sampled value; sensors are read by the Sampler.
+
+        The legacy format can't flag a stale value, so it is reported as a
+        failed read (-1000).
+        """
         value = -1000
         try:
-            value = str(self.ai.read_value())
+            reading = self.sampler.latest()
+            if reading.stale:
+                self.log.warning("Asset data is stale (sampled at %s).", reading.timestamp)
+            elif reading.value is not None:
+                value = str(reading.value)
         except Exception, excpt:
             self.log.exception("Error getting asset data: %s", excpt)
         return value
@@ -297,26 +477,72 @@ class SmartModule(object):
 
     def push_data(self, asset_name, asset_context, value, unit):
         try:
-            conn = self.connect_influx(asset_context)
-            json_body = [
-                {
-                    "measurement": asset_context,
-                    "tags": {
-                        "site": self.name,
-                        "asset": asset_name
-                    },
-                    "time": str(datetime.datetime.now()),
-                    "fields": {
-                        "value": value,
-                        "unit": unit
-                    }
-                }
-            ]
-            conn.write_points(json_body)
-            self.log.info("Wrote to analytic database: %s", json_body)
+            line = self.encoder.encode(asset_context,
+                                       self.encoder.tags(("site", self.name),
+                                                         ("asset", asset_name)),
+                                       (("value", value), ("unit", unit)), now_ns())
+            self.writer.write(asset_context, [line])
+            self.log.info("Queued for analytic database: %s", line)
         except Exception, excpt:
             self.log.exception('Error writing to analytic database: %s', excpt)
 
+    def send_history(self, asset_id, payload):
+        """Answer a HISTORY/QUERY from the local sensor history.
+
+        payload is JSON with "start" and "end" (Unix time), and optionally
+        "resolution" (seconds), "page_size" and "request" (echoed back).
+        Pages are published on HISTORY/RESPONSE/<asset_id>. Only the module
+        hosting the asset keeps its history, so only that module answers.
+        """
+        if asset_id != self.asset.id:
+            return
+
+        topic = "HISTORY/RESPONSE/" + asset_id
+        query = None
+        try:
+            query = json.loads(payload)
+            end = float(query.get("end", time.time()))
+            start = float(query.get("start", end - SECONDS_PER_HOUR))
+            resolution = int(query.get("resolution", 0))
+            page_size = int(query.get("page_size", 500))
+            if page_size <= 0:
+                raise ValueError("page_size must be positive, got %d" % page_size)
+        except (ValueError, TypeError, AttributeError), excpt:
+            self.log.warning("Rejecting history query %r: %s", payload, excpt)
+            self.comm.send(topic, json.dumps({
+                "request": query.get("request") if isinstance(query, dict) else None,
+                "asset_id": asset_id,
+                "page": 0,
+                "last": True,
+                "points": [],
+                "error": str(excpt),
+            }))
+            return
+
+        try:
+            page = 0
+            for resolution, points in self.history.query(asset_id, start, end,
+                                                         resolution=resolution,
+                                                         page_size=page_size):
+                self.comm.send(topic, json.dumps({
+                    "request": query.get("request"),
+                    "asset_id": asset_id,
+                    "resolution": resolution,
+                    "page": page,
+                    "last": False,
+                    "points": points,
+                }))
+                page += 1
+            self.comm.send(topic, json.dumps({
+                "request": query.get("request"),
+                "asset_id": asset_id,
+                "page": page,
+                "last": True,
+                "points": [],
+            }))
+        except Exception, excpt:
+            self.log.exception("Error answering history query: %s", excpt)
+
     def get_weather(self):
         response = ""
         url = (
@@ -329,7 +555,8 @@ class SmartModule(object):
         )
 
         try:
-            f = urllib2.urlopen(url)
+            # As a scheduled job, give up when the job times out.
+            f = urllib2.urlopen(url, timeout=time_left(30.0))
             json_string = f.read()
             parsed_json = json.loads(json_string)
             response = parsed_json['current_observation']
@@ -390,10 +617,30 @@ class SmartModule(object):
             self.log.exception("Error getting environment data: %s", excpt)
 
 class Scheduler(object):
-    def __init__(self):
+    job_field_names = ["timeout", "overlap"]
+    # Jobs that used to be recognized by name rather than by their command.
+    legacy_job_commands = {
+        "Log Data": "log_data",
+        "Log Status": "log_status",
+    }
+
+    def __init__(self, timers, workers=4):
         self.running = True
         self.smart_module = None
-        self.processes = []
+        self.timers = timers
+        self.executor = JobExecutor(workers=workers)
+        self.executor.start()
+        self.timers.dispatch = self.dispatch
+        self.sequences = SequenceEngine(timers, self.send)
+        self.commands = CommandRegistry()
+        self.commands.register("log_data", self.log_data)
+        self.commands.register("log_status", self.log_status)
+        self.commands.register("get_weather", self.get_weather)
+        self.commands.register("send_command", self.send_command, self.check_command)
+        self.jobs = {}
+        self.jobs_lock = threading.RLock()
+        self.data_version = None
+        self.schedule_digest = None
         self.log = logging.getLogger(SM_LOGGER)
 
     class Job(object):
@@ -408,29 +655,66 @@ class Scheduler(object):
             self.enabled = False
             self.sequence = ""
             self.timeout = 0.0
+            self.overlap = SKIP
             self.virtual = False
+            self.action = None
 
-    def process_sequence(self, seq_jobs, job, job_rtu, seq_result):
-        for row in seq_jobs:
-            name, command, step_name, timeout = row
-            seq_result.put(
-                'Running {name}:{step_name}({command}) on {id} at {address}.'.
-                format(
-                    name=name,
-                    step_name=step_name,
-                    command=job.command,
-                    id=job.rtuid,
-                    address=job_rtu.address,
-                )
-            )
-            command = command.encode("ascii")
-            timeout = int(timeout)
-            self.site.comm.send("COMMAND/" + job.rtuid, command)
-            time.sleep(timeout)
-
-    def load_schedule(self):
-        jobs = []
-        self.log.info("Loading Schedule Data...")
+    def send(self, topic, message):
+        self.smart_module.comm.send(topic, message)
+
+    def log_data(self):
+        # Every module listens on ASSET/QUERY(/#); MQTT can't publish to a wildcard.
+        self.send("ASSET/QUERY", payload.BINARY)
+
+    def log_status(self):
+        self.send("STATUS/QUERY", payload.BINARY)
+
+    def get_weather(self):
+        return self.smart_module.get_weather()
+
+    def send_command(self, command, target):
+        self.send("COMMAND/" + str(target), command)
+
+    @staticmethod
+    def check_command(command, target):
+        check_topic("COMMAND/" + str(target))
+
+    def compile_command(self, job):
+        """Resolve a job's command into a bound Command (None for sequences).
+
+        A command of a non-virtual job that isn't a registered command is a
+        device command and is sent to the job's asset.
+        """
+        if job.sequence:
+            check_topic("COMMAND/" + str(job.asset_id))
+            return None
+        text = self.legacy_job_commands.get(job.name, job.command)
+        if not job.virtual:
+            try:
+                name, _ = parse(text)
+            except CommandError:
+                name = None
+            if name not in self.commands.commands:
+                return self.commands.bind("send_command", (text, job.asset_id))
+        return self.commands.compile(text)
+
+    def load_sequence(self, name):
+        """Return the (step_name, command, timeout) steps of sequence 'name'."""
+        command = '''
+            SELECT step_name, command, timeout
+            FROM sequence
+            WHERE name=?
+            ORDER BY step ;
+        ''', (name,)
+        database = sqlite3.connect('hapi_core.db')
+        try:
+            return [(step_name, command.encode("ascii"), timeout)
+                    for step_name, command, timeout in database.cursor().execute(*command)]
+        finally:
+            database.close()
+
+    def read_schedule(self):
+        """Return the field names and rows of the schedule table, ordered by id."""
         field_names = '''
             id
             name
@@ -443,116 +727,195 @@ class Scheduler(object):
             sequence
             virtual
         '''.split()
+        sql = 'SELECT {fields} FROM schedule ORDER BY id;'
+        database = sqlite3.connect("hapi_core.db")
         try:
-            sql = 'SELECT {fields} FROM schedule;'.format(
-                fields=', '.join(field_names))
-            database = sqlite3.connect("hapi_core.db")
-            db_jobs = database.cursor().execute(sql)
-            for row in db_jobs:
+            try:
+                fields = field_names + self.job_field_names
+                rows = database.cursor().execute(sql.format(fields=', '.join(fields))).fetchall()
+            except sqlite3.OperationalError:
+                # Schedule tables from before job timeouts/overlap policies.
+                fields = field_names
+                rows = database.cursor().execute(sql.format(fields=', '.join(fields))).fetchall()
+        finally:
+            database.close()
+        return fields, rows
+
+    def load_schedule(self, schedule=None):
+        """Build Jobs from read_schedule() (or the given (fields, rows))."""
+        jobs = []
+        self.log.info("Loading Schedule Data...")
+        try:
+            fields, rows = schedule or self.read_schedule()
+            for row in rows:
                 job = Scheduler.Job()
-                for field_name, field_value in zip(field_names, row):
+                for field_name, field_value in zip(fields, row):
                     setattr(job, field_name, field_value)
+                try:
+                    job.action = self.compile_command(job)
+                except CommandError, excpt:
+                    self.log.error("Skipping job %s: %s", job.name, excpt)
+                    continue
                 jobs.append(job)
-            database.close()
             self.log.info("Schedule Data Loaded.")
         except Exception, excpt:
             self.log.exception("Error loading schedule. %s", excpt)
 
         return jobs
 
+    @staticmethod
+    def read_data_version():
+        database = sqlite3.connect("hapi_core.db")
+        try:
+            row = database.cursor().execute("SELECT data_version FROM db_info;").fetchone()
+            return row[0] if row else None
+        finally:
+            database.close()
+
+    def reload_schedule(self, force=False):
+        """Apply schedule changes made since the last load. Return True if reloaded."""
+        changes = self.read_schedule_changes(force)
+        return bool(changes) and self.apply_schedule(*changes)
+
+    def read_schedule_changes(self, force=False):
+        """Return (digest, jobs) if the schedule changed since the last read, else None.
+
+        A db_info.data_version equal to last time means nothing changed;
+        without a data_version the schedule rows are hashed instead.
+        """
+        # Held while reading so a SYNCHRONIZE/DATA reload and the periodic
+        # check can't interleave their reads of the versions.
+        with self.jobs_lock:
+            try:
+                version = self.read_data_version()
+                if not force and version and version == self.data_version:
+                    return None
+                schedule = self.read_schedule()
+            except sqlite3.Error, excpt:
+                self.log.warning("Could not check the schedule for changes: %s", excpt)
+                return None
+
+            digest = hashlib.sha1(repr(schedule)).hexdigest()
+            self.data_version = version
+            if not force and digest == self.schedule_digest:
+                return None
+            self.schedule_digest = digest
+        return digest, self.load_schedule(schedule)
+
+    def apply_schedule(self, digest, jobs):
+        """Put jobs read with 'digest' on the heap unless a newer read superseded them."""
+        with self.jobs_lock:
+            if digest != self.schedule_digest:
+                self.log.info("Skipping a schedule superseded by a newer read.")
+                return False
+            self.prepare_jobs(jobs)
+            return True
+
+    def watch_schedule(self, interval=60.0):
+        """Check for schedule changes every 'interval' seconds.
+
+        The schedule is read and compiled on the executor; only the heap
+        update runs on the timer thread.
+        """
+        def read():
+            try:
+                changes = self.read_schedule_changes()
+                if changes:
+                    self.timers.call_later(0, self.apply_schedule, *changes)
+            finally:
+                if self.running:
+                    self.timers.call_later(interval, check)
+
+        def check():
+            if not self.executor.submit("reload_schedule", read) and self.running:
+                self.timers.call_later(interval, check)
+        self.timers.call_later(interval, check)
+
     def prepare_jobs(self, jobs):
-        # It still have space for improvements.
-        for job in jobs:
-            if not job.enabled:
-                continue
+        """Bring the timer heap in line with 'jobs', touching only what changed.
+
+        Jobs are matched by id. A job whose timing (unit, interval, at_time)
+        is unchanged keeps its next fire time even if its command changed.
+        Every new or retimed job is validated before the heap is touched; an
+        invalid one is dropped.
+        """
+        with self.jobs_lock:
+            jobs = dict((job.id, job) for job in jobs if job.enabled)
+            timers = {}
+            for job_id, job in jobs.items():
+                current = self.jobs.get(job_id)
+                if current is not None and self.fingerprint(current) == self.fingerprint(job):
+                    jobs[job_id] = current
+                    continue
+                if (current is not None and job_id in self.timers.jobs and
+                        self.timing(current) == self.timing(job)):
+                    continue
+                try:
+                    timers[job_id] = ScheduledJob(job.id, self.run_job, job.time_unit or "",
+                                                  job.interval, job.at_time, args=(job,))
+                except (TypeError, ValueError), excpt:
+                    del jobs[job_id]
+                    self.log.error("  Skipping job %s: %s", job.name, excpt)
+
+            for job_id in set(self.jobs) - set(jobs):
+                self.timers.remove(job_id)
+                self.log.info("  Removed job: %s", self.jobs[job_id].name)
+            added = changed = 0
+            for job_id, job in jobs.items():
+                if job_id in timers:
+                    self.timers.add(timers[job_id])
+                    self.log.info("  Loading %s job: %s", timers[job_id].time_unit, job.name)
+                    added += 1
+                elif job is not self.jobs.get(job_id):
+                    self.timers.jobs[job_id].args = (job,)
+                    self.log.info("  Updated job: %s", job.name)
+                    changed += 1
+            self.jobs = jobs
+            self.log.info("Schedule: %d jobs, %d (re)scheduled, %d updated in place.",
+                          len(jobs), added, changed)
 
-            if job.time_unit.lower() == "month":
-                if job.interval > -1:
-                    #schedule.every(job.interval).months.do(self.run_job, job)
-                    self.log.info("  Loading monthly job: " + job.name)
-            elif job.time_unit.lower() == "week":
-                if job.interval > -1:
-                    schedule.every(job.interval).weeks.do(self.run_job, job)
-                    self.log.info("  Loading weekly job: " + job.name)
-            elif job.time_unit.lower() == "day":
-                if job.interval > -1:
-                    schedule.every(job.interval).days.do(self.run_job, job)
-                    self.log.info("  Loading daily job: " + job.name)
-                else:
-                    schedule.every().day.at(job.at_time).do(self.run_job, job)
-                    self.log.info("  Loading time-based job: " + job.name)
-            elif job.time_unit.lower() == "hour":
-                if job.interval > -1:
-                    schedule.every(job.interval).hours.do(self.run_job, job)
-                    self.log.info("  Loading hourly job: " + job.name)
-            elif job.time_unit.lower() == "minute":
-                if job.interval > -1:
-                    schedule.every(job.interval).minutes.do(self.run_job, job)
-                    self.log.info("  Loading minutes job: " + job.name)
-                else:
-                    schedule.every().minute.do(self.run_job, job)
-                    self.log.info("  Loading minute job: " + job.name)
-            elif job.time_unit.lower() == "second":
-                if job.interval > -1:
-                    schedule.every(job.interval).seconds.do(self.run_job, job)
-                    self.log.info("  Loading seconds job: " + job.name)
-                else:
-                    schedule.every().second.do(self.run_job, job)
-                    self.log.info("  Loading second job: " + job.name)
+    @staticmethod
+    def timing(job):
+        return (job.time_unit, job.interval, job.at_time)
+
+    def fingerprint(self, job):
+        return tuple(getattr(job, name) for name in
+                     ("name", "asset_id", "command", "time_unit", "interval", "at_time",
+                      "enabled", "sequence", "virtual") + tuple(self.job_field_names))
+
+    def dispatch(self, scheduled):
+        """Hand a due job to the executor (called by the timer heap)."""
+        job = scheduled.args[0]
+        overlap = (job.overlap or SKIP).lower()
+        if overlap not in OVERLAP_POLICIES:
+            self.log.warning("Unknown overlap policy %r for job %s, skipping overlaps.",
+                             job.overlap, job.name)
+            overlap = SKIP
+        self.executor.submit(job.id, self.run_job, (job,), scheduled=scheduled.last_run,
+                             timeout=float(job.timeout or 0), overlap=overlap)
 
     def run_job(self, job):
         if not self.running or not job.enabled:
             return
 
-        response = ""
-        job_rtu = None
-
-        if job.sequence is None:
-            job.sequence = ""
-
-        if job.virtual:
-            print('Running virtual job:', job.name, job.command)
-            try:
-                response = eval(job.command)
-                self.smart_module.log_sensor_data(response, True)
-            except Exception, excpt:
-                self.log.exception("Error running job. %s", excpt)
-        else:
-            try:
-                if job.sequence != "":
-                    print('Running sequence', job.sequence)
-                    command = '''
-                        SELECT name, command, step_name, timeout
-                        FROM sequence
-                        WHERE name=?
-                        ORDER BY step ;
-                    ''', (job.sequence,)
-                    database = sqlite3.connect('hapi_core.db')
-                    seq_jobs = self.database.cursor().execute(*command)
-                    #print('len(seq_jobs) =', len(seq_jobs))
-                    p = Process(target=self.process_sequence, args=(seq_jobs, job, job_rtu,
-                                                                    seq_result,))
-                    p.start()
-                    database.close()
-                else:
-                    print('Running command', job.command)
-                    # Check pre-defined jobs
-                    if job.name == "Log Data":
-                        self.site.comm.send("QUERY/#", "query")
-                        # self.site.log_sensor_data(response, False, self.logger)
-
-                    elif job.name == "Log Status":
-                        self.site.comm.send("REPORT/#", "report")
-
-                    else:
-                        eval(job.command)
-                        # if job_rtu is not None:  #??? job_rtu is always None. Bug?
-                        #     self.site.comm.send("COMMAND/" + job.rtuid, job.command)
-
-                    #self.log_command(job, "")
-
-            except Exception, excpt:
-                self.log.exception('Error running job: %s', excpt)
+        try:
+            if job.sequence:
+                print('Running sequence', job.sequence)
+                self.sequences.start(job.sequence, str(job.asset_id),
+                                     self.load_sequence(job.sequence),
+                                     overlap=(job.overlap or SKIP).lower())
+            elif job.virtual:
+                print('Running virtual job:', job.name, job.action)
+                data = job.action()
+                if cancelled():
+                    self.log.info("Job %s was cancelled, not logging its data.", job.name)
+                    return
+                self.smart_module.log_sensor_data(data, True)
+            else:
+                print('Running command', job.action)
+                job.action()
+        except Exception, excpt:
+            self.log.exception('Error running job: %s', excpt)
 
 class DataSync(object):
     @staticmethod
@@ -579,6 +942,7 @@ class DataSync(object):
             database.cursor().execute(*command)
             database.commit()
             database.close()
+            alert_params_cache.invalidate()
             logging.getLogger(SM_LOGGER).info("Wrote database version: %s", version)
         except Exception, excpt:
             logging.getLogger(SM_LOGGER).info("Error writing database version: %s", excpt)
@@ -597,18 +961,34 @@ class DataSync(object):
         except Exception, excpt:
             logging.getLogger(SM_LOGGER).info("Error publishing database: %s", excpt)
 
-    def synchronize_core_db(self, data):
-        try:
-            with codecs.open("incoming.sql", "w") as fd:
-                fd.write(data)
+    def synchronize_core_db(self, data, core="hapi_core.db"):
+        """Replace the core database with the SQL dump 'data'. Return True on success.
 
-            subprocess.call('sqlite3 -init incoming.sql hapi_new.db ""', shell=True)
+        The dump is loaded into hapi_new.db next to it, which is then renamed
+        over the core database, so readers see either the old or the new one.
+        """
+        staging = os.path.join(os.path.dirname(core), "hapi_new.db")
+        try:
+            if os.path.exists(staging):
+                os.remove(staging)
+            database = sqlite3.connect(staging)
+            try:
+                database.executescript(str(data))
+                database.commit()
+            finally:
+                database.close()
+            os.rename(staging, core)
+            alert_params_cache.invalidate()
 
             logging.getLogger(SM_LOGGER).info("Synchronized database.")
+            return True
         except Exception, excpt:
-            logging.getLogger(SM_LOGGER).info("Error synchronizing database: %s", excpt)
+            logging.getLogger(SM_LOGGER).error("Error synchronizing database: %s", excpt)
+            if os.path.exists(staging):
+                os.remove(staging)
+            return False
 
-def main():
+def setup_logging():
     #max_log_size = 1000000
 
     # Setup Logging
@@ -630,6 +1010,10 @@ def main():
     console_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
+    return logger
+
+def main():
+    logger = setup_logging()
 
     try:
         smart_module = SmartModule()
@@ -638,15 +1022,13 @@ def main():
 
     except Exception, excpt:
         logger.exception("Error initializing Smart Module. %s", excpt)
+        return
 
-    while 1:
-        try:
-            time.sleep(0.5)
-            schedule.run_pending()
-
-        except Exception, excpt:
-            logger.exception("Error in Smart Module main loop. %s", excpt)
-            break
+    # Sleeps until the next scheduled job is due.
+    try:
+        smart_module.timers.run()
+    except Exception, excpt:
+        logger.exception("Error in Smart Module main loop. %s", excpt)
 
 if __name__ == "__main__":
     main()
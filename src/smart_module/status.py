@@ -44,6 +44,8 @@ class SystemStatus(object):
         self.disk = {"total": 0, "used": 0, "free": 0}
         self.timestamp = 0
         self.clients = -1
+        # Id of the module reporting this status (see payload.encode_status).
+        self.module = ""
         if update:
             self.update()
 
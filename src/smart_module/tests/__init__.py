@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Unit tests for the Smart Module. From the repository root run:
+
+    python -m unittest discover -s src/smart_module/tests -t src/smart_module
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import logging
+
+# The Smart Module modules import each other as top-level modules.
+SMART_MODULE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SMART_MODULE_DIR not in sys.path:
+    sys.path.insert(0, SMART_MODULE_DIR)
+
+from utilities import SM_LOGGER
+
+# Keep expected error logs out of the test output.
+logging.getLogger(SM_LOGGER).addHandler(logging.NullHandler())
+logging.getLogger(SM_LOGGER).propagate = False
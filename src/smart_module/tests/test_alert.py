@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the alert engine and the statistical alert rules.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import alert
+from alert import Alert, AlertEngine, AlertParamsCache, EwmaRule, SlopeRule, VarianceRule
+
+class FakeParamsCache(object):
+    def __init__(self, params):
+        self.params = params
+
+    def all(self):
+        return self.params
+
+class AlertParamsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.directory, "hapi_core.db")
+        self.execute('''
+            CREATE TABLE alert_params (asset_id int, lower_threshold real, upper_threshold real,
+                message text, response_type text, rule_type text, rule_window real,
+                rule_limit real);
+            CREATE TABLE db_info (schema_version text, data_version text);
+            INSERT INTO db_info VALUES ('1', 'v1');
+            INSERT INTO alert_params VALUES (1, 10, 20, 'Too hot', 'sms', '', NULL, NULL);
+            INSERT INTO alert_params VALUES (1, NULL, NULL, 'Rising', 'sms', 'slope', 3600, 2);
+        ''')
+        self.cache = AlertParamsCache(self.dbfile, version_check_interval=60.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def execute(self, script):
+        database = sqlite3.connect(self.dbfile)
+        try:
+            database.executescript(script)
+            database.commit()
+        finally:
+            database.close()
+
+    def test_loads_thresholds_and_rules(self):
+        self.assertEqual(sorted(self.cache.all()), ["1"])
+        self.assertEqual(self.cache.all()["1"]["upper_threshold"], 20.0)
+        (rule,) = self.cache.get_rules("1")
+        self.assertEqual((rule["rule_type"], rule["rule_window"]), ("slope", 3600.0))
+
+    def test_reloads_when_the_data_version_changes(self):
+        params = self.cache.all()
+        self.execute('''
+            UPDATE alert_params SET upper_threshold = 25 WHERE rule_type = '';
+            UPDATE db_info SET data_version = 'v2';
+        ''')
+        # Within the check interval the cached parameters are kept.
+        self.assertIs(self.cache.all(), params)
+        self.cache.last_version_check -= 60.0
+        self.assertEqual(self.cache.all()["1"]["upper_threshold"], 25.0)
+        self.assertEqual(self.cache.data_version, "v2")
+
+    def test_unchanged_version_keeps_the_cache(self):
+        params = self.cache.all()
+        self.execute("UPDATE alert_params SET upper_threshold = 25 WHERE rule_type = '';")
+        self.cache.last_version_check -= 60.0
+        self.assertIs(self.cache.all(), params)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.all()["1"]["upper_threshold"], 25.0)
+
+class AlertEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        dbfile = os.path.join(self.directory, "hapi_history.db")
+        database = sqlite3.connect(dbfile)
+        database.execute("CREATE TABLE alert_log (asset_id int, value real, timestamp text);")
+        database.close()
+        cache = FakeParamsCache({"1": {"lower_threshold": 10.0, "upper_threshold": 20.0,
+                                       "message": "Too hot"}})
+        self.engine = AlertEngine(cache, hysteresis=0.1, debounce=30, cooldown=0,
+                                  dbfile=dbfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stop_wakes_the_engine_thread(self):
+        self.engine.interval = 60.0
+        self.engine.start()
+        started = time.time()
+        self.engine.stop()
+        self.assertLess(time.time() - started, 5.0)
+
+    def test_single_bad_reading_never_fires(self):
+        self.engine.update("1", 25.0, 1000.0)
+        self.assertEqual(self.engine.evaluate(now=1000.0), [])
+        self.assertEqual(self.engine.evaluate(now=2000.0), [])
+
+    def test_breach_must_persist_across_readings(self):
+        self.engine.update("1", 25.0, 1000.0)
+        self.engine.update("1", 26.0, 1020.0)
+        self.assertEqual(self.engine.evaluate(now=1020.0), [])
+        self.engine.update("1", 27.0, 1030.0)
+        fired = self.engine.evaluate(now=1030.0)
+        self.assertEqual(fired, [("1", 27.0, 1030.0, "Too hot")])
+
+    def test_good_reading_resets_the_debounce(self):
+        self.engine.update("1", 25.0, 1000.0)
+        self.engine.update("1", 15.0, 1010.0)
+        self.engine.update("1", 25.0, 1020.0)
+        self.engine.update("1", 25.0, 1040.0)
+        self.assertEqual(self.engine.evaluate(now=1040.0), [])
+
+    def test_repeated_reading_is_ignored(self):
+        self.engine.update("1", 25.0, 1000.0)
+        self.engine.update("1", 15.0, 1000.0)
+        self.engine.update("1", 25.0, 1030.0)
+        self.assertEqual(len(self.engine.evaluate(now=1030.0)), 1)
+
+    def test_hysteresis_is_relative_to_the_band(self):
+        self.engine.update("1", 25.0, 1000.0)
+        self.engine.update("1", 25.0, 1030.0)
+        self.assertEqual(len(self.engine.evaluate(now=1030.0)), 1)
+        # Inside the band but within 10% of its width from the edge: still active.
+        self.engine.update("1", 19.5, 1040.0)
+        self.engine.evaluate(now=1040.0)
+        self.engine.update("1", 25.0, 1050.0)
+        self.engine.update("1", 25.0, 1080.0)
+        self.assertEqual(self.engine.evaluate(now=1080.0), [])
+        # Back well inside: cleared, so a new breach fires again.
+        self.engine.update("1", 15.0, 1090.0)
+        self.engine.evaluate(now=1090.0)
+        self.engine.update("1", 25.0, 1100.0)
+        self.engine.update("1", 25.0, 1130.0)
+        self.assertEqual(len(self.engine.evaluate(now=1130.0)), 1)
+
+    def test_narrow_band_can_clear(self):
+        cache = FakeParamsCache({"1": {"lower_threshold": 6.8, "upper_threshold": 7.2,
+                                       "message": "pH"}})
+        engine = AlertEngine(cache, debounce=0, cooldown=0, dbfile=self.engine.dbfile)
+        engine.update("1", 8.0, 1000.0)
+        self.assertEqual(len(engine.evaluate(now=1000.0)), 1)
+        engine.update("1", 7.0, 1010.0)
+        engine.evaluate(now=1010.0)
+        engine.update("1", 8.0, 1020.0)
+        self.assertEqual(len(engine.evaluate(now=1020.0)), 1)
+
+    def test_fired_alerts_are_logged(self):
+        self.engine.update("1", 25.0, 1000.0)
+        self.engine.update("1", 25.0, 1030.0)
+        self.engine.evaluate(now=1030.0)
+        database = sqlite3.connect(self.engine.dbfile)
+        rows = database.execute("SELECT asset_id, value FROM alert_log;").fetchall()
+        database.close()
+        self.assertEqual(rows, [(1, 25.0)])
+
+class SlopeRuleTest(unittest.TestCase):
+    def test_slope_in_units_per_hour(self):
+        rule = SlopeRule(3600, -2.0)
+        fired = [rule.breached(20.0 - 3.0 * minutes / 60.0, 1000.0 + 60 * minutes)
+                 for minutes in range(31)]
+        self.assertFalse(any(fired[:30]))
+        self.assertTrue(fired[30])
+        self.assertAlmostEqual(rule.slope(), -3.0)
+
+    def test_rebase_keeps_the_slope_exact(self):
+        rule = SlopeRule(600, 1.0)
+        start = 1.5e9
+        for second in range(0, 7 * 86400, 60):
+            rule.breached(0.001 * second / 3600.0, start + second)
+        self.assertLessEqual(rule.points[0][0], 600 / 3600.0)
+        self.assertGreater(rule.origin, start)
+        self.assertAlmostEqual(rule.slope(), 0.001, places=9)
+
+class EwmaRuleTest(unittest.TestCase):
+    def test_outlier_fires_after_warmup(self):
+        rule = EwmaRule(60, 3.0)
+        fired = [rule.breached(20.0 + (0.1 if i % 2 else -0.1), 1000.0 + 10 * i)
+                 for i in range(5)]
+        self.assertFalse(any(fired))
+        self.assertFalse(rule.breached(30.0, 1050.0))
+        for i in range(6, 20):
+            rule.breached(20.0 + (0.1 if i % 2 else -0.1), 1000.0 + 10 * i)
+        self.assertTrue(rule.breached(30.0, 1200.0))
+
+    def test_weight_follows_elapsed_time(self):
+        rule = EwmaRule(60, 3.0)
+        rule.breached(0.0, 0.0)
+        rule.breached(10.0, 60.0)
+        self.assertAlmostEqual(rule.mean, 10.0 * (1 - 2.718281828459045 ** -1))
+
+class VarianceRuleTest(unittest.TestCase):
+    def test_window_is_in_seconds(self):
+        rule = VarianceRule(100, 1.0)
+        for second in range(0, 100, 10):
+            self.assertFalse(rule.breached(5.0, float(second)))
+        fired = [rule.breached(value, 100.0 + 5 * i)
+                 for i, value in enumerate([0.0, 10.0, 0.0, 10.0])]
+        self.assertTrue(fired[-1])
+        self.assertEqual(rule.points[0][0], 20.0)
+
+    def test_matches_the_plain_variance(self):
+        rule = VarianceRule(50, 100.0)
+        values = [float((i * 7) % 11) for i in range(40)]
+        for i, value in enumerate(values):
+            rule.breached(value, float(i * 5))
+        window = [value for i, value in enumerate(values) if i * 5 >= 195 - 50]
+        mean = sum(window) / len(window)
+        variance = sum((value - mean) ** 2 for value in window) / len(window)
+        self.assertAlmostEqual(rule.m2 / len(rule.points), variance)
+
+class RulesCache(object):
+    def __init__(self, rules):
+        self.rules = rules
+
+    def get_rules(self, asset_id):
+        return [dict(rule) for rule in self.rules]
+
+class AlertRulesTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_cache = alert.alert_params_cache
+        alert.alert_params_cache = RulesCache([
+            {"rule_type": "variance", "rule_window": 60.0, "rule_limit": 1.0, "message": ""}])
+
+    def tearDown(self):
+        alert.alert_params_cache = self.saved_cache
+
+    def test_reload_with_same_parameters_keeps_rule_state(self):
+        asset = Alert("1")
+        asset.check_rules(5.0, 1000.0)
+        rule = asset.rules[0][0]
+        asset.check_rules(5.0, 1010.0)
+        self.assertIs(asset.rules[0][0], rule)
+        self.assertEqual(len(rule.points), 2)
+
+    def test_older_readings_are_skipped(self):
+        asset = Alert("1")
+        asset.check_rules(5.0, 1010.0)
+        asset.check_rules(6.0, 1000.0)
+        self.assertEqual(list(asset.rules[0][0].points), [(1010.0, 5.0)])
+
+    def test_changed_parameters_rebuild_rules(self):
+        asset = Alert("1")
+        asset.check_rules(5.0, 1000.0)
+        rule = asset.rules[0][0]
+        alert.alert_params_cache.rules[0]["rule_limit"] = 2.0
+        asset.check_rules(5.0, 1010.0)
+        self.assertIsNot(asset.rules[0][0], rule)
+
+if __name__ == "__main__":
+    unittest.main()
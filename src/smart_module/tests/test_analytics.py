@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the analytics writer and its on-disk spool.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from analytics import AnalyticsWriter, Spool, LINE_FORMAT
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.directory, "hapi_history.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get_remove(self):
+        spool = Spool(self.dbfile)
+        spool.put("a", ["p1", "p2"])
+        spool.put("b", ["p3"])
+        last_id, batches = spool.get(10)
+        self.assertEqual(batches, {"a": ["p1", "p2"], "b": ["p3"]})
+        spool.remove(last_id)
+        self.assertEqual(spool.count(), 0)
+        self.assertEqual(spool.get(10), (None, {}))
+
+    def test_oldest_points_are_evicted_over_the_cap(self):
+        spool = Spool(self.dbfile, max_points=3)
+        spool.put("a", ["p1", "p2"])
+        spool.put("a", ["p3", "p4"])
+        self.assertEqual(spool.get(10)[1], {"a": ["p2", "p3", "p4"]})
+
+    def test_json_rows_from_older_versions_are_converted(self):
+        database = sqlite3.connect(self.dbfile)
+        database.execute('''
+            CREATE TABLE analytics_spool
+            (id INTEGER PRIMARY KEY AUTOINCREMENT, db_name text, point text);
+        ''')
+        point = {"measurement": "Water", "tags": {"asset": "Temp"},
+                 "fields": {"value": 21.5}, "time": 1500000000000000000}
+        database.executemany("INSERT INTO analytics_spool (db_name, point) VALUES (?, ?);",
+                             [("Water", json.dumps(point)), ("Water", "not json")])
+        database.commit()
+        database.close()
+
+        spool = Spool(self.dbfile)
+        self.assertEqual(spool.get(10)[1],
+                         {"Water": ["Water,asset=Temp value=21.5 1500000000000000000"]})
+        database = sqlite3.connect(self.dbfile)
+        formats = [row[0] for row in database.execute("SELECT format FROM analytics_spool;")]
+        database.close()
+        self.assertEqual(formats, [LINE_FORMAT])
+
+class FakeClient(object):
+    """Stands in for InfluxDBClient; 'errors' maps a point to the error it raises."""
+
+    def __init__(self):
+        self.written = []
+        self.errors = {}
+
+    def get_list_database(self):
+        return [{"name": "Water"}]
+
+    def create_database(self, database):
+        pass
+
+    def write_points(self, points, database=None, protocol=None):
+        for point in points:
+            if point in self.errors:
+                raise self.errors[point]
+        self.written.append((database, list(points)))
+
+class AnalyticsWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = FakeClient()
+        self.spool = Spool(os.path.join(self.directory, "hapi_history.db"))
+        self.writer = AnalyticsWriter(self.client, batch_size=2, spool=self.spool)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stop_wakes_the_writer_thread(self):
+        self.writer.flush_interval = 120.0
+        self.writer.start()
+        started = time.time()
+        self.writer.stop()
+        self.assertLess(time.time() - started, 5.0)
+
+    def test_only_due_buffers_are_flushed(self):
+        self.writer.write("Water", ["p1"])
+        self.writer.flush(force=False)
+        self.assertEqual(self.client.written, [])
+        self.writer.write("Water", ["p2"])
+        self.writer.flush(force=False)
+        self.assertEqual(self.client.written, [("Water", ["p1", "p2"])])
+        self.assertEqual(self.writer.pending(), 0)
+
+    def test_unreachable_server_spools_points(self):
+        self.client.errors["p1"] = InfluxDBServerError("down")
+        self.writer.write("Water", ["p1"])
+        self.writer.flush()
+        self.assertEqual(self.spool.count(), 1)
+
+    def test_rejected_points_are_dropped_not_spooled(self):
+        self.client.errors["bad"] = InfluxDBClientError("unable to parse", 400)
+        self.writer.write("Water", ["bad"])
+        self.writer.flush()
+        self.assertEqual(self.spool.count(), 0)
+        self.assertEqual(self.writer.rejected_points, 1)
+
+    def test_replay_skips_rejected_rows(self):
+        self.spool.put("Water", ["bad"])
+        self.spool.put("Air", ["good"])
+        self.client.errors["bad"] = InfluxDBClientError("unable to parse", 400)
+        self.writer.replay_size = 1
+        self.writer.replay()
+        self.assertEqual(self.client.written, [("Air", ["good"])])
+        self.assertEqual(self.spool.count(), 0)
+
+    def test_replay_keeps_rows_on_server_errors(self):
+        self.spool.put("Water", ["p1"])
+        self.client.errors["p1"] = InfluxDBServerError("down")
+        self.assertRaises(InfluxDBServerError, self.writer.replay)
+        self.assertEqual(self.spool.count(), 1)
+
+    def test_authentication_errors_are_retried(self):
+        self.spool.put("Water", ["p1"])
+        self.client.errors["p1"] = InfluxDBClientError("unauthorized", 401)
+        self.assertRaises(InfluxDBClientError, self.writer.replay)
+        self.assertEqual(self.spool.count(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
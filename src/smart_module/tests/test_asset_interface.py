@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the asset driver registry.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import sys
+import types
+import unittest
+from asset_interface import DriverRegistry
+
+class FakeDriver(object):
+    created = 0
+
+    def __init__(self):
+        FakeDriver.created += 1
+        self.discovered = 0
+        self.fail = False
+
+    def discover(self):
+        self.discovered += 1
+
+    def read_value(self):
+        if self.fail:
+            raise IOError("probe gone")
+        return 21.5
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        FakeDriver.created = 0
+        module = types.ModuleType("asset_fake")
+        module.AssetImpl = FakeDriver
+        sys.modules["asset_fake"] = module
+        self.registry = DriverRegistry(rediscover_interval=300.0)
+
+    def tearDown(self):
+        del sys.modules["asset_fake"]
+
+    def test_driver_is_loaded_once(self):
+        driver = self.registry.get("Fake")
+        self.assertIs(self.registry.get("fake"), driver)
+        self.assertEqual(self.registry.read_value("FAKE"), 21.5)
+        self.assertEqual(FakeDriver.created, 1)
+        self.assertEqual(driver.discovered, 0)
+
+    def test_unknown_type(self):
+        self.assertRaises(ImportError, self.registry.get, "no_such_driver")
+
+    def test_rediscovers_after_the_interval(self):
+        driver = self.registry.get("fake")
+        self.registry.discovered["fake"] -= 301.0
+        self.registry.get("fake")
+        self.assertEqual(driver.discovered, 1)
+        self.registry.get("fake")
+        self.assertEqual(driver.discovered, 1)
+
+    def test_failed_read_rediscovers_and_raises(self):
+        driver = self.registry.get("fake")
+        driver.fail = True
+        self.assertRaises(IOError, self.registry.read_value, "fake")
+        self.assertRaises(IOError, self.registry.read_values, "fake")
+        self.assertEqual(driver.discovered, 2)
+
+    def test_single_probe_drivers_report_one_value(self):
+        self.assertEqual(self.registry.read_values("fake"), {"fake": 21.5})
+
+    def test_simulator(self):
+        self.assertIsInstance(self.registry.read_value("sim"), float)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the DS18B20 water temperature driver.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import asset_wt
+
+GOOD = "72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t=%d\n"
+BAD_CRC = "72 01 4b 46 7f ff 0e 10 57 : crc=00 NO\n72 01 4b 46 7f ff 0e 10 57 t=85000\n"
+
+class WaterTemperatureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved_delay = asset_wt.CRC_RETRY_DELAY
+        asset_wt.CRC_RETRY_DELAY = 0
+        self.sequences = {}
+        self.drivers = []
+
+    def tearDown(self):
+        for driver in self.drivers:
+            if driver.pool is not None:
+                driver.pool.terminate()
+        asset_wt.CRC_RETRY_DELAY = self.saved_delay
+        shutil.rmtree(self.directory)
+
+    def probe(self, probe_id, *contents):
+        """Create a probe whose successive reads return 'contents' (the last one repeats)."""
+        path = os.path.join(self.directory, probe_id)
+        os.mkdir(path)
+        with open(os.path.join(path, "w1_slave"), "w") as slave:
+            slave.write(contents[0])
+        self.sequences[probe_id] = list(contents)
+
+    def driver(self, **kwargs):
+        sequences = self.sequences
+
+        class Driver(asset_wt.AssetImpl):
+            base_dir = self.directory
+
+            @staticmethod
+            def read_temp_raw(device_path):
+                contents = sequences[os.path.basename(os.path.dirname(device_path))]
+                text = contents.pop(0) if len(contents) > 1 else contents[0]
+                return text.split("\n")
+
+        driver = Driver(**kwargs)
+        self.drivers.append(driver)
+        return driver
+
+    def test_discovers_probes(self):
+        self.probe("28-0001", GOOD % 21500)
+        self.probe("28-0002", GOOD % 22000)
+        os.mkdir(os.path.join(self.directory, "00-other"))
+        driver = self.driver()
+        self.assertEqual(sorted(driver.device_paths), ["28-0001", "28-0002"])
+        self.assertEqual(driver.read_values(), {"28-0001": 21.5, "28-0002": 22.0})
+        self.assertEqual(driver.read_value(), 21.5)
+
+    def test_no_probe(self):
+        self.assertRaises(IOError, self.driver().read_values)
+
+    def test_crc_retries(self):
+        self.probe("28-0001", BAD_CRC, BAD_CRC, GOOD % 20000)
+        self.assertEqual(self.driver().read_values(), {"28-0001": 20.0})
+
+    def test_crc_failures_drop_the_probe(self):
+        self.probe("28-0001", GOOD % 21000)
+        self.probe("28-0002", BAD_CRC)
+        driver = self.driver()
+        self.assertEqual(driver.read_values(), {"28-0001": 21.0})
+        self.sequences["28-0001"] = [BAD_CRC]
+        self.assertRaises(IOError, driver.read_values)
+
+    def test_probes_are_read_concurrently(self):
+        for number in range(4):
+            self.probe("28-000%d" % number, GOOD % 20000)
+        driver = self.driver(workers=4)
+        read_probe = driver.read_probe
+        active = []
+        overlap = []
+        lock = threading.Lock()
+
+        def slow_read(probe_id):
+            with lock:
+                active.append(probe_id)
+                overlap.append(len(active))
+            time.sleep(0.1)
+            with lock:
+                active.remove(probe_id)
+            return read_probe(probe_id)
+
+        driver.read_probe = slow_read
+        self.assertEqual(len(driver.read_values()), 4)
+        self.assertGreater(max(overlap), 1)
+
+    def test_slow_probes_time_out(self):
+        self.probe("28-0001", GOOD % 21000)
+        self.probe("28-0002", GOOD % 22000)
+        driver = self.driver(read_timeout=0.1)
+        read_probe = driver.read_probe
+        release = threading.Event()
+
+        def stuck_read(probe_id):
+            if probe_id == "28-0002":
+                release.wait(5)
+            return read_probe(probe_id)
+
+        driver.read_probe = stuck_read
+        started = time.time()
+        try:
+            self.assertEqual(driver.read_values(), {"28-0001": 21.0})
+        finally:
+            release.set()
+        self.assertLess(time.time() - started, 2.0)
+
+if __name__ == "__main__":
+    unittest.main()
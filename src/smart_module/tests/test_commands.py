@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the job command registry and the Scheduler's command compilation.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import unittest
+from commands import CommandRegistry, CommandError, parse, arity, check_topic
+from job_scheduler import JobScheduler
+from smart_module import Scheduler
+
+class ParseTest(unittest.TestCase):
+    def test_bare_name_and_call(self):
+        self.assertEqual(parse("log_data"), ("log_data", ()))
+        self.assertEqual(parse(" get_weather() "), ("get_weather", ()))
+
+    def test_literal_arguments(self):
+        self.assertEqual(parse('send_command("ON", "doc0220")'),
+                         ("send_command", ("ON", "doc0220")))
+        self.assertEqual(parse("wait(1.5)"), ("wait", (1.5,)))
+
+    def test_malformed(self):
+        for text in (None, "", "1abc", "log data", "f(x)", "f(1"):
+            self.assertRaises(CommandError, parse, text)
+
+class ArityTest(unittest.TestCase):
+    def test_function_and_method(self):
+        def func(a, b=1):
+            pass
+        class Holder(object):
+            def method(self, a, *rest):
+                pass
+        self.assertEqual(arity(func), (1, 2))
+        self.assertEqual(arity(Holder().method), (1, None))
+
+class CheckTopicTest(unittest.TestCase):
+    def test_rejects_wildcards(self):
+        self.assertEqual(check_topic("COMMAND/doc0220"), "COMMAND/doc0220")
+        for topic in ("", "QUERY/#", "COMMAND/+", "COMMAND/a+b"):
+            self.assertRaises(CommandError, check_topic, topic)
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.registry = CommandRegistry()
+        self.registry.register("ping", lambda: self.calls.append("ping"))
+        self.registry.register("send", lambda command, target: self.calls.append((command, target)),
+                               lambda command, target: check_topic("COMMAND/" + target))
+
+    def test_compile_binds_arguments(self):
+        command = self.registry.compile('send("ON", "pump")')
+        command()
+        self.assertEqual(self.calls, [("ON", "pump")])
+        self.assertEqual(repr(command), "send('ON', 'pump')")
+
+    def test_unknown_command(self):
+        self.assertRaises(CommandError, self.registry.compile, "reboot()")
+
+    def test_wrong_argument_count(self):
+        self.assertRaises(CommandError, self.registry.compile, "ping(1)")
+        self.assertRaises(CommandError, self.registry.compile, 'send("ON")')
+
+    def test_check_runs_at_compile_time(self):
+        self.assertRaises(CommandError, self.registry.compile, 'send("ON", "#")')
+        self.assertRaises(CommandError, self.registry.bind, "send", ("ON", "pumps/+"))
+        self.assertEqual(self.calls, [])
+
+class SchedulerCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(JobScheduler(), workers=1)
+        self.sent = []
+        self.scheduler.send = lambda topic, message: self.sent.append((topic, message))
+
+    def tearDown(self):
+        self.scheduler.executor.stop()
+
+    def job(self, **fields):
+        job = Scheduler.Job()
+        job.name = "job"
+        job.asset_id = "doc0220"
+        for name, value in fields.items():
+            setattr(job, name, value)
+        return job
+
+    def test_query_topics_have_no_wildcards(self):
+        self.scheduler.compile_command(self.job(command="log_data"))()
+        self.scheduler.compile_command(self.job(name="Log Status", command="anything"))()
+        self.assertEqual([topic for topic, _ in self.sent], ["ASSET/QUERY", "STATUS/QUERY"])
+        for topic, _ in self.sent:
+            check_topic(topic)
+
+    def test_device_command_goes_to_the_asset(self):
+        self.scheduler.compile_command(self.job(command="ON"))()
+        self.assertEqual(self.sent, [("COMMAND/doc0220", "ON")])
+
+    def test_wildcard_targets_are_rejected(self):
+        self.assertRaises(CommandError, self.scheduler.compile_command,
+                          self.job(command="ON", asset_id="#"))
+        self.assertRaises(CommandError, self.scheduler.compile_command,
+                          self.job(command='send_command("ON", "+")', virtual=True))
+        self.assertRaises(CommandError, self.scheduler.compile_command,
+                          self.job(sequence="flush", asset_id="pumps/+"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the discovery cache and the Smart Module's startup discovery.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+import smart_module
+from discovery import DiscoveryCache, PhaseTimer
+from utilities import SM_LOGGER
+
+class FakeClient(object):
+    def loop_start(self):
+        pass
+
+class FakeComm(object):
+    """Brokers in 'reachable' take the TCP connection; those in 'accepting' send a CONNACK."""
+
+    def __init__(self, reachable=(), accepting=()):
+        self.reachable = set(reachable) | set(accepting)
+        self.accepting = set(accepting)
+        self.default_broker = self.broker_name = "mqttbroker.local"
+        self.client = FakeClient()
+        self.connected = threading.Event()
+        self.scheduler_located = threading.Event()
+        self.scheduler_found = False
+        self.scheduler_name = ""
+        self.attempts = []
+
+    def connect(self, broker=None):
+        broker = broker or self.broker_name
+        self.attempts.append(broker)
+        if broker not in self.reachable:
+            return False
+        self.broker_name = broker
+        if broker in self.accepting:
+            self.connected.set()
+        return True
+
+class DiscoveryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "hapi_discovery.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        cache = DiscoveryCache(self.path)
+        self.assertEqual(cache.load(), {})
+        cache.save("broker.local", "hsm1.local")
+        loaded = cache.load()
+        self.assertEqual((loaded["broker"], loaded["scheduler"]), ("broker.local", "hsm1.local"))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_corrupt_cache_is_ignored(self):
+        with open(self.path, "w") as cache:
+            cache.write("{not json")
+        self.assertEqual(DiscoveryCache(self.path).load(), {})
+
+    def test_phase_timer(self):
+        timer = PhaseTimer()
+        timer.mark("connect")
+        timer.mark("scheduler")
+        self.assertEqual([phase for phase, _ in timer.phases], ["connect", "scheduler"])
+        self.assertTrue(timer.report().endswith("s"))
+        self.assertIn("total", timer.report())
+
+class DiscoverTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiscoveryCache(os.path.join(self.directory, "hapi_discovery.json"))
+        self.scripts = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def discover(self, comm, scheduler_answers=False):
+        module = smart_module.SmartModule.__new__(smart_module.SmartModule)
+        module.comm = comm
+        module.discovery_cache = self.cache
+        module.log = logging.getLogger(SM_LOGGER)
+        module.hostname = "hsm2"
+        module.scheduler = None
+        module.connect_wait = module.cached_connect_wait = 0.05
+        module.scheduler_wait = module.cached_scheduler_wait = 0.05
+
+        def start_discovery():
+            self.scripts += 1
+
+        def announce():
+            if scheduler_answers:
+                comm.scheduler_found = True
+                comm.scheduler_name = "hsm1.local"
+                comm.scheduler_located.set()
+
+        def become_scheduler():
+            module.scheduler = True
+
+        module.start_discovery = start_discovery
+        module.announce = announce
+        module.become_scheduler = become_scheduler
+        module.discover()
+        return module
+
+    def test_cache_miss_runs_the_discovery_script(self):
+        comm = FakeComm(accepting=["mqttbroker.local"])
+        module = self.discover(comm, scheduler_answers=True)
+        self.assertEqual(comm.attempts, ["mqttbroker.local"])
+        self.assertEqual(self.scripts, 1)
+        self.assertIsNone(module.scheduler)
+        cached = self.cache.load()
+        self.assertEqual((cached["broker"], cached["scheduler"]),
+                         ("mqttbroker.local", "hsm1.local"))
+
+    def test_cache_hit_skips_the_discovery_script(self):
+        self.cache.save("broker.local", "hsm1.local")
+        comm = FakeComm(accepting=["broker.local"])
+        self.discover(comm, scheduler_answers=True)
+        self.assertEqual(comm.attempts, ["broker.local"])
+        self.assertEqual(self.scripts, 0)
+
+    def test_unreachable_cached_broker_falls_back(self):
+        self.cache.save("gone.local", "hsm1.local")
+        comm = FakeComm(accepting=["mqttbroker.local"])
+        self.discover(comm, scheduler_answers=True)
+        self.assertEqual(comm.attempts, ["gone.local", "mqttbroker.local"])
+        self.assertEqual(self.cache.load()["broker"], "mqttbroker.local")
+
+    def test_stale_cached_broker_without_connack_falls_back_to_the_default(self):
+        self.cache.save("stale.local", "hsm2.local")
+        comm = FakeComm(reachable=["stale.local"], accepting=["mqttbroker.local"])
+        module = self.discover(comm)
+        self.assertEqual(comm.attempts, ["stale.local", "mqttbroker.local"])
+        self.assertEqual(self.scripts, 1)
+        self.assertTrue(module.scheduler)
+        cached = self.cache.load()
+        self.assertEqual((cached["broker"], cached["scheduler"]),
+                         ("mqttbroker.local", "hsm2.local"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the topic-trie message dispatcher.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import threading
+import unittest
+from collections import namedtuple
+from dispatcher import TopicDispatcher
+
+Message = namedtuple("Message", "topic payload")
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = TopicDispatcher()
+        self.calls = []
+
+    def register(self, topic_filter):
+        return self.dispatcher.register(topic_filter, lambda msg: self.calls.append(topic_filter),
+                                        name=topic_filter)
+
+    def matches(self, topic):
+        return sorted(handler.name for handler in self.dispatcher.match(topic))
+
+    def test_wildcards(self):
+        for topic_filter in ("ASSET/QUERY/#", "ASSET/RESPONSE/+", "STATUS/QUERY", "+/QUERY",
+                             "#", "A/+/C"):
+            self.register(topic_filter)
+        self.assertEqual(self.matches("ASSET/QUERY"), ["#", "+/QUERY", "ASSET/QUERY/#"])
+        self.assertEqual(self.matches("ASSET/QUERY/doc0220"), ["#", "ASSET/QUERY/#"])
+        self.assertEqual(self.matches("ASSET/RESPONSE/doc0220"), ["#", "ASSET/RESPONSE/+"])
+        self.assertEqual(self.matches("ASSET/RESPONSE/doc0220/x"), ["#"])
+        self.assertEqual(self.matches("ASSET/RESPONSE"), ["#"])
+        self.assertEqual(self.matches("STATUS/QUERY"), ["#", "+/QUERY", "STATUS/QUERY"])
+        self.assertEqual(self.matches("A/B/C"), ["#", "A/+/C"])
+        self.assertEqual(self.matches("A//C"), ["#", "A/+/C"])
+
+    def test_system_topics(self):
+        for topic_filter in ("#", "+/broker/clients/total", "$SYS/broker/clients/total",
+                             "$SYS/#"):
+            self.register(topic_filter)
+        self.assertEqual(self.matches("$SYS/broker/clients/total"),
+                         ["$SYS/#", "$SYS/broker/clients/total"])
+
+    def test_invalid_filter(self):
+        self.assertRaises(ValueError, self.register, "ASSET/#/QUERY")
+
+    def test_registration_clears_the_cache(self):
+        self.register("ASSET/+")
+        self.assertEqual(self.matches("ASSET/x"), ["ASSET/+"])
+        self.register("ASSET/x")
+        self.assertEqual(self.matches("ASSET/x"), ["ASSET/+", "ASSET/x"])
+
+    def test_dispatch_counts_calls_and_errors(self):
+        self.register("ASSET/+")
+        def fail(msg):
+            raise RuntimeError("boom")
+        self.dispatcher.register("ASSET/#", fail)
+        self.assertEqual(self.dispatcher.dispatch(Message("ASSET/x", "")), 2)
+        self.assertEqual(self.dispatcher.dispatch(Message("OTHER", "")), 0)
+        self.assertEqual(self.calls, ["ASSET/+"])
+        stats = dict((entry["name"], entry) for entry in self.dispatcher.stats())
+        self.assertEqual((stats["ASSET/+"]["calls"], stats["ASSET/+"]["errors"]), (1, 0))
+        self.assertEqual((stats["fail"]["calls"], stats["fail"]["errors"]), (1, 1))
+    def test_counters_from_several_threads(self):
+        handler = self.dispatcher.register("ASSET/+", lambda msg: None)
+        message = Message("ASSET/x", "")
+
+        def work():
+            for _ in range(2000):
+                self.dispatcher.run(handler, message)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(handler.calls, 8000)
+
+if __name__ == "__main__":
+    unittest.main()
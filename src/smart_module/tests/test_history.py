@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the local sensor history and its rollups.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from history import SensorHistory, format_timestamp, parse_timestamp
+
+# Noon UTC, so the readings below share their hour and day buckets.
+START = 1500000000 - 1500000000 % 86400 + 12 * 3600
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.directory, "hapi_history.db")
+        # Expire only when a test asks for it; the readings are years old.
+        self.history = SensorHistory(self.dbfile, expire_interval=float("inf"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rows(self, sql, *args):
+        database = sqlite3.connect(self.dbfile)
+        try:
+            return database.cursor().execute(sql, args).fetchall()
+        finally:
+            database.close()
+
+    def test_timestamps_round_trip(self):
+        self.assertEqual(parse_timestamp(format_timestamp(START)), START)
+        self.assertAlmostEqual(parse_timestamp(format_timestamp(START + 0.25)), START + 0.25)
+
+    def test_rollups(self):
+        self.history.record_many([("1", 10.0, "C", START + 1), ("1", 20.0, "C", START + 30),
+                                  ("1", 30.0, "C", START + 90), ("2", 5.0, "C", START + 1)])
+        self.assertEqual(self.rows('SELECT count(*) FROM sensor_data;'), [(4,)])
+        minutes = self.rows('''SELECT bucket, min, max, sum, count FROM sensor_rollup
+                               WHERE asset_id = 1 AND resolution = 60 ORDER BY bucket;''')
+        bucket = START // 60 * 60
+        self.assertEqual(minutes, [(bucket, 10.0, 20.0, 30.0, 2),
+                                   (bucket + 60, 30.0, 30.0, 30.0, 1)])
+        hours = self.rows('''SELECT min, max, sum, count FROM sensor_rollup
+                             WHERE asset_id = 1 AND resolution = 3600;''')
+        self.assertEqual(hours, [(10.0, 30.0, 60.0, 3)])
+        self.assertEqual(self.rows('SELECT count(*) FROM sensor_rollup WHERE asset_id = 2;'),
+                         [(3,)])
+
+    def test_expire(self):
+        old = START - 30 * 86400
+        self.history.record("1", 1.0, "C", old)
+        self.history.record("1", 2.0, "C", START)
+        # Expiry runs against the current time; move the retention windows instead.
+        self.history.raw_retention = 0
+        database = sqlite3.connect(self.dbfile)
+        try:
+            cursor = database.cursor()
+            self.history.expire(cursor, START + 1)
+            database.commit()
+        finally:
+            database.close()
+        self.assertEqual(self.rows('SELECT value FROM sensor_data;'), [])
+        resolutions = self.rows('''SELECT resolution, count(*) FROM sensor_rollup
+                                   GROUP BY resolution ORDER BY resolution;''')
+        # Minute buckets are kept 14 days, hours 400 days, days forever.
+        self.assertEqual(resolutions, [(60, 1), (3600, 2), (86400, 2)])
+    def test_pick_resolution(self):
+        self.assertEqual(SensorHistory.pick_resolution(0), 0)
+        self.assertEqual(SensorHistory.pick_resolution(59), 0)
+        self.assertEqual(SensorHistory.pick_resolution(300), 60)
+        self.assertEqual(SensorHistory.pick_resolution(7 * 86400), 86400)
+
+    def test_query_raw_pages(self):
+        self.history.record_many([("1", float(i), "C", START + i) for i in range(5)])
+        pages = list(self.history.query("1", START + 1, START + 3, page_size=2))
+        self.assertEqual(pages, [(0, [[START + 1, 1.0], [START + 2, 2.0]]),
+                                 (0, [[START + 3, 3.0]])])
+
+    def test_query_rollups(self):
+        self.history.record_many([("1", 10.0, "C", START + 1), ("1", 20.0, "C", START + 30),
+                                  ("1", 30.0, "C", START + 90)])
+        # The bucket the start falls in is included.
+        pages = list(self.history.query("1", START + 59, START + 120, resolution=60))
+        bucket = START // 60 * 60
+        self.assertEqual(pages, [(60, [[bucket, 10.0, 20.0, 15.0, 2],
+                                       [bucket + 60, 30.0, 30.0, 30.0, 1]])])
+        self.assertEqual(list(self.history.query("2", START, START + 120, resolution=60)), [])
+    def test_query_rejects_empty_pages(self):
+        for page_size in (0, -1):
+            self.assertRaises(ValueError, list, self.history.query("1", START, START + 1,
+                                                                   page_size=page_size))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the scheduled job executor.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import threading
+import unittest
+import job_executor
+from job_executor import JobExecutor, SKIP, QUEUE, CANCEL
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+class JobExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = JobExecutor(workers=2)
+        self.executor.start()
+        self.gate = threading.Event()
+        self.runs = []
+
+    def tearDown(self):
+        self.gate.set()
+        self.executor.stop()
+
+    def blocked_job(self, name):
+        self.runs.append(name)
+        self.gate.wait(2.0)
+
+    def test_skip_drops_overlapping_runs(self):
+        self.executor.submit("job", self.blocked_job, ("first",), overlap=SKIP)
+        self.assertFalse(self.executor.submit("job", self.blocked_job, ("second",),
+                                              overlap=SKIP))
+        self.gate.set()
+        self.assertTrue(wait_for(lambda: self.executor.metrics()["job"]["runs"] == 1))
+        self.assertEqual(self.runs, ["first"])
+        self.assertEqual(self.executor.metrics()["job"]["skipped"], 1)
+
+    def test_queue_runs_overlapping_runs_in_order(self):
+        self.executor.submit("job", self.blocked_job, ("first",), overlap=QUEUE)
+        self.assertTrue(self.executor.submit("job", self.blocked_job, ("second",),
+                                             overlap=QUEUE))
+        self.gate.set()
+        self.assertTrue(wait_for(lambda: self.executor.metrics()["job"]["runs"] == 2))
+        self.assertEqual(self.runs, ["first", "second"])
+
+    def test_cancel_tells_the_previous_run(self):
+        seen = []
+
+        def job(name):
+            self.runs.append(name)
+            while not job_executor.cancelled() and not self.gate.is_set():
+                time.sleep(0.01)
+            seen.append((name, job_executor.cancelled()))
+
+        self.executor.submit("job", job, ("first",), overlap=CANCEL)
+        self.assertTrue(wait_for(lambda: self.runs == ["first"]))
+        self.executor.submit("job", job, ("second",), overlap=CANCEL)
+        self.assertTrue(wait_for(lambda: seen == [("first", True)]))
+        self.gate.set()
+        self.assertTrue(wait_for(lambda: len(seen) == 2))
+        self.assertEqual(seen[1], ("second", False))
+        self.assertEqual(self.executor.metrics()["job"]["cancelled"], 1)
+
+    def test_timeout_is_enforced_promptly(self):
+        left = []
+
+        def job():
+            left.append(job_executor.time_left())
+            while not job_executor.cancelled():
+                time.sleep(0.01)
+
+        started = time.time()
+        self.executor.submit("job", job, timeout=0.2)
+        self.assertTrue(wait_for(lambda: self.executor.metrics()["job"]["timeouts"] == 1))
+        self.assertLess(time.time() - started, 1.0)
+        self.assertTrue(0.0 < left[0] <= 0.2)
+
+    def test_outside_a_job(self):
+        self.assertFalse(job_executor.cancelled())
+        self.assertEqual(job_executor.time_left(30.0), 30.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the timer heap and its calendar arithmetic.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import time
+import datetime
+import unittest
+from job_scheduler import JobScheduler, ScheduledJob, add_months, parse_at_time
+
+def timestamp(*fields):
+    return time.mktime(datetime.datetime(*fields).timetuple())
+
+def local(seconds):
+    return datetime.datetime.fromtimestamp(seconds)
+
+class CalendarTest(unittest.TestCase):
+    def setUp(self):
+        # US Eastern: clocks went forward on 2017-03-12 and back on 2017-11-05.
+        self.timezone = os.environ.get("TZ")
+        os.environ["TZ"] = "America/New_York"
+        time.tzset()
+
+    def tearDown(self):
+        if self.timezone is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = self.timezone
+        time.tzset()
+
+    def test_add_months_clamps_the_day(self):
+        moment = datetime.datetime(2016, 1, 31, 8, 0)
+        self.assertEqual(add_months(moment, 1), datetime.datetime(2016, 2, 29, 8, 0))
+        self.assertEqual(add_months(moment, 13), datetime.datetime(2017, 2, 28, 8, 0))
+        self.assertEqual(add_months(datetime.datetime(2016, 11, 15), 2),
+                         datetime.datetime(2017, 1, 15))
+        self.assertEqual(add_months(datetime.datetime(2016, 3, 31), -1),
+                         datetime.datetime(2016, 2, 29))
+
+    def test_parse_at_time(self):
+        self.assertIsNone(parse_at_time(""))
+        self.assertIsNone(parse_at_time(None))
+        self.assertEqual(parse_at_time("7:05"), datetime.time(7, 5))
+        self.assertEqual(parse_at_time(" 23:59:30 "), datetime.time(23, 59, 30))
+        for text in ("7", "1:2:3:4", "25:00", "ab:cd"):
+            self.assertRaises(ValueError, parse_at_time, text)
+
+    def test_job_validation(self):
+        self.assertRaises(ValueError, ScheduledJob, 1, None, "fortnight")
+        self.assertRaises(TypeError, ScheduledJob, 1, None, "day", None)
+        self.assertEqual(ScheduledJob(1, None, "Hour", 0).interval, 1)
+        # at_time only pins day, week and month jobs.
+        self.assertIsNone(ScheduledJob(1, None, "hour", 1, "08:00").at_time)
+
+    def test_first_run_at_time(self):
+        job = ScheduledJob(1, None, "day", 1, "08:00")
+        self.assertEqual(local(job.first_run(timestamp(2017, 3, 1, 7, 0))),
+                         datetime.datetime(2017, 3, 1, 8, 0))
+        self.assertEqual(local(job.first_run(timestamp(2017, 3, 1, 8, 0))),
+                         datetime.datetime(2017, 3, 2, 8, 0))
+
+    def test_daily_job_keeps_wall_clock_across_dst(self):
+        job = ScheduledJob(1, None, "day", 1, "08:00")
+        self.assertEqual(local(job.advance(timestamp(2017, 3, 11, 8, 0))),
+                         datetime.datetime(2017, 3, 12, 8, 0))
+        self.assertEqual(local(job.advance(timestamp(2017, 11, 4, 8, 0))),
+                         datetime.datetime(2017, 11, 5, 8, 0))
+
+    def test_interval_job_keeps_elapsed_time_across_dst(self):
+        job = ScheduledJob(1, None, "hour", 6)
+        start = timestamp(2017, 3, 11, 23, 0)
+        self.assertEqual(job.advance(start), start + 6 * 3600)
+        self.assertEqual(local(job.advance(start)), datetime.datetime(2017, 3, 12, 6, 0))
+
+    def test_monthly_job(self):
+        job = ScheduledJob(1, None, "month", 1, "06:00")
+        self.assertEqual(local(job.advance(timestamp(2017, 1, 31, 6, 0))),
+                         datetime.datetime(2017, 2, 28, 6, 0))
+
+    def test_schedule_after_skips_missed_runs(self):
+        job = ScheduledJob(1, None, "minute", 5)
+        job.next_run = 1000.0
+        self.assertEqual(job.schedule_after(2000.0), 2200.0)
+
+class JobSchedulerTest(unittest.TestCase):
+    def test_run_pending_fires_due_jobs_in_deadline_order(self):
+        fired = []
+        timers = JobScheduler()
+        timers.add(ScheduledJob("a", fired.append, "minute", 1, args=("a",)), now=0.0)
+        timers.add(ScheduledJob("b", fired.append, "minute", 2, args=("b",)), now=0.0)
+        self.assertEqual(timers.next_deadline(), 60.0)
+        self.assertEqual(timers.run_pending(now=59.0), 0)
+        self.assertEqual(timers.run_pending(now=60.0), 1)
+        self.assertEqual(timers.run_pending(now=120.0), 2)
+        self.assertEqual(fired, ["a", "b", "a"])
+        self.assertEqual(timers.next_deadline(), 180.0)
+
+    def test_replace_and_remove(self):
+        fired = []
+        timers = JobScheduler()
+        timers.add(ScheduledJob("a", fired.append, "minute", 1, args=("old",)), now=0.0)
+        timers.add(ScheduledJob("a", fired.append, "minute", 1, args=("new",)), now=0.0)
+        timers.run_pending(now=60.0)
+        self.assertEqual(fired, ["new"])
+        timers.remove("a")
+        self.assertIsNone(timers.next_deadline())
+        self.assertEqual(timers.run_pending(now=1000.0), 0)
+
+    def test_call_later_fires_once_and_can_be_cancelled(self):
+        fired = []
+        timers = JobScheduler()
+        timers.call_later(0, fired.append, 1)
+        timers.call_later(0, fired.append, 2).cancel()
+        now = time.time() + 1
+        timers.run_pending(now=now)
+        timers.run_pending(now=now)
+        self.assertEqual(fired, [1])
+
+    def test_run_sleeps_until_the_deadline(self):
+        fired = []
+        timers = JobScheduler()
+        timers.start()
+        try:
+            timers.call_later(0.05, fired.append, 1)
+            deadline = time.time() + 2
+            while not fired and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            timers.stop()
+        self.assertEqual(fired, [1])
+        self.assertLess(timers.wakeups, 10)
+
+if __name__ == "__main__":
+    unittest.main()
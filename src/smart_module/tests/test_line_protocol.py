@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for line_protocol.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import unittest
+from influxdb.line_protocol import make_lines
+from line_protocol import PointEncoder, escape_key, escape_measurement, field_value
+
+class FieldValueTest(unittest.TestCase):
+    def test_types(self):
+        self.assertEqual(field_value(True), "true")
+        self.assertEqual(field_value(False), "false")
+        self.assertEqual(field_value(3), "3i")
+        self.assertEqual(field_value(2.5), "2.5")
+        self.assertEqual(field_value('say "hi" \\'), '"say \\"hi\\" \\\\"')
+
+    def test_non_finite_floats_are_rejected(self):
+        for value in (float("nan"), float("inf"), float("-inf")):
+            self.assertRaises(ValueError, field_value, value)
+
+class EscapeTest(unittest.TestCase):
+    def test_key(self):
+        self.assertEqual(escape_key("a b,c=d"), "a\\ b\\,c\\=d")
+
+    def test_measurement_keeps_equals(self):
+        self.assertEqual(escape_measurement("a b,c=d"), "a\\ b\\,c=d")
+
+class PointEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = PointEncoder()
+
+    def test_tags_are_sorted_cached_and_skip_empty_values(self):
+        tag_set = self.encoder.tags(("site", "My Site"), ("asset", "Water"), ("probe", ""))
+        self.assertEqual(tag_set, ",asset=Water,site=My\\ Site")
+        self.assertIs(self.encoder.tags(("site", "My Site"), ("asset", "Water"), ("probe", "")),
+                      tag_set)
+
+    def test_matches_influxdb_make_lines(self):
+        tag_set = self.encoder.tags(("site", "HAPI Site"), ("asset", "Water Temperature"))
+        line = self.encoder.encode("Water", tag_set, (("unit", "C"), ("value", 21.5)),
+                                   1500000000000000000)
+        expected = make_lines({"points": [{
+            "measurement": "Water",
+            "tags": {"site": "HAPI Site", "asset": "Water Temperature"},
+            "fields": {"value": 21.5, "unit": "C"},
+            "time": 1500000000000000000,
+        }]})
+        self.assertEqual(line + "\n", expected)
+
+    def test_nan_point_is_not_encoded(self):
+        self.assertRaises(ValueError, self.encoder.encode, "Water", "",
+                          (("value", float("nan")),), 0)
+
+if __name__ == "__main__":
+    unittest.main()
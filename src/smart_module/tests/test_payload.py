@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for payload encoding round-trips.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import json
+import unittest
+import payload
+from status import SystemStatus
+
+def make_status(module=u"doc0220"):
+    status = SystemStatus()
+    status.module = module
+    status.timestamp = 1500000000.5
+    status.boot = "2017-04-01 12:00:00"
+    status.cpu["percentage"] = 12.5
+    status.memory.update(used=1, free=2, cached=3)
+    status.network.update(packet_sent=4, packet_recv=5)
+    status.disk.update(total=6, used=7, free=8)
+    status.clients = 3
+    return status
+
+class ReadingTest(unittest.TestCase):
+    def setUp(self):
+        self.reading = payload.Reading(u"doc0220", 1500000000.25, u"°C", payload.STALE,
+                                       21.5)
+
+    def test_binary_and_json_round_trip(self):
+        for fmt in (payload.BINARY, payload.JSON):
+            self.assertEqual(payload.decode_reading(payload.encode_reading(self.reading, fmt)),
+                             self.reading)
+
+    def test_byte_string_unit(self):
+        reading = self.reading._replace(unit="\xc2\xb0C", asset_id="doc0220")
+        for fmt in (payload.BINARY, payload.JSON):
+            decoded = payload.decode_reading(payload.encode_reading(reading, fmt))
+            self.assertEqual(decoded.unit, u"°C")
+
+    def test_json_carries_the_trend(self):
+        trend = {10: {"count": 2, "min": 21.0, "max": 22.0, "mean": 21.5, "variance": 0.25,
+                      "last": 21.5}}
+        data = payload.encode_reading(self.reading, payload.JSON, trend=trend)
+        self.assertEqual(json.loads(data)["trend"]["10"]["mean"], 21.5)
+        self.assertEqual(payload.decode_reading(data), self.reading)
+        binary = payload.encode_reading(self.reading, payload.BINARY, trend=trend)
+        self.assertEqual(binary, payload.encode_reading(self.reading, payload.BINARY))
+
+    def test_legacy(self):
+        self.assertEqual(payload.encode_reading(self.reading, payload.LEGACY), "21.5")
+        decoded = payload.decode_reading("21.5", asset_id="doc0220", unit="C")
+        self.assertEqual((decoded.asset_id, decoded.unit, decoded.quality, decoded.value),
+                         ("doc0220", "C", payload.GOOD, 21.5))
+        self.assertEqual(payload.decode_reading("-1000").quality, payload.FAILED)
+
+    def test_requested_format(self):
+        self.assertEqual(payload.requested_format(" JSON "), payload.JSON)
+        self.assertEqual(payload.requested_format("binary"), payload.BINARY)
+        self.assertEqual(payload.requested_format("Where are you?"), payload.LEGACY)
+        self.assertEqual(payload.requested_format(None), payload.LEGACY)
+
+class StatusTest(unittest.TestCase):
+    def assertSameStatus(self, decoded, status):
+        for name in ("module", "timestamp", "boot", "cpu", "memory", "network", "disk",
+                     "clients"):
+            self.assertEqual(getattr(decoded, name), getattr(status, name), name)
+
+    def test_binary_and_json_round_trip_with_module(self):
+        status = make_status()
+        for fmt in (payload.BINARY, payload.JSON):
+            self.assertSameStatus(payload.decode_status(payload.encode_status(status, fmt)),
+                                  status)
+
+    def test_binary_without_module_id(self):
+        data = payload.encode_status(make_status(u""))
+        decoded = payload.decode_status(data[:payload.STATUS_STRUCT.size])
+        self.assertEqual(decoded.module, "")
+        self.assertEqual(decoded.clients, 3)
+
+    def test_legacy_is_not_decoded(self):
+        self.assertIsNone(payload.decode_status(str(make_status())))
+
+class BatchTest(unittest.TestCase):
+    def test_round_trip(self):
+        readings = [payload.Reading(u"doc0220", 1500000000.0, u"C", payload.GOOD, 21.5),
+                    payload.Reading(u"doc0220/28-01", 1500000000.0, u"C", payload.GOOD, 22.0)]
+        for status in (None, make_status(u"")):
+            batch = payload.Batch(u"doc0220", u"Water Temperature", u"Water", readings, status)
+            for fmt in (payload.BINARY, payload.JSON):
+                decoded = payload.decode_batch(payload.encode_batch(batch, fmt))
+                self.assertEqual(decoded[:4], batch[:4])
+                if status is None:
+                    self.assertIsNone(decoded.status)
+                else:
+                    # A batch's status defaults to the batch's module.
+                    self.assertEqual(decoded.status.module, u"doc0220")
+                    self.assertEqual(decoded.status.memory, status.memory)
+
+if __name__ == "__main__":
+    unittest.main()
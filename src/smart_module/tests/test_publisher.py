@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the buffered MQTT Publisher.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import unittest
+import paho.mqtt.client as mqtt
+from communicator import Communicator
+from publisher import Publisher
+from worker_pool import WorkerPool
+
+class Info(object):
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+class FakeClient(object):
+    """Answers publish() with the result queued for the topic, else success."""
+
+    def __init__(self):
+        self.on_publish = None
+        self.results = {}
+        self.published = []
+        self.mid = 0
+
+    def publish(self, topic, message, qos=0):
+        result = self.results.get(topic, [mqtt.MQTT_ERR_SUCCESS])
+        rc = result.pop(0) if len(result) > 1 else result[0]
+        if isinstance(rc, Exception):
+            raise rc
+        self.mid += 1
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published.append((topic, message, qos))
+        return Info(rc, self.mid)
+
+class PublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.publisher = Publisher(self.client, topic_qos=[("ASSET/RESPONSE/+", 1)],
+                                   retry_delay=(60.0, 60.0), max_buffer=3)
+        self.publisher.on_connect()
+
+    def test_stop_wakes_the_publishing_thread(self):
+        self.publisher.interval = 60.0
+        self.publisher.start()
+        started = time.time()
+        self.publisher.stop()
+        self.assertLess(time.time() - started, 5.0)
+
+    def test_qos_by_topic_filter(self):
+        self.assertEqual(self.publisher.qos("ASSET/RESPONSE/1"), 1)
+        self.assertEqual(self.publisher.qos("ASSET/QUERY/1"), 0)
+
+    def test_failing_message_does_not_block_the_rest(self):
+        self.client.results["A"] = [mqtt.MQTT_ERR_NOMEM]
+        self.publisher.put("A", "1")
+        self.publisher.put("B", "2")
+        self.publisher.flush()
+        self.assertEqual(self.client.published, [("B", "2", 0)])
+        metrics = self.publisher.metrics()
+        self.assertEqual((metrics["retrying"], metrics["retries"], metrics["depth"]), (1, 1, 0))
+
+    def test_parked_message_returns_to_the_head_when_due(self):
+        self.publisher.retry_delay = (0.0, 0.0)
+        self.client.results["A"] = [mqtt.MQTT_ERR_NOMEM, mqtt.MQTT_ERR_SUCCESS]
+        self.publisher.put("A", "1")
+        self.publisher.flush()
+        self.assertEqual(self.client.published, [])
+        self.publisher.put("B", "2")
+        self.publisher.flush()
+        self.assertEqual(self.client.published, [("A", "1", 0), ("B", "2", 0)])
+
+    def test_exceptions_are_not_retried(self):
+        self.client.results["A/#"] = [ValueError("Publish topic cannot contain wildcards.")]
+        self.publisher.put("A/#", "1")
+        self.publisher.put("B", "2")
+        self.publisher.flush()
+        metrics = self.publisher.metrics()
+        self.assertEqual((metrics["failed"], metrics["retrying"]), (1, 0))
+        self.assertEqual(self.client.published, [("B", "2", 0)])
+
+    def test_permanent_errors_are_not_retried(self):
+        self.client.results["A"] = [mqtt.MQTT_ERR_PAYLOAD_SIZE]
+        self.publisher.put("A", "1")
+        self.publisher.flush()
+        metrics = self.publisher.metrics()
+        self.assertEqual((metrics["failed"], metrics["retrying"]), (1, 0))
+
+    def test_full_buffer_drops_the_oldest(self):
+        self.publisher.on_disconnect()
+        for number in range(4):
+            self.publisher.put("A", str(number))
+        self.assertEqual([outgoing.message for outgoing in self.publisher.buffer],
+                         ["1", "2", "3"])
+        self.assertEqual(self.publisher.metrics()["dropped"], 1)
+
+    def test_qos1_waits_for_the_acknowledgement(self):
+        self.publisher.put("ASSET/RESPONSE/1", "21.5")
+        self.publisher.flush()
+        self.assertEqual(self.publisher.metrics()["inflight"], 1)
+        self.publisher.on_publish(self.client, None, self.client.mid)
+        metrics = self.publisher.metrics()
+        self.assertEqual((metrics["inflight"], metrics["published"]), (0, 1))
+class ConnackTest(unittest.TestCase):
+    def setUp(self):
+        # Neither the pool nor the publisher thread is started.
+        self.comm = Communicator(None, pool=WorkerPool())
+
+    def test_refused_connection_does_not_start_publishing(self):
+        self.comm.on_connect(None, None, {}, mqtt.CONNACK_REFUSED_NOT_AUTHORIZED)
+        self.assertFalse(self.comm.publisher.connected)
+        self.assertFalse(self.comm.connected.is_set())
+
+    def test_accepted_connection(self):
+        self.comm.on_connect(None, None, {}, mqtt.CONNACK_ACCEPTED)
+        self.assertTrue(self.comm.publisher.connected)
+        self.assertTrue(self.comm.connected.is_set())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the per-asset reading ring buffer and its rolling windows.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import random
+import unittest
+from readings import ReadingBuffer, RollingWindow
+
+def reference(values):
+    mean = sum(values) / len(values)
+    return {
+        "count": len(values),
+        "min": min(values),
+        "max": max(values),
+        "mean": mean,
+        "variance": sum((value - mean) ** 2 for value in values) / len(values),
+    }
+
+class RollingWindowTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(RollingWindow(5).stats(), {"count": 0})
+
+    def test_matches_recomputed_stats(self):
+        generator = random.Random(7)
+        buffer = ReadingBuffer(capacity=16, windows=(1, 5, 16))
+        values = []
+        for i in range(200):
+            value = generator.uniform(-50.0, 50.0)
+            values.append(value)
+            buffer.append(value, timestamp=i)
+            for size in (1, 5, 16):
+                stats = buffer.stats(size)
+                expected = reference(values[-size:])
+                self.assertEqual(stats["count"], expected["count"])
+                self.assertEqual(stats["min"], expected["min"])
+                self.assertEqual(stats["max"], expected["max"])
+                self.assertAlmostEqual(stats["mean"], expected["mean"], places=9)
+                self.assertAlmostEqual(stats["variance"], expected["variance"], places=6)
+                self.assertEqual(stats["last"], value)
+
+    def test_constant_values_have_no_variance(self):
+        buffer = ReadingBuffer(capacity=4, windows=(4,))
+        for _ in range(20):
+            buffer.append(0.1)
+        self.assertEqual(buffer.stats(4)["variance"], 0.0)
+
+class ReadingBufferTest(unittest.TestCase):
+    def test_window_must_fit(self):
+        self.assertRaises(ValueError, ReadingBuffer, capacity=10, windows=(5, 11))
+
+    def test_ring(self):
+        buffer = ReadingBuffer(capacity=3, windows=(2,))
+        self.assertIsNone(buffer.last())
+        self.assertEqual(buffer.recent(5), [])
+        for i in range(5):
+            buffer.append(i, timestamp=100.0 + i)
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.last(), (104.0, 4.0))
+        self.assertEqual(buffer.recent(5), [(102.0, 2.0), (103.0, 3.0), (104.0, 4.0)])
+        self.assertEqual(buffer.recent(1), [(104.0, 4.0)])
+        self.assertEqual(sorted(buffer.trend()), [2])
+
+if __name__ == "__main__":
+    unittest.main()
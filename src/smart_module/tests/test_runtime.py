@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the single-thread EventLoop.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import select
+import socket
+import threading
+import unittest
+import paho.mqtt.client as mqtt
+from runtime import EventLoop
+from worker_pool import WorkerPool
+
+class SocketClient(object):
+    """Stand-in MQTT client: loop() waits in select() and handles what arrives."""
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.received = []
+        self.timeouts = []
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        self.reconnects = 0
+
+    def loop(self, timeout):
+        self.timeouts.append(timeout)
+        if self.rc != mqtt.MQTT_ERR_SUCCESS:
+            return self.rc
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if readable:
+            self.received.append((time.time(), self.sock.recv(1024)))
+        return self.rc
+
+    def reconnect(self):
+        self.reconnects += 1
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+class EventLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = WorkerPool(workers=1)
+        self.executor.start()
+        self.loop = EventLoop(self.executor, max_wait=0.2, reconnect_delay=(0.01, 0.04))
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_timers_run_in_deadline_order(self):
+        calls = []
+        self.loop.call_later(0.02, calls.append, "late")
+        self.loop.call_later(0, calls.append, "first")
+        self.loop.call_later(0, calls.append, "second")
+        self.loop.call_later(0, calls.append, "cancelled").cancel()
+        self.loop.call_later(60, calls.append, "never")
+        self.loop.run_timers()
+        self.assertEqual(calls, ["first", "second"])
+        time.sleep(0.03)
+        self.loop.run_timers()
+        self.assertEqual(calls, ["first", "second", "late"])
+
+    def test_failing_timer_does_not_stop_the_others(self):
+        calls = []
+        self.loop.call_later(0, lambda: 1 / 0)
+        self.loop.call_later(0, calls.append, "next")
+        self.loop.run_timers()
+        self.assertEqual(calls, ["next"])
+
+    def test_next_wait(self):
+        self.assertEqual(self.loop.next_wait(), 0.2)
+        self.loop.call_later(0.05, lambda: None)
+        self.assertLessEqual(self.loop.next_wait(), 0.05)
+        self.loop.call_later(-1, lambda: None)
+        self.assertEqual(self.loop.next_wait(), 0.0)
+
+    def test_every_skips_overlapping_blocking_runs(self):
+        gate = threading.Event()
+        runs = []
+
+        def work():
+            runs.append(1)
+            gate.wait(2)
+
+        self.loop.every(0, work, blocking=True)
+        for _ in range(3):
+            self.loop.run_timers()
+            time.sleep(0.02)
+        gate.set()
+        self.assertEqual(runs, [1])
+
+    def test_readable_socket_is_handled_without_waiting_for_timers(self):
+        client = SocketClient()
+        self.addCleanup(client.close)
+        sent = []
+
+        def send():
+            sent.append(time.time())
+            client.peer.send(b"PUBLISH")
+
+        threading.Timer(0.05, send).start()
+        self.loop.call_later(0.5, self.loop.stop)
+        self.loop.max_wait = 1.0
+        self.loop.run(client)
+        (received, data), = client.received
+        self.assertEqual(data, b"PUBLISH")
+        self.assertLess(received - sent[0], 0.1)
+        # The loop slept in select() until the stop timer, not in short polls.
+        self.assertLess(len(client.timeouts), 5)
+
+    def test_reconnects_with_backoff(self):
+        client = SocketClient()
+        self.addCleanup(client.close)
+        client.rc = mqtt.MQTT_ERR_NO_CONN
+        self.loop.call_later(0.3, self.loop.stop)
+        self.loop.max_wait = 0.01
+        self.loop.run(client)
+        self.assertGreater(client.reconnects, 1)
+        self.assertEqual(self.loop.reconnect_wait, 0.04)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the background Sampler.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import unittest
+from sampler import Sampler, median
+
+class SamplerTest(unittest.TestCase):
+    def test_median(self):
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 3, 2]), 2.5)
+
+    def test_latest_never_reads_the_sensor(self):
+        reads = []
+        sampler = Sampler(lambda: reads.append(1) or 1.0)
+        reading = sampler.latest()
+        self.assertEqual(reads, [])
+        self.assertIsNone(reading.value)
+        self.assertTrue(reading.stale)
+
+    def test_sample_is_median_filtered(self):
+        values = iter([20.0, 99.0, 21.0])
+        sampled = []
+        sampler = Sampler(lambda: next(values), on_sample=lambda *args: sampled.append(args))
+        self.assertEqual(sampler.sample(), 21.0)
+        reading = sampler.latest()
+        self.assertEqual(reading.value, 21.0)
+        self.assertFalse(reading.stale)
+        self.assertEqual(sampled, [(21.0, reading.timestamp)])
+
+    def test_failed_sample_marks_cached_value_stale(self):
+        values = iter([20.0, 20.0, 20.0])
+        sampler = Sampler(lambda: next(values))
+        sampler.sample()
+        self.assertIsNone(sampler.sample())
+        reading = sampler.latest()
+        self.assertEqual(reading.value, 20.0)
+        self.assertTrue(reading.stale)
+
+    def test_old_value_is_stale(self):
+        sampler = Sampler(lambda: 1.0, max_age=5)
+        sampler.sample()
+        sampler.timestamp = time.time() - 10
+        self.assertTrue(sampler.latest().stale)
+
+    def test_probes_are_filtered_separately(self):
+        values = iter([{"a": 1.0, "b": 10.0}, {"a": 2.0, "b": 30.0}, {"a": 3.0, "b": 20.0}])
+        sampler = Sampler(lambda: next(values))
+        self.assertEqual(sampler.sample(), 2.0)
+        self.assertEqual(sampler.probes, {"a": 2.0, "b": 20.0})
+
+    def test_stop_wakes_the_sampling_thread(self):
+        sampler = Sampler(lambda: 1.0, interval=60.0)
+        sampler.start()
+        started = time.time()
+        sampler.stop()
+        self.assertLess(time.time() - started, 5.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for schedule reloading and core database synchronization.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from job_scheduler import JobScheduler
+from smart_module import Scheduler, DataSync
+
+def make_job(job_id, **fields):
+    job = Scheduler.Job()
+    job.id = job_id
+    job.name = "job%d" % job_id
+    job.asset_id = "doc0220"
+    job.command = "log_data"
+    job.time_unit = "minute"
+    job.interval = 5
+    job.enabled = True
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return job
+
+class PrepareJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.timers = JobScheduler()
+        self.scheduler = Scheduler(self.timers, workers=1)
+
+    def tearDown(self):
+        self.scheduler.executor.stop()
+
+    def prepare(self, *jobs):
+        for job in jobs:
+            job.action = self.scheduler.compile_command(job)
+        self.scheduler.prepare_jobs(list(jobs))
+
+    def test_adds_and_removes(self):
+        self.prepare(make_job(1), make_job(2))
+        self.assertEqual(sorted(self.timers.jobs), [1, 2])
+        self.prepare(make_job(2), make_job(3, enabled=False))
+        self.assertEqual(sorted(self.timers.jobs), [2])
+        self.assertEqual(sorted(self.scheduler.jobs), [2])
+
+    def test_unchanged_job_keeps_its_timer(self):
+        self.prepare(make_job(1))
+        scheduled = self.timers.jobs[1]
+        job = self.scheduler.jobs[1]
+        self.prepare(make_job(1))
+        self.assertIs(self.timers.jobs[1], scheduled)
+        self.assertIs(self.scheduler.jobs[1], job)
+
+    def test_command_change_updates_in_place(self):
+        self.prepare(make_job(1))
+        scheduled = self.timers.jobs[1]
+        next_run = scheduled.next_run
+        self.prepare(make_job(1, command="log_status"))
+        self.assertIs(self.timers.jobs[1], scheduled)
+        self.assertEqual(scheduled.next_run, next_run)
+        self.assertEqual(scheduled.args[0].command, "log_status")
+
+    def test_timing_change_reschedules(self):
+        self.prepare(make_job(1))
+        scheduled = self.timers.jobs[1]
+        self.prepare(make_job(1, interval=10))
+        self.assertIsNot(self.timers.jobs[1], scheduled)
+        self.assertTrue(scheduled.cancelled)
+        self.assertEqual(self.timers.jobs[1].interval, 10)
+
+    def test_invalid_rows_are_skipped(self):
+        self.prepare(make_job(1), make_job(2))
+        self.prepare(make_job(1, interval=None), make_job(2, time_unit="fortnight"),
+                     make_job(3, time_unit=None), make_job(4))
+        self.assertEqual(sorted(self.scheduler.jobs), [4])
+        self.assertEqual(sorted(self.timers.jobs), [4])
+
+class ReloadScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        database = sqlite3.connect("hapi_core.db")
+        database.executescript('''
+            CREATE TABLE db_info (data_version text);
+            INSERT INTO db_info VALUES ('1');
+            CREATE TABLE schedule (id integer, name text, asset_id text, command text,
+                time_unit text, interval integer, at_time text, enabled integer,
+                sequence text, virtual integer, timeout real, overlap text);
+            INSERT INTO schedule VALUES (1, 'Log Data', '', 'log_data', 'minute', 5, '', 1,
+                '', 0, 0, 'skip');
+        ''')
+        database.close()
+        self.timers = JobScheduler()
+        self.scheduler = Scheduler(self.timers, workers=1)
+
+    def tearDown(self):
+        self.scheduler.executor.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_reloads_only_on_change(self):
+        self.assertTrue(self.scheduler.reload_schedule())
+        self.assertFalse(self.scheduler.reload_schedule())
+        self.assertEqual(sorted(self.timers.jobs), [1])
+
+    def test_watch_applies_the_schedule_on_the_timer_thread(self):
+        self.scheduler.watch_schedule(interval=60.0)
+        self.timers.run_pending(now=time.time() + 61)
+        deadline = time.time() + 5
+        while len(self.timers.heap) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.timers.heap), 2)
+        self.assertEqual(self.timers.jobs, {})
+        self.assertEqual(self.timers.run_pending(), 1)
+        self.assertEqual(sorted(self.timers.jobs), [1])
+
+    def test_superseded_schedule_is_not_applied(self):
+        changes = self.scheduler.read_schedule_changes()
+        database = sqlite3.connect("hapi_core.db")
+        database.execute("UPDATE db_info SET data_version='2';")
+        database.execute("UPDATE schedule SET interval=10;")
+        database.commit()
+        database.close()
+        self.assertTrue(self.scheduler.reload_schedule())
+        self.assertFalse(self.scheduler.apply_schedule(*changes))
+        self.assertEqual(self.timers.jobs[1].interval, 10)
+
+    def test_synchronize_replaces_core_db(self):
+        self.scheduler.reload_schedule()
+        dump = "\n".join(sqlite3.connect("hapi_core.db").iterdump())
+        dump = dump.replace("VALUES('1')", "VALUES('2')")
+        dump = dump.replace("'minute',5", "'minute',NULL")
+        dump += ("\nINSERT INTO schedule VALUES"
+                 "(2,'Log Status','','log_status','hour',1,'',1,'',0,0,'skip');")
+        self.assertTrue(DataSync().synchronize_core_db(dump))
+        self.assertFalse(os.path.exists("hapi_new.db"))
+        self.assertEqual(self.scheduler.read_data_version(), "2")
+        self.assertTrue(self.scheduler.reload_schedule())
+        self.assertEqual(sorted(self.timers.jobs), [2])
+
+    def test_failed_synchronize_keeps_core_db(self):
+        self.assertFalse(DataSync().synchronize_core_db("CREATE TABLE broken (;"))
+        self.assertFalse(os.path.exists("hapi_new.db"))
+        self.assertEqual(self.scheduler.read_data_version(), "1")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the timer-driven sequence engine.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import json
+import unittest
+from job_executor import SKIP, QUEUE, CANCEL
+from sequence import SequenceEngine, DONE, CANCELLED, FAILED
+
+class Timer(object):
+    def __init__(self, delay, func, args):
+        self.delay = delay
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class FakeTimers(object):
+    """A call_later() whose timers the test fires by hand."""
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, func, *args):
+        timer = Timer(delay, func, args)
+        self.timers.append(timer)
+        return timer
+
+    def fire(self):
+        """Fire the oldest timer that is not cancelled and return it."""
+        for timer in self.timers:
+            if not timer.cancelled:
+                self.timers.remove(timer)
+                timer.func(*timer.args)
+                return timer
+        return None
+
+class SequenceEngineTest(unittest.TestCase):
+    steps = [("open", "valve open", 5), ("close", "valve close", 10)]
+
+    def setUp(self):
+        self.timers = FakeTimers()
+        self.sent = []
+        self.engine = SequenceEngine(self.timers, lambda *args: self.sent.append(args),
+                                     ack_timeout=30.0)
+
+    def commands(self):
+        return [(topic, message) for topic, message in self.sent
+                if topic.startswith("COMMAND/")]
+
+    def states(self):
+        return [json.loads(message)["state"] for topic, message in self.sent
+                if topic.startswith("SEQUENCE/PROGRESS/")]
+
+    def test_steps_advance_on_their_timeouts(self):
+        run_id = self.engine.start("fill", "7", self.steps)
+        self.assertEqual(run_id, "fill-1")
+        self.assertEqual(self.commands(), [("COMMAND/7", "valve open")])
+        self.assertEqual(self.timers.fire().delay, 5.0)
+        self.assertEqual(self.commands()[-1], ("COMMAND/7", "valve close"))
+        self.assertEqual(self.timers.fire().delay, 10.0)
+        self.assertEqual(self.engine.active(), [])
+        self.assertEqual(self.states()[-1], DONE)
+
+    def test_ack_completes_a_waiting_step(self):
+        self.engine.require_ack = True
+        self.engine.start("fill", "7", self.steps)
+        self.timers.fire()
+        self.assertEqual(len(self.commands()), 1)
+        self.assertFalse(self.engine.acknowledge("8", "valve open"))
+        self.assertFalse(self.engine.acknowledge("7", "valve close"))
+        self.assertTrue(self.engine.acknowledge("7", "valve open"))
+        self.assertEqual(self.commands()[-1], ("COMMAND/7", "valve close"))
+        self.assertEqual(self.timers.fire().delay, 10.0)
+
+    def test_early_ack_advances_on_the_step_timeout(self):
+        self.engine.require_ack = True
+        self.engine.start("fill", "7", self.steps)
+        self.assertTrue(self.engine.acknowledge("7", "valve open"))
+        self.assertEqual(len(self.commands()), 1)
+        self.timers.fire()
+        self.assertEqual(self.commands()[-1], ("COMMAND/7", "valve close"))
+
+    def test_missing_ack_fails_the_run(self):
+        self.engine.require_ack = True
+        self.engine.start("fill", "7", self.steps)
+        self.timers.fire()
+        self.assertEqual(self.timers.fire().delay, 30.0)
+        self.assertEqual(self.engine.active(), [])
+        self.assertEqual(self.states()[-1], FAILED)
+        self.assertEqual(len(self.commands()), 1)
+
+    def test_cancel_stops_the_run_and_its_timer(self):
+        run_id = self.engine.start("fill", "7", self.steps)
+        self.assertEqual(self.engine.cancel(run_id), 1)
+        self.assertEqual(self.states()[-1], CANCELLED)
+        self.assertIsNone(self.timers.fire())
+        self.assertEqual(len(self.commands()), 1)
+        self.assertEqual(self.engine.cancel("fill"), 0)
+
+    def test_overlapping_run_is_skipped(self):
+        self.engine.start("fill", "7", self.steps)
+        self.assertIsNone(self.engine.start("fill", "7", self.steps, overlap=SKIP))
+        self.assertEqual(self.engine.active(), ["fill-1"])
+        self.assertEqual(self.engine.start("fill", "8", self.steps), "fill-2")
+
+    def test_overlapping_run_is_queued(self):
+        self.engine.start("fill", "7", self.steps)
+        self.assertIsNone(self.engine.start("fill", "7", [("drain", "drain", 1)],
+                                            overlap=QUEUE))
+        self.timers.fire()
+        self.timers.fire()
+        self.assertEqual(self.engine.active(), ["fill-2"])
+        self.assertEqual(self.commands()[-1], ("COMMAND/7", "drain"))
+
+    def test_overlapping_run_cancels_the_current_one(self):
+        self.engine.start("fill", "7", self.steps)
+        self.assertEqual(self.engine.start("fill", "7", self.steps, overlap=CANCEL), "fill-2")
+        self.assertEqual(self.engine.active(), ["fill-2"])
+        self.assertIn(CANCELLED, self.states())
+        self.assertEqual(self.timers.fire().args[0].id, "fill-2")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the SmartModule's batch handling and the Scheduler.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+import alert
+import payload
+import smart_module
+from history import SensorHistory
+from line_protocol import PointEncoder
+from utilities import SM_LOGGER
+
+class Recorder(object):
+    """Records calls to any method; keyword arguments are recorded by value."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append(
+            (name,) + args + tuple(value for _, value in sorted(kwargs.items())))
+
+class RulesCache(object):
+    def get_rules(self, asset_id):
+        return [{"rule_type": "slope", "rule_window": 7200.0, "rule_limit": 1.0,
+                 "message": "Rising"}]
+
+def make_module():
+    """Return a SmartModule with just what store_batch needs."""
+    module = smart_module.SmartModule.__new__(smart_module.SmartModule)
+    module.name = "Site"
+    module.asset = smart_module.Asset()
+    module.encoder = PointEncoder()
+    module.alerts = {}
+    module.alert_engine = Recorder()
+    module.writer = Recorder()
+    module.history = Recorder()
+    module.log = logging.getLogger(SM_LOGGER)
+    return module
+
+class AssetTest(unittest.TestCase):
+    def test_alert_follows_the_asset_id(self):
+        asset = smart_module.Asset()
+        asset.id = "HSM-WT123-MOCK"
+        self.assertEqual(asset.alert.alert_id, "HSM-WT123-MOCK")
+        self.assertIs(asset.alert, asset.alert)
+
+    def test_rules_fire_for_the_real_id(self):
+        saved_cache = alert.alert_params_cache
+        alert.alert_params_cache = RulesCache()
+        try:
+            module = make_module()
+            module.asset.id = "HSM-WT123-MOCK"
+            self.assertIs(module.alert_for("HSM-WT123-MOCK"), module.asset.alert)
+            fired = []
+            for hour, value in enumerate([20.0, 21.0, 22.0]):
+                fired.extend(module.asset.alert.check_rules(value, 1500000000.0 + 3600 * hour))
+        finally:
+            alert.alert_params_cache = saved_cache
+        self.assertEqual([entry[0] for entry in fired], ["HSM-WT123-MOCK"])
+
+class StoreBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_cache = alert.alert_params_cache
+        alert.alert_params_cache = RulesCache()
+        self.module = make_module()
+
+    def tearDown(self):
+        alert.alert_params_cache = self.saved_cache
+
+    def batch(self, values, timestamp=1500000000.0):
+        readings = [payload.Reading(u"doc0220", timestamp, u"C", payload.GOOD, values[0])]
+        for number, value in enumerate(values[1:]):
+            readings.append(payload.Reading(u"doc0220/probe%d" % number, timestamp, u"C",
+                                            payload.GOOD, value))
+        return payload.Batch(u"doc0220", u"Water Temperature", u"Water", readings, None)
+
+    def test_probes_are_separate_series(self):
+        self.module.store_batch(self.batch([20.0, 21.0, 22.0]))
+        (_, database, lines), = self.module.writer.calls
+        self.assertEqual(database, u"Water")
+        series = [line.rsplit(" ", 2)[0] for line in lines]
+        self.assertEqual(len(set(series)), 3)
+        self.assertEqual(series[0], u"Water,asset=Water\\ Temperature,site=Site")
+        self.assertEqual(series[1],
+                         u"Water,asset=Water\\ Temperature,probe=doc0220/probe0,site=Site")
+
+    def test_readings_go_to_alert_rules_but_not_history(self):
+        for second, value in enumerate([20.0, 21.0, 22.0]):
+            self.module.store_batch(self.batch([value, 5.0], 1500000000.0 + 3600 * second))
+        # The module hosting the asset keeps its history.
+        self.assertEqual(self.module.history.calls, [])
+        self.assertEqual(sorted(self.module.alerts), [u"doc0220", u"doc0220/probe0"])
+        recorded = [call[1] for call in self.module.alert_engine.calls if call[0] == "record"]
+        self.assertEqual(recorded, [[(u"doc0220", 22.0, 1500007200.0, "Rising")]])
+
+    def test_failed_and_non_finite_readings_are_skipped(self):
+        batch = self.batch([20.0, float("nan")])
+        batch.readings.append(payload.Reading(u"doc0220/x", 1500000000.0, u"C",
+                                              payload.FAILED, -1000.0))
+        self.module.store_batch(batch)
+        (_, _, lines), = self.module.writer.calls
+        self.assertEqual(len(lines), 1)
+
+class HistoryTest(unittest.TestCase):
+    """A module that isn't the Scheduler records its samples and answers for them."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.module = make_module()
+        self.module.asset.id = "doc0220"
+        self.module.asset.unit = "C"
+        self.module.scheduler = None
+        self.module.publish_mode = "query"
+        self.module.comm = Recorder()
+        self.module.history = SensorHistory(os.path.join(self.directory, "hapi_history.db"),
+                                            expire_interval=float("inf"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def responses(self):
+        return [(topic, json.loads(data)) for _, topic, data in self.module.comm.calls]
+
+    def test_samples_are_recorded_and_served(self):
+        for second in range(3):
+            self.module.on_sample(20.0 + second, 1500000000.0 + second)
+        self.module.send_history("doc0220", json.dumps(
+            {"start": 1500000000, "end": 1500000010, "page_size": 2, "request": 7}))
+        responses = self.responses()
+        self.assertEqual([topic for topic, _ in responses], ["HISTORY/RESPONSE/doc0220"] * 3)
+        self.assertEqual([len(page["points"]) for _, page in responses], [2, 1, 0])
+        self.assertEqual([page["last"] for _, page in responses], [False, False, True])
+        self.assertEqual(responses[0][1]["points"][0], [1500000000.0, 20.0])
+        self.assertEqual(set(page["request"] for _, page in responses), set([7]))
+
+    def test_only_the_owner_answers(self):
+        self.module.scheduler = object()
+        self.module.send_history("doc0999", json.dumps({"start": 0, "end": 1}))
+        self.assertEqual(self.module.comm.calls, [])
+
+    def test_bad_queries_are_rejected(self):
+        for query in ('{"page_size": 0, "request": 1}', '{"start": "soon"}', "not json"):
+            self.module.send_history("doc0220", query)
+        responses = self.responses()
+        self.assertEqual(len(responses), 3)
+        for _, page in responses:
+            self.assertTrue(page["last"])
+            self.assertEqual(page["points"], [])
+            self.assertIn("error", page)
+        self.assertEqual(responses[0][1]["request"], 1)
+
+class PublishBatchTest(unittest.TestCase):
+    def test_status_is_collected_off_the_sampler_thread(self):
+        module = make_module()
+        module.comm = Recorder()
+        module.comm.pool = Recorder()
+        module.sampler = Recorder()
+        module.sampler.probes = {}
+        module.batch_status_interval = 60.0
+        module.last_batch_status = 0
+        module.batch_status = None
+        module.batch_status_lock = smart_module.threading.Lock()
+        module.asset.value = 21.5
+        module.publish_batch(1500000000.0)
+        (_, func, _), = module.comm.pool.calls
+        self.assertEqual(func, module.collect_batch_status)
+        (_, topic, data), = module.comm.calls
+        self.assertIsNone(payload.decode_batch(data).status)
+
+        module.batch_status = smart_module.SystemStatus()
+        module.batch_status.boot = "2017-04-01 12:00:00"
+        module.publish_batch(1500000010.0)
+        self.assertEqual(len(module.comm.pool.calls), 1)
+        self.assertIsNotNone(payload.decode_batch(module.comm.calls[1][2]).status)
+        self.assertIsNone(module.batch_status)
+
+if __name__ == "__main__":
+    unittest.main()
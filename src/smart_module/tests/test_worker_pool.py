@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Tests for the handler worker pool and its overflow policies.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import threading
+import unittest
+from worker_pool import WorkerPool, BACKLOG, DROP_OLDEST, REJECT
+
+def task(name):
+    pass
+
+class WorkerPoolPolicyTest(unittest.TestCase):
+    """The pool is not started, so queued tasks stay put."""
+
+    def setUp(self):
+        self.pool = WorkerPool(max_queue=3, max_backlog=2)
+
+    def queued(self):
+        return [args[0] for _, _, args, _ in self.pool.queue]
+
+    def test_reject_when_full(self):
+        for name in "abc":
+            self.assertTrue(self.pool.submit(task, (name,), REJECT))
+        self.assertFalse(self.pool.submit(task, ("d",), REJECT))
+        self.assertEqual(self.queued(), ["a", "b", "c"])
+        self.assertEqual(self.pool.metrics()["rejected"], 1)
+
+    def test_drop_oldest_only_evicts_the_same_key(self):
+        self.pool.submit(task, ("data",), BACKLOG, "ASSET/RESPONSE/1")
+        self.pool.submit(task, ("query 1",), DROP_OLDEST, "ASSET/QUERY/1")
+        self.pool.submit(task, ("status",), DROP_OLDEST, "STATUS/QUERY")
+        self.assertTrue(self.pool.submit(task, ("query 2",), DROP_OLDEST, "ASSET/QUERY/1"))
+        self.assertEqual(self.queued(), ["data", "status", "query 2"])
+        self.assertEqual(self.pool.metrics()["dropped"], 1)
+
+    def test_drop_oldest_without_a_same_key_task_rejects(self):
+        for name in "abc":
+            self.pool.submit(task, (name,), BACKLOG, "ASSET/RESPONSE/1")
+        self.assertFalse(self.pool.submit(task, ("query",), DROP_OLDEST, "ASSET/QUERY/1"))
+        self.assertEqual(self.queued(), ["a", "b", "c"])
+
+    def test_backlog_never_waits_and_is_bounded(self):
+        started = time.time()
+        results = [self.pool.submit(task, (str(i),), BACKLOG) for i in range(6)]
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(results, [True] * 5 + [False])
+        self.assertEqual(self.pool.metrics()["max_depth"], 5)
+
+class WorkerPoolRunTest(unittest.TestCase):
+    def test_tasks_run_in_order_and_stop_drains_the_queue(self):
+        pool = WorkerPool(workers=1)
+        done = []
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        for i in range(5):
+            pool.submit(done.append, (i,))
+        pool.start()
+        gate.set()
+        pool.stop()
+        self.assertEqual(done, range(5))
+        metrics = pool.metrics()
+        self.assertEqual(metrics["completed"], 6)
+        self.assertEqual(metrics["depth"], 0)
+
+    def test_failures_are_counted(self):
+        pool = WorkerPool(workers=1)
+        pool.submit(lambda: 1 / 0)
+        pool.start()
+        pool.stop()
+        self.assertEqual(pool.metrics()["failed"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HAPI Smart Module v2.1.2
+Authors: Tyler Reed, Pedro Freitas
+Release: April 2017 Beta Milestone
+
+Bounded worker pool used to run message handlers off the MQTT network thread.
+
+Copyright 2016 Maya Culpa, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function
+import time
+import logging
+import threading
+from collections import deque
+from utilities import SM_LOGGER
+
+# What to do with a new task when the queue is full. submit() never waits,
+# so it is safe to call from the MQTT network thread.
+BACKLOG = "backlog"          # queue it anyway, up to max_backlog tasks over max_queue
+DROP_OLDEST = "drop-oldest"  # discard the oldest queued task with the same key
+REJECT = "reject"            # discard the new task
+
+class WorkerPool(object):
+    """Run tasks on 'workers' threads behind a queue of at most max_queue tasks.
+
+    Tasks run in submission order. A task's key (a topic, say) limits
+    DROP_OLDEST evictions to tasks with the same key, so a burst of one kind
+    of task can't evict another kind.
+    """
+
+    def __init__(self, workers=4, max_queue=256, max_backlog=1024, name="Worker"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_backlog = max_backlog
+        self.name = name
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.log = logging.getLogger(SM_LOGGER)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run, name="%s-%d" % (self.name, i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stop the workers once the queue has been drained."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, func, args=(), policy=BACKLOG, key=None):
+        """Queue func(*args). Return False if the task was rejected."""
+        with self.condition:
+            depth = len(self.queue)
+            if depth >= self.max_queue:
+                if policy == DROP_OLDEST and self.drop_oldest(key):
+                    pass
+                elif policy != BACKLOG or depth >= self.max_queue + self.max_backlog:
+                    self.rejected += 1
+                    return False
+            self.queue.append((time.time(), func, args, key))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.condition.notify_all()
+        return True
+
+    def drop_oldest(self, key):
+        """Remove the oldest queued task with 'key'; called with the condition held."""
+        for position, task in enumerate(self.queue):
+            if task[3] == key:
+                del self.queue[position]
+                self.dropped += 1
+                return True
+        return False
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                queued, func, args, _ = self.queue.popleft()
+                waited = time.time() - queued
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                self.condition.notify_all()
+            try:
+                func(*args)
+            except Exception, excpt:
+                with self.condition:
+                    self.failed += 1
+                self.log.exception("Error in worker task: %s", excpt)
+            with self.condition:
+                self.completed += 1
+
+    def metrics(self):
+        """Return queue depth, counters and wait times."""
+        with self.condition:
+            started = self.submitted - len(self.queue) - self.dropped
+            return {
+                "workers": self.workers,
+                "depth": len(self.queue),
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "wait_mean": self.wait_total / started if started else 0.0,
+                "wait_max": self.wait_max,
+            }